@@ -0,0 +1,53 @@
+__author__ = 'Adam Miller'
+import unittest
+import math
+
+import numpy as np
+import scipy.fftpack as fftp
+
+import pa_tools.constants as consts
+from pa_tools.directionlocalizer import DirectionLocalizer
+
+
+class DirectionLocalizerTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.sample_rate = 44100
+        self.dft_len = 512
+        self.mic_positions = np.array([[0, 0, 0],
+                                       [.1, 0, 0],
+                                       [0, .1, 0],
+                                       [0, 0, .1]])
+        self.loc = DirectionLocalizer(self.mic_positions, shift_n=61,
+                                      shift_max=15,
+                                      sample_rate=self.sample_rate)
+
+    def make_ffts(self, direction):
+        source = fftp.fft(np.random.randn(self.dft_len))
+        delays = -self.mic_positions.dot(direction) * self.sample_rate / \
+            consts.SPEED_OF_SOUND
+        k = np.fft.fftfreq(self.dft_len) * self.dft_len
+        return source * np.exp(-1j * 2 * math.pi * np.outer(delays, k) /
+                               self.dft_len)
+
+    def testPeaksMatchShiftedIfft(self):
+        ffts = self.make_ffts(np.array([.6, .8, 0]))
+        peaks = self.loc.get_peaks(ffts)
+        auto_corr = ffts[0, :].conjugate() * ffts[1:, :]
+        k = np.arange(self.dft_len)
+        for idx, tau in enumerate(peaks[0, :]):
+            shifted = auto_corr * np.exp(-1j * 2 * np.pi * k * tau / self.dft_len)
+            corr = np.real(fftp.ifft(shifted))
+            self.assertLess(np.max(np.abs(peaks[1:, idx] - corr[:, 0])),
+                            1e-6 * np.max(np.abs(corr)))
+
+    def testDirection(self):
+        direction = np.array([.36, .48, .8])
+        ffts = self.make_ffts(direction)
+        estimate = self.loc.get_direction_np(ffts)
+        self.assertLess(np.linalg.norm(estimate - direction), .1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,664 @@
+__author__ = 'Adam Miller'
+import unittest
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import pa_tools.constants as consts
+from pa_tools import distributionlocalizer
+from pa_tools.distributionlocalizer import DistributionLocalizer
+from pa_tools.observation import Observation
+from pa_tools.steeringgeometry import SteeringGeometry
+from syntheticsource import make_rffts
+
+
+class DistributionLocalizerTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.sample_rate = 44100
+        self.dft_len = 512
+        self.mic_positions = np.array([[.03, 0, 0],
+                                       [-.01, 0, 0],
+                                       [.01, 0, 0],
+                                       [-.03, 0, 0]])
+        self.n_theta = 40
+        self.loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                         dft_len=self.dft_len,
+                                         sample_rate=self.sample_rate,
+                                         n_theta=self.n_theta)
+        self.directions = self.loc.get_directions()
+
+    def testTdoaMatchesMcc(self):
+        for ind in [5, 17, 30]:
+            rffts = make_rffts(self.mic_positions, self.directions[:, ind],
+                               self.dft_len, self.sample_rate)
+            mcc, _ = self.loc.get_distribution_real(rffts, 'mcc')
+            tdoa, _ = self.loc.get_distribution_real(rffts, 'tdoa')
+            self.assertEqual(ind, np.argmax(mcc))
+            self.assertEqual(ind, np.argmax(tdoa))
+
+    def testTdoaLagLookup(self):
+        rffts = make_rffts(self.mic_positions, self.directions[:, 12],
+                           self.dft_len, self.sample_rate)
+        cutoff_index = self.loc._compute_cutoff_index()
+        cp_pairs = self.loc._get_crosspower_pairs(rffts[:, :cutoff_index])
+        cp_pairs /= (np.abs(cp_pairs) + consts.EPS)
+        # Real part of the frequency domain sums used by 'mcc'
+        shifted = cp_pairs[:, :, np.newaxis] * self.loc.get_geometry().get_shift_table('all_lp_pos')
+        exact = np.real(shifted[:, 0, :] + 2 * np.sum(shifted[:, 1:, :], axis=1))
+        corrs = self.loc.get_geometry().lookup_lags(self.loc._get_lag_correlations(cp_pairs))
+        self.assertLessEqual(np.max(np.abs(corrs - exact)),
+                             .01 * np.max(np.abs(exact)))
+
+    def testCoarseToFine2D(self):
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=10)
+        loc.PEAK_SEARCH = 'coarse_to_fine'
+        for theta in [.4, 1.234, 2.5]:
+            source = np.array([math.cos(theta), math.sin(theta), 0])
+            rffts = make_rffts(self.mic_positions, source,
+                               self.dft_len, self.sample_rate)
+            for method in ['gcc', 'mcc', 'tdoa']:
+                direction, distr, _ = loc.get_peak(rffts, method)
+                self.assertEqual(10, len(distr))
+                self.assertLess(abs(theta - math.atan2(direction[1],
+                                                       direction[0])), .03)
+
+    def testCoarseToFine3D(self):
+        R = .0375
+        mic_positions = np.array([[0, 0, .07]] + \
+            [[R * math.cos(a), R * math.sin(a), 0]
+             for a in np.arange(6) * math.pi / 3])
+        loc = DistributionLocalizer(mic_positions=mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=13, n_phi=4)
+        loc.PEAK_SEARCH = 'coarse_to_fine'
+        source = np.array([.3, -.5, .6])
+        source /= np.linalg.norm(source)
+        rffts = make_rffts(mic_positions, source, self.dft_len, self.sample_rate)
+        direction, _, _ = loc.get_peak(rffts, 'mcc')
+        grid_direction = loc.get_directions()[:, np.argmax(
+            loc.get_distribution_real(rffts, 'mcc')[0])]
+        self.assertLess(np.linalg.norm(direction - source),
+                        np.linalg.norm(grid_direction - source))
+        self.assertLess(np.linalg.norm(direction - source), .1)
+
+    def testInterpolatePeak(self):
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=19)
+        loc.PEAK_SEARCH = 'interpolate'
+        for theta in [.8, 1.234, 1.9]:
+            source = np.array([math.cos(theta), math.sin(theta), 0])
+            rffts = make_rffts(self.mic_positions, source,
+                               self.dft_len, self.sample_rate)
+            direction, distr, _ = loc.get_peak(rffts, 'mcc')
+            grid_theta = loc.get_spher_directions()[1, np.argmax(distr)]
+            est_theta = math.atan2(direction[1], direction[0])
+            self.assertLess(abs(theta - est_theta), abs(theta - grid_theta))
+            self.assertLess(abs(theta - est_theta), .03)
+
+    def testBlockShiftsMatchTables(self):
+        geometry = SteeringGeometry(self.mic_positions, self.dft_len,
+                                    self.sample_rate, self.n_theta)
+        geometry.SHIFT_TABLE_BUDGET = 0
+        geometry.SHIFT_BLOCK_BUDGET = 4096
+        block_loc = DistributionLocalizer(mic_positions=None, geometry=geometry,
+                                          dft_len=self.dft_len,
+                                          sample_rate=self.sample_rate)
+        rffts = make_rffts(self.mic_positions, self.directions[:, 8],
+                           self.dft_len, self.sample_rate)
+        for method in ['gcc', 'mcc', 'beam']:
+            distr, _ = self.loc.get_distribution_real(rffts, method)
+            block_distr, _ = block_loc.get_distribution_real(rffts, method)
+            self.assertListFloatEqual(distr / np.max(distr),
+                                      block_distr / np.max(block_distr))
+        self.assertEqual(0, len(geometry._shift_tables))
+
+    def testTableCache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            rffts = make_rffts(self.mic_positions, self.directions[:, 8],
+                               self.dft_len, self.sample_rate)
+            distr, _ = self.loc.get_distribution_real(rffts, 'mcc')
+            for i in range(2):
+                geometry = SteeringGeometry(self.mic_positions, self.dft_len,
+                                            self.sample_rate, self.n_theta)
+                geometry.TABLE_CACHE_DIR = cache_dir
+                cached_loc = DistributionLocalizer(mic_positions=None,
+                                                   geometry=geometry,
+                                                   dft_len=self.dft_len,
+                                                   sample_rate=self.sample_rate)
+                # The compiled kernel does not read the shift tables
+                cached_loc.USE_KERNEL = False
+                cached_distr, _ = cached_loc.get_distribution_real(rffts, 'mcc')
+                self.assertListFloatEqual(distr / np.max(distr),
+                                          cached_distr / np.max(cached_distr))
+                self.assertEqual(1, len(os.listdir(cache_dir)))
+            self.assertTrue(isinstance(geometry.get_shift_table('all_lp_pos'),
+                                       np.memmap))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def testSharedGeometry(self):
+        other = DistributionLocalizer(mic_positions=None,
+                                      geometry=self.loc.get_geometry(),
+                                      dft_len=self.dft_len,
+                                      sample_rate=self.sample_rate)
+        self.assertEqual(self.n_theta, other.get_directions().shape[1])
+        self.assertTrue(other._all_delays is self.loc._all_delays)
+        rffts = make_rffts(self.mic_positions, self.directions[:, 20],
+                           self.dft_len, self.sample_rate)
+        distr, _ = self.loc.get_distribution_real(rffts, 'mcc')
+        other_distr, _ = other.get_distribution_real(rffts, 'mcc')
+        self.assertListFloatEqual(distr, other_distr)
+        self.assertRaises(ValueError, DistributionLocalizer, None,
+                          geometry=self.loc.get_geometry(), dft_len=256,
+                          sample_rate=self.sample_rate)
+
+    def testShiftRecurrence(self):
+        geometry = self.loc.get_geometry()
+        delays = geometry.get_all_delays()
+        nn = np.hstack((np.arange(0, self.dft_len / 2),
+                        np.arange(-self.dft_len / 2, 0)))
+        for n_coeffs in [10, self.dft_len / 2 + 1, self.dft_len]:
+            shifts = geometry.get_shifts_from_delays(delays, n_coeffs)
+            expected = np.exp(-1j * 2 * math.pi * delays[:, np.newaxis, :] *
+                              nn[:n_coeffs, np.newaxis] / self.dft_len)
+            self.assertLessEqual(np.max(np.abs(shifts - expected)), 1e-5)
+
+    def testUniformGrids(self):
+        # Worst case angle between a direction on the hemisphere and the
+        # closest search direction
+        probes = np.random.randn(3, 2000)
+        probes[2, :] = np.abs(probes[2, :])
+        probes /= np.sqrt(np.sum(probes ** 2, axis=0))
+        def coverage(geometry):
+            dots = np.max(probes.T.dot(geometry.get_directions()), axis=1)
+            return np.max(np.arccos(np.clip(dots, -1, 1)))
+        lattice = SteeringGeometry(self.mic_positions, n_theta=13, n_phi=8)
+        lattice_coverage = coverage(lattice)
+        for grid in ['fibonacci', 'icosahedral']:
+            geometry = SteeringGeometry(self.mic_positions, n_theta=10,
+                                        n_phi=8, grid=grid)
+            directions = geometry.get_directions()
+            # Better coverage than the lattice, with fewer directions
+            self.assertLessEqual(80, geometry.get_n_directions())
+            self.assertLess(geometry.get_n_directions(),
+                            lattice.get_n_directions())
+            self.assertListFloatEqual(np.ones(directions.shape[1]),
+                                      np.sum(directions ** 2, axis=0))
+            self.assertLessEqual(-1e-6, np.min(directions[2, :]))
+            spher = geometry.get_spher_directions()
+            self.assertListFloatEqual(directions[0, :], np.sin(spher[2, :]) *
+                                      np.cos(spher[1, :]))
+            self.assertListFloatEqual(directions[2, :], np.cos(spher[2, :]))
+            self.assertLess(coverage(geometry), lattice_coverage)
+        self.assertEqual(100, SteeringGeometry(self.mic_positions, n_theta=10,
+            n_phi=10, grid='fibonacci').get_n_directions())
+        self.assertRaises(ValueError, SteeringGeometry, self.mic_positions,
+                          n_theta=10, grid='fibonacci')
+
+    def testUniformGridPeak(self):
+        R = .0375
+        mic_positions = np.array([[0, 0, .07]] + \
+            [[R * math.cos(a), R * math.sin(a), 0]
+             for a in np.arange(6) * math.pi / 3])
+        loc = DistributionLocalizer(mic_positions=mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=10, n_phi=10, grid='fibonacci')
+        source = np.array([.3, -.5, .6])
+        source /= np.linalg.norm(source)
+        rffts = make_rffts(mic_positions, source, self.dft_len, self.sample_rate)
+        for peak_search in ['grid', 'interpolate', 'coarse_to_fine']:
+            loc.PEAK_SEARCH = peak_search
+            direction, distr, _ = loc.get_peak(rffts, 'mcc')
+            self.assertEqual(100, len(distr))
+            self.assertLess(np.linalg.norm(direction - source), .15)
+        grid_error = np.linalg.norm(loc.get_directions()[:, np.argmax(distr)] - source)
+        self.assertLess(np.linalg.norm(direction - source), grid_error)
+        # Resampling onto the lattice
+        spher_grid = loc.to_spher_grid(loc.get_directions()[2, :])
+        lattice = loc.get_lattice_spher_directions()
+        self.assertEqual((10, 10), spher_grid.shape)
+        self.assertLess(np.max(np.abs(spher_grid.ravel() - np.cos(lattice[2, :]))),
+                        loc.get_geometry().get_grid_spacing())
+
+    def testNeighbourGraph(self):
+        geometry = self.loc.get_geometry()
+        neighbours = geometry.get_neighbours()
+        self.assertEqual((self.n_theta, 2), neighbours.shape)
+        self.assertEqual(set([4, 6]), set(neighbours[5, :]))
+        inds, n_inner = geometry.get_neighbourhood(5, 2)
+        self.assertEqual(3, n_inner)
+        self.assertEqual(set(range(3, 8)), set(inds))
+        # Repeated lattice directions at the pole are not neighbours
+        lattice = SteeringGeometry(self.mic_positions, n_theta=13, n_phi=4)
+        neighbours = lattice.get_neighbours()
+        self.assertTrue(np.all(neighbours[0, :] >= 13))
+        inds, n_inner = lattice.get_neighbourhood(20, 1)
+        self.assertEqual(1, n_inner)
+        self.assertEqual(1 + lattice.NEIGHBOURS, len(inds))
+
+    def testLocalSearch(self):
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=self.n_theta)
+        loc.LOCAL_SEARCH_HOPS = 3
+        loc.FULL_SCAN_INTERVAL = 100
+        for ind in [10, 11, 12, 12, 13, 14]:
+            rffts = make_rffts(self.mic_positions, self.directions[:, ind],
+                               self.dft_len, self.sample_rate)
+            direction, distr, _ = loc.get_peak(rffts, 'mcc')
+            full_distr, _ = self.loc.get_distribution_real(rffts, 'mcc')
+            self.assertEqual(np.argmax(full_distr), np.argmax(distr))
+            evaluated = distr > consts.EPS
+            self.assertListFloatEqual(full_distr[evaluated] / np.max(full_distr),
+                                      distr[evaluated] / np.max(full_distr))
+        # Only the neighbourhood was evaluated
+        self.assertEqual(7, np.sum(distr > consts.EPS))
+        self.assertEqual(5, loc._frames_since_scan)
+        # The source jumps away, so the local peak lies on the boundary
+        rffts = make_rffts(self.mic_positions, self.directions[:, 30],
+                           self.dft_len, self.sample_rate)
+        direction, distr, _ = loc.get_peak(rffts, 'mcc')
+        self.assertEqual(30, np.argmax(distr))
+        self.assertEqual(0, loc._frames_since_scan)
+        # Tracker prior
+        loc.set_search_prior(self.directions[:2, 5])
+        rffts = make_rffts(self.mic_positions, self.directions[:, 6],
+                           self.dft_len, self.sample_rate)
+        direction, distr, _ = loc.get_peak(rffts, 'tdoa')
+        self.assertEqual(6, np.argmax(distr))
+        self.assertEqual(1, loc._frames_since_scan)
+
+    def testSparseDistribution(self):
+        R = .0375
+        mic_positions = np.array([[0, 0, .07]] + \
+            [[R * math.cos(a), R * math.sin(a), 0]
+             for a in np.arange(6) * math.pi / 3])
+        geometry = SteeringGeometry(mic_positions, self.dft_len,
+                                    self.sample_rate, 25, 8)
+        geometry.SHIFT_TABLE_BUDGET = 0
+        geometry.SHIFT_BLOCK_BUDGET = 2 ** 16
+        loc = DistributionLocalizer(mic_positions=None, geometry=geometry,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate)
+        sources = [np.array([.6, .3, .7]), np.array([-.5, -.6, .4])]
+        rffts = sum([make_rffts(mic_positions, source / np.linalg.norm(source),
+                                self.dft_len, self.sample_rate)
+                     for source in sources])
+        for method in ['mcc', 'tdoa']:
+            distr, _ = loc.get_distribution_real(rffts, method)
+            inds, values, _ = loc.get_sparse_distribution(rffts, 4, method)
+            self.assertListFloatEqual(np.sort(distr)[::-1][:4], values, 1e-2)
+            self.assertListFloatEqual(distr[inds], values, 1e-2)
+        # Directions are evaluated in blocks, with or without the kernel
+        block_len = geometry.get_block_len('all_lp_pos')
+        for use_kernel in [True, False]:
+            loc.USE_KERNEL = use_kernel
+            blocks = list(loc._iter_search_blocks(loc._get_spectra(rffts), 'mcc'))
+            self.assertGreater(len(blocks), 1)
+            self.assertTrue(all([len(distr) <= block_len for _, distr in blocks]))
+            self.assertEqual(geometry.get_n_directions(),
+                             sum([len(distr) for _, distr in blocks]))
+        # Peaks from the two sources, not neighbours on the strongest lobe
+        loc.PEAK_SUPPRESSION_ANGLE = .5
+        inds, values, _ = loc.get_sparse_distribution(rffts, 2, 'mcc')
+        self.assertEqual(2, len(inds))
+        distr, _ = loc.get_distribution_real(rffts, 'mcc')
+        self.assertAlmostEqual(1, values[0] / np.max(distr), 4)
+        directions = loc.get_directions()[:, inds]
+        for source in sources:
+            source = source / np.linalg.norm(source)
+            self.assertGreater(np.max(directions.T.dot(source)), math.cos(.3))
+        # Same as suppressing peaks over the whole distribution
+        all_directions = loc.get_directions()
+        expected = []
+        for ind in np.argsort(-distr, kind='mergesort'):
+            if len(expected) == 4:
+                break
+            if np.all(all_directions[:, expected].T.dot(
+                    all_directions[:, ind]) < math.cos(.5)):
+                expected.append(ind)
+        inds, values, _ = loc.get_sparse_distribution(rffts, 4, 'mcc')
+        self.assertListEqual(expected, list(inds))
+
+    def testEnergyGate(self):
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=self.n_theta)
+        loc.ENERGY_GATE = True
+        n_bins = self.dft_len / 2 + 1
+        def noise(scale):
+            return scale * (np.random.randn(4, n_bins) +
+                            1j * np.random.randn(4, n_bins))
+        for i in range(10):
+            loc.get_distribution_real(noise(.01), 'mcc')
+            self.assertFalse(loc.is_active())
+        source = make_rffts(self.mic_positions, self.directions[:, 12],
+                            self.dft_len, self.sample_rate)
+        direction, distr, _ = loc.get_peak(source + noise(.01), 'mcc')
+        self.assertTrue(loc.is_active())
+        self.assertEqual(12, np.argmax(distr))
+        # Gated frames give the last active result
+        gated_direction, gated_distr, _ = loc.get_peak(noise(.01), 'mcc')
+        self.assertFalse(loc.is_active())
+        self.assertListFloatEqual(distr, gated_distr)
+        self.assertListFloatEqual(direction, gated_direction)
+        # Hysteresis: energy between the off and on ratios keeps the state
+        self.assertFalse(loc.gate_frame(noise(.01 * math.sqrt(3))))
+        self.assertTrue(loc.gate_frame(noise(.01 * math.sqrt(6))))
+        self.assertTrue(loc.gate_frame(noise(.01 * math.sqrt(3))))
+        self.assertFalse(loc.gate_frame(noise(.01)))
+        # The gate is updated once per Observation
+        obs = Observation(noise(.01 * math.sqrt(6)))
+        self.assertTrue(loc.gate_frame(obs))
+        noise_floor = loc._noise_floor
+        loc.get_distribution_real(obs, 'mcc')
+        loc.get_peak(obs, 'mcc')
+        self.assertTrue(loc.is_active())
+        self.assertEqual(noise_floor, loc._noise_floor)
+
+    def testBinSelection(self):
+        geometry = SteeringGeometry(self.mic_positions, self.dft_len,
+                                    self.sample_rate, self.n_theta)
+        geometry.SHIFT_TABLE_BUDGET = 0
+        block_loc = DistributionLocalizer(mic_positions=None, geometry=geometry,
+                                          dft_len=self.dft_len,
+                                          sample_rate=self.sample_rate)
+        n_bins = self.dft_len / 2 + 1
+        rumble = np.zeros((4, n_bins), dtype=complex)
+        rumble[:, 1:6] = 50 * make_rffts(self.mic_positions, self.directions[:, 30],
+                                         self.dft_len, self.sample_rate)[:, 1:6]
+        for loc in [self.loc, block_loc]:
+            loc.N_BINS = 20
+            for i in range(5):
+                loc.get_distribution_real(rumble, 'mcc')
+            rffts = rumble + make_rffts(self.mic_positions, self.directions[:, 12],
+                                        self.dft_len, self.sample_rate)
+            for method in ['gcc', 'mcc', 'beam', 'tdoa']:
+                distr, _ = loc.get_distribution_real(rffts, method)
+                bins = loc._bins
+                self.assertEqual(20, len(bins))
+                self.assertFalse(np.any((bins >= 1) & (bins < 6)))
+                # Same as zeroing the other bins
+                masked = np.zeros(rffts.shape, dtype=complex)
+                masked[:, bins] = rffts[:, bins]
+                loc.N_BINS = 0
+                expected, _ = loc.get_distribution_real(masked, method)
+                loc.N_BINS = 20
+                self.assertListFloatEqual(distr / np.max(expected),
+                                          expected / np.max(expected))
+                self.assertEqual(12, np.argmax(distr))
+
+    def testCpsd(self):
+        n_bins = self.dft_len / 2 + 1
+        hops = np.dstack([make_rffts(self.mic_positions, self.directions[:, 25],
+                                     self.dft_len, self.sample_rate) +
+                          2 * (np.random.randn(4, n_bins) +
+                               1j * np.random.randn(4, n_bins))
+                          for i in range(8)])
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=self.n_theta)
+        self.assertRaises(ValueError, loc.get_cpsd_peak)
+        # Without memory the estimates are those of the last hop
+        loc.CPSD_FORGETTING = 0
+        self.assertFalse(loc.update_cpsd(hops[:, :, 0]))
+        self.assertTrue(loc.update_cpsd(hops[:, :, 1:4]))
+        for method in ['gcc', 'mcc', 'beam', 'tdoa']:
+            direction, distr, energy = loc.get_cpsd_peak(method)
+            expected, expected_energy = self.loc.get_distribution_real(
+                hops[:, :, 3], method)
+            self.assertListFloatEqual(distr / np.max(expected),
+                                      expected / np.max(expected))
+            self.assertAlmostEqual(1, energy / expected_energy, 4)
+        self.assertFalse(loc.update_cpsd(hops[:, :, 4]))
+        # Averaging over hops
+        loc.CPSD_FORGETTING = .8
+        loc.update_cpsd(hops)
+        direction, distr, energy = loc.get_cpsd_peak('mcc')
+        self.assertEqual(25, np.argmax(distr))
+        self.assertListFloatEqual(self.directions[:, 25], direction)
+
+    def testBatch(self):
+        n_bins = self.dft_len / 2 + 1
+        frames = np.array([make_rffts(self.mic_positions, self.directions[:, i],
+                                      self.dft_len, self.sample_rate) +
+                           .5 * (np.random.randn(4, n_bins) +
+                                 1j * np.random.randn(4, n_bins))
+                           for i in range(0, 35, 5)])
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=self.n_theta)
+        # Groups of frames that do not divide the stack
+        loc.BATCH_FRAMES = 3
+        for method in ['gcc', 'mcc', 'beam', 'tdoa']:
+            distrs, energies = loc.get_distribution_batch(frames, method)
+            self.assertEqual((7, self.n_theta), distrs.shape)
+            for i in range(7):
+                expected, expected_energy = self.loc.get_distribution_real(
+                    frames[i], method)
+                self.assertListFloatEqual(distrs[i] / np.max(expected),
+                                          expected / np.max(expected))
+                self.assertAlmostEqual(1, energies[i] / expected_energy, 4)
+
+    def testPairSelection(self):
+        # Uniform linear array. Pairs with equal spacing are redundant
+        ula = np.array([[.02 * i, 0] for i in range(8)])
+        geometry = SteeringGeometry(ula, self.dft_len, self.sample_rate,
+                                    self.n_theta, max_pairs=28)
+        self.assertEqual(7, geometry.get_n_pairs())
+        self.assertListEqual([[0, i] for i in range(1, 8)],
+                             geometry.get_pairs().tolist())
+        self.assertRaises(ValueError, SteeringGeometry, ula, self.dft_len,
+                          self.sample_rate, self.n_theta, max_pairs=6)
+        # Circular array. Opposite pairs are redundant
+        R = .05
+        mic_positions = np.array([[R * math.cos(a), R * math.sin(a), 0]
+                                  for a in np.arange(8) * math.pi / 4])
+        for max_pairs, n_pairs in [(None, 28), (28, 16), (10, 10)]:
+            loc = DistributionLocalizer(mic_positions=mic_positions,
+                                        dft_len=self.dft_len,
+                                        sample_rate=self.sample_rate,
+                                        n_theta=60, max_pairs=max_pairs)
+            geometry = loc.get_geometry()
+            self.assertEqual(n_pairs, geometry.get_n_pairs())
+            self.assertListEqual([[0, i] for i in range(1, 8)],
+                                 geometry.get_pairs()[:7].tolist())
+            report = geometry.get_pair_report()
+            self.assertAlmostEqual(n_pairs / 28., report['cost'])
+            self.assertLessEqual(report['aperture'], 1)
+            for nested_bands in [False, True]:
+                loc.NESTED_BANDS = nested_bands
+                for ind in [3, 40]:
+                    rffts = make_rffts(mic_positions,
+                                       loc.get_directions()[:, ind],
+                                       self.dft_len, self.sample_rate)
+                    for method in ['gcc', 'mcc', 'beam', 'tdoa']:
+                        distr, _ = loc.get_distribution_real(rffts, method)
+                        self.assertEqual(ind, np.argmax(distr))
+        # Every bin below the cutoff is covered by some pair
+        self.assertTrue(np.all(np.any(geometry.get_pair_bands(), axis=0)))
+
+    def testObservation(self):
+        rffts = make_rffts(self.mic_positions, self.directions[:, 12],
+                           self.dft_len, self.sample_rate)
+        obs = Observation(rffts, 7)
+        self.assertEqual(7, obs.get_frame_id())
+        expected, expected_energy = self.loc.get_distribution_real(rffts, 'mcc')
+        distr, energy = self.loc.get_distribution_real(obs, 'mcc')
+        self.assertListFloatEqual(expected, distr)
+        self.assertEqual(expected_energy, energy)
+        # A localizer sharing the geometry reuses the work done for the frame
+        loc = DistributionLocalizer(mic_positions=None,
+                                    geometry=self.loc.get_geometry(),
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate)
+        def fail(*args):
+            raise AssertionError("Distribution computed twice")
+        loc._get_steered_distribution = fail
+        loc._get_spectra = fail
+        loc._get_energy = fail
+        distr, energy = loc.get_distribution_real(obs, 'mcc')
+        self.assertListFloatEqual(expected, distr)
+        direction, distr, energy = loc.get_peak(obs, 'mcc')
+        self.assertListFloatEqual(self.directions[:, 12], direction)
+        # Returned distributions are copies
+        distr[:] = 0
+        self.assertListFloatEqual(expected,
+                                  loc.get_distribution_real(obs, 'mcc')[0])
+        # One with other steering settings computes its own
+        band_loc = DistributionLocalizer(mic_positions=None,
+                                         geometry=self.loc.get_geometry(),
+                                         dft_len=self.dft_len,
+                                         sample_rate=self.sample_rate)
+        band_loc.N_BINS = 20
+        distr, _ = band_loc.get_distribution_real(obs, 'mcc')
+        band_expected, _ = band_loc.get_distribution_real(rffts, 'mcc')
+        self.assertListFloatEqual(band_expected, distr)
+        self.assertFalse(np.allclose(expected, distr))
+
+    def testSrpGridLikelihood(self):
+        rffts = make_rffts(self.mic_positions, self.directions[:, 12],
+                           self.dft_len, self.sample_rate)
+        spectra = self.loc._get_spectra(rffts)
+        theta = np.linspace(-math.pi, math.pi, 101)
+        directions = np.array([np.cos(theta), np.sin(theta),
+                               np.zeros(theta.shape)])
+        exact = self.loc._get_steered_distribution(spectra, 'beam', directions)
+        # The linear array cannot tell y from -y, so the 2d search space
+        # covers every direction
+        values, covered = self.loc.get_geometry().interpolate_distribution(
+            self.loc._get_steered_distribution(spectra, 'beam', None),
+            directions)
+        self.assertTrue(np.all(covered))
+        self.assertTrue(np.allclose(values, exact, rtol=.01))
+        likelihood = self.loc._get_srp_likelihood(rffts, directions)
+        self.loc.SRP_GRID_LIKELIHOOD = False
+        expected = self.loc._get_srp_likelihood(rffts, directions)
+        self.assertTrue(np.allclose(likelihood, expected, rtol=.02))
+        # Exact at the directions of the search space
+        expected = self.loc._get_srp_likelihood(rffts, self.directions)
+        self.loc.SRP_GRID_LIKELIHOOD = True
+        self.assertListFloatEqual(expected, self.loc._get_srp_likelihood(
+            rffts, self.directions))
+        # A planar array in 3d covers the lower hemisphere by symmetry. One
+        # out of the plane does not
+        for mic_positions, all_covered in [
+                (self.mic_positions + [[0, .01, 0], [0, 0, 0],
+                                       [0, -.02, 0], [0, .01, 0]], True),
+                (self.mic_positions + [[0, 0, .01], [0, 0, 0],
+                                       [0, 0, -.02], [0, 0, 0]], False)]:
+            geometry = SteeringGeometry(mic_positions, self.dft_len,
+                                        self.sample_rate, n_theta=37,
+                                        n_phi=19)
+            rffts = make_rffts(mic_positions, geometry.get_directions()[:, 300],
+                               self.dft_len, self.sample_rate)
+            loc = DistributionLocalizer(mic_positions=None, geometry=geometry,
+                                        dft_len=self.dft_len,
+                                        sample_rate=self.sample_rate)
+            spectra = loc._get_spectra(rffts)
+            directions = np.random.randn(3, 200)
+            directions /= np.sqrt(np.sum(directions ** 2, axis=0))
+            values, covered = geometry.interpolate_distribution(
+                loc._get_steered_distribution(spectra, 'beam', None),
+                directions)
+            exact = loc._get_steered_distribution(spectra, 'beam', directions)
+            if all_covered:
+                self.assertTrue(np.all(covered))
+            else:
+                self.assertListEqual(list(directions[2, :] >= 0), list(covered))
+            self.assertTrue(np.allclose(values[covered], exact[covered],
+                                        rtol=.02))
+            # Uncovered directions are steered to exactly
+            likelihood = loc._get_srp_likelihood(rffts, directions)
+            loc.SRP_GRID_LIKELIHOOD = False
+            expected = loc._get_srp_likelihood(rffts, directions)
+            self.assertTrue(np.allclose(likelihood, expected, rtol=.05))
+
+    def testInterpolateUniformGrid(self):
+        mic_positions = self.mic_positions + [[0, 0, .01], [0, 0, 0],
+                                              [0, 0, -.02], [0, 0, 0]]
+        directions = np.random.randn(3, 500)
+        directions[2, :] = np.abs(directions[2, :])
+        directions /= np.sqrt(np.sum(directions ** 2, axis=0))
+        for grid in ['fibonacci', 'icosahedral']:
+            geometry = SteeringGeometry(mic_positions, self.dft_len,
+                                        self.sample_rate, n_theta=20,
+                                        n_phi=10, grid=grid)
+            distr = np.random.rand(geometry.get_n_directions())
+            values, covered = geometry.interpolate_distribution(distr,
+                                                                directions)
+            self.assertTrue(np.all(covered))
+            # Same as weighting the nearest directions found by brute force
+            dots = geometry.get_directions().T.dot(directions)
+            inds = np.argsort(-dots, axis=0)[:geometry.RESAMPLE_NEIGHBOURS, :]
+            weights = 1. / np.arccos(np.clip(
+                dots[inds, np.arange(directions.shape[1])], -1, 1))
+            expected = np.sum(distr[inds] * weights, axis=0) / \
+                np.sum(weights, axis=0)
+            self.assertListFloatEqual(expected, values)
+
+    @unittest.skipIf(distributionlocalizer.steeringkernel is None,
+                     "steering kernel not built")
+    def testKernel(self):
+        n_bins = self.dft_len / 2 + 1
+        rffts = make_rffts(self.mic_positions, self.directions[:, 12],
+                           self.dft_len, self.sample_rate) + \
+            .5 * (np.random.randn(4, n_bins) + 1j * np.random.randn(4, n_bins))
+        loc = DistributionLocalizer(mic_positions=self.mic_positions,
+                                    dft_len=self.dft_len,
+                                    sample_rate=self.sample_rate,
+                                    n_theta=self.n_theta)
+        for n_bins in [0, 20]:
+            loc.N_BINS = n_bins
+            for method, args in [('gcc', ()), ('gcc', (1.5,)),
+                                 ('mcc', ()), ('beam', ())]:
+                loc.USE_KERNEL = True
+                distr, energy = loc.get_distribution_real(rffts, method, *args)
+                loc.USE_KERNEL = False
+                expected, energy = loc.get_distribution_real(rffts, method, *args)
+                self.assertListFloatEqual(distr / np.max(expected),
+                                          expected / np.max(expected))
+                self.assertEqual(consts.REAL_DTYPE, distr.dtype)
+                self.assertEqual(consts.REAL_DTYPE, expected.dtype)
+                # Directions off the search space
+                directions = self.directions[:, :5] * .5 + \
+                    self.directions[:, 1:6] * .5
+                loc.USE_KERNEL = True
+                distr = loc._get_steered_distribution(
+                    loc._get_spectra(rffts), method, directions, *args)
+                loc.USE_KERNEL = False
+                expected = loc._get_steered_distribution(
+                    loc._get_spectra(rffts), method, directions, *args)
+                self.assertListFloatEqual(distr / np.max(expected),
+                                          expected / np.max(expected))
+
+    def assertListFloatEqual(self, list1, list2, tol=1e-4):
+        if not len(list1) == len(list2):
+            raise AssertionError("Lists differ in lenght. Cannot be equal")
+        for i in range(len(list1)):
+            try:
+                self.assertLessEqual(abs(list1[i] - list2[i]), tol)
+            except AssertionError:
+                err_str = "Lists differ on element " + str(i) + ": " + \
+                          str(list1[i]) + " vs. " + str(list2[i])
+                raise AssertionError(err_str)
+
+    def tearDown(self):
+        pass
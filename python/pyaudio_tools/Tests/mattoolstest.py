@@ -190,6 +190,21 @@ class MatToolsTest(unittest.TestCase):
         vec = mat.to_float(vec)
         self.assertEquals(vec.dtype, np.float)
 
+    def testSpherToCartesian(self):
+        angles = np.array([[0, np.pi / 2, np.pi], [np.pi / 2, np.pi / 2, 0]])
+        dirs = mat.spher_to_cartesian(angles)
+        self.assertListFloatEqual([1, 0, 0], dirs[:, 0])
+        self.assertListFloatEqual([0, 1, 0], dirs[:, 1])
+        self.assertListFloatEqual([0, 0, 1], dirs[:, 2])
+        self.assertListFloatEqual([0, 1, 0],
+                                  mat.spher_to_cartesian([np.pi / 2, np.pi / 2]))
+
+    def testParabolicPeakOffset(self):
+        # Samples of -(x - .3)^2 at x = -1, 0, 1
+        self.assertAlmostEqual(.3, mat.parabolic_peak_offset(-1.69, -.09, -.49))
+        self.assertEquals(0, mat.parabolic_peak_offset(1, 1, 1))
+        self.assertEquals(.5, mat.parabolic_peak_offset(0, 1, 1))
+
     def assertListFloatEqual(self, list1, list2):
             if not len(list1) == len(list2):
                 raise AssertionError("Lists differ in lenght. Cannot be equal")
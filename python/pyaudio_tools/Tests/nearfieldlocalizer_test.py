@@ -0,0 +1,69 @@
+__author__ = 'Adam Miller'
+import unittest
+
+import numpy as np
+
+from pa_tools.nearfieldlocalizer import NearFieldLocalizer
+from searchspace import SourcePlane, OrientedSourcePlane
+from syntheticsource import make_point_source_rffts
+
+
+class NearFieldLocalizerTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.sample_rate = 44100
+        self.dft_len = 512
+        self.mic_positions = np.array([[0, 0, 0], [.4, 0, .05], [0, .4, .1],
+                                       [.4, .4, 0], [.2, .2, .3],
+                                       [.2, 0, .15], [0, .2, .2],
+                                       [.4, .2, .1]])
+        self.bounds = np.array([[-.5, -.5, 0], [1, 1, 1]])
+        self.source = np.array([.7, .3, .5])
+
+    def testPositionDelays(self):
+        loc = NearFieldLocalizer(self.mic_positions, self.bounds,
+                                 dft_len=self.dft_len,
+                                 sample_rate=self.sample_rate)
+        geometry = loc.get_geometry()
+        direction = np.array([.3, .4, .5])
+        direction /= np.linalg.norm(direction)
+        for all_pairs in [False, True]:
+            far = geometry.compute_delays(direction[:, np.newaxis], all_pairs)
+            near = geometry.compute_position_delays(
+                1e5 * direction[:, np.newaxis], all_pairs)
+            self.assertLess(np.max(np.abs(far - near)), 1e-3)
+
+    def testPosition(self):
+        loc = NearFieldLocalizer(self.mic_positions, self.bounds,
+                                 dft_len=self.dft_len,
+                                 sample_rate=self.sample_rate)
+        rffts = make_point_source_rffts(self.mic_positions, self.source,
+                                        self.dft_len, self.sample_rate)
+        for method in ['beam', 'mcc', 'gcc', 'tdoa']:
+            position, value, energy = loc.get_position(rffts, method)
+            self.assertLess(np.linalg.norm(position - self.source), .03)
+
+    def testPlanes(self):
+        planes = [SourcePlane(np.array([0, 0, 1.]), np.array([0, 0, .5])),
+                  OrientedSourcePlane(np.array([1., 0, 0]), np.array([0, 0, 1.]),
+                                      np.array([.7, 0, 0])),
+                  # Outside of the bounds
+                  SourcePlane(np.array([0, 0, 1.]), np.array([0, 0, 3.]))]
+        loc = NearFieldLocalizer(self.mic_positions, self.bounds, planes,
+                                 dft_len=self.dft_len,
+                                 sample_rate=self.sample_rate)
+        for source, axis, value in [(np.array([.6, .3, .5]), 2, .5),
+                                    (np.array([.7, .9, .2]), 0, .7)]:
+            rffts = make_point_source_rffts(self.mic_positions, source,
+                                            self.dft_len, self.sample_rate)
+            position, _, _ = loc.get_position(rffts)
+            self.assertAlmostEqual(value, position[axis])
+            self.assertLess(np.linalg.norm(position - source), .01)
+        self.assertRaises(ValueError, NearFieldLocalizer, self.mic_positions,
+                          self.bounds, planes[2:], dft_len=self.dft_len,
+                          sample_rate=self.sample_rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
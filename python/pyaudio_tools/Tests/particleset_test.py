@@ -0,0 +1,145 @@
+__author__ = 'Adam Miller'
+import unittest
+
+import numpy as np
+
+import pybayes as pb
+
+from pa_tools.particleset import ParticleSet, AngleParticleSet
+from pa_tools.vonmisescpdf import VonMisesCPdf
+
+
+class ParticleSetTest(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(3)
+    self.n = 1000
+    self.particles = np.random.randn(self.n, 3)
+    self.weights = np.random.rand(self.n) ** 4
+    self.weights /= np.sum(self.weights)
+
+  def testResampleIndices(self):
+    for method in ParticleSet.RESAMPLE_METHODS:
+      pset = ParticleSet(self.particles, self.weights)
+      inds = pset.get_resample_indices(method)
+      self.assertEquals(inds.shape, (self.n,))
+      self.assertTrue(np.all((inds >= 0) & (inds < self.n)))
+      # Each particle is copied about n * w_i times
+      counts = np.bincount(inds, minlength=self.n)
+      self.assertTrue(np.all(np.abs(counts - self.n * self.weights) < 5))
+      if method != 'stratified':
+        self.assertTrue(np.all(counts >= np.floor(self.n * self.weights)))
+
+  def testResampleSingleParticle(self):
+    weights = np.zeros((self.n,))
+    weights[7] = 1.
+    for method in ParticleSet.RESAMPLE_METHODS:
+      pset = ParticleSet(self.particles, weights)
+      pset.resample(method)
+      self.assertTrue(np.allclose(pset.particles, self.particles[7]))
+      self.assertTrue(np.allclose(pset.weights, 1. / self.n))
+
+  def testMean(self):
+    pset = ParticleSet(self.particles, self.weights)
+    self.assertTrue(np.allclose(pset.mean(),
+                                np.sum(self.weights[:, np.newaxis] *
+                                       self.particles, axis=0)))
+
+  def testNormaliseWeights(self):
+    pset = ParticleSet(self.particles, 3 * self.weights)
+    pset.normalise_weights()
+    self.assertTrue(np.allclose(pset.weights, self.weights))
+    pset.weights[:] = 0
+    self.assertRaises(ValueError, pset.normalise_weights)
+
+  def testReweight(self):
+    pset = ParticleSet(self.particles, self.weights)
+    lhood = np.random.rand(self.n)
+    pset.reweight(np.log(lhood))
+    expected = self.weights * lhood / np.sum(self.weights * lhood)
+    self.assertTrue(np.allclose(pset.weights, expected))
+    self.assertTrue(np.allclose(pset.log_weights, np.log(expected)))
+
+  def testReweightUnderflow(self):
+    # Likelihoods far below the smallest float keep their relative weights
+    pset = ParticleSet(self.particles)
+    log_lhood = -5000. - np.arange(self.n) / 10.
+    pset.reweight(log_lhood)
+    self.assertTrue(np.all(np.isfinite(pset.log_weights)))
+    self.assertAlmostEqual(pset.log_weights[0] - pset.log_weights[10], 1.)
+    self.assertAlmostEqual(np.sum(pset.weights), 1.)
+    # No particle with nonzero likelihood leaves the weights unchanged
+    weights = pset.weights.copy()
+    self.assertFalse(pset.reweight(-np.inf * np.ones((self.n,))))
+    self.assertTrue(np.allclose(pset.weights, weights))
+
+  def testEss(self):
+    pset = ParticleSet(self.particles)
+    self.assertAlmostEqual(pset.get_ess(), self.n)
+    pset.weights[:] = 0
+    pset.weights[:10] = 1
+    pset.normalise_weights()
+    self.assertAlmostEqual(pset.get_ess(), 10)
+
+  def testKldResample(self):
+    pset = ParticleSet(self.particles, self.weights)
+    # All particles in one bin need the fewest particles
+    inds = pset.get_kld_resample_indices(np.zeros((self.n,), dtype=int),
+                                         20, 5000)
+    self.assertEquals(inds.size, 20)
+    # Particles spread over many bins need more, up to the bound
+    bins = np.arange(self.n)
+    n_diffuse = pset.get_kld_resample_indices(bins, 20, 5000).size
+    self.assertGreater(n_diffuse, 1000)
+    self.assertEquals(pset.get_kld_resample_indices(bins, 20, 500).size, 500)
+    # The number of particles follows the indices
+    pset.resample(inds=inds)
+    self.assertEquals(pset.get_n_particles(), 20)
+    self.assertTrue(np.allclose(pset.particles, self.particles[inds]))
+    self.assertTrue(np.allclose(pset.weights, 1. / 20))
+
+  def testAngleBins(self):
+    width = np.pi / 8
+    vectors = self.particles / \
+      np.sqrt(np.sum(self.particles ** 2, axis=1))[:, np.newaxis]
+    bins = ParticleSet(vectors).get_angle_bins(width, width)
+    # Particles share a bin when they share both angle cells
+    theta = np.mod(np.arctan2(vectors[:, 1], vectors[:, 0]), 2 * np.pi)
+    phi = np.arccos(vectors[:, 2])
+    cells = np.floor(theta / width) + 100 * np.floor(phi / width)
+    for i in range(20):
+      self.assertTrue(np.all((bins == bins[i]) == (cells == cells[i])))
+    # Planar particles are binned by azimuthal angle
+    planar = vectors[:, :2] / \
+      np.sqrt(np.sum(vectors[:, :2] ** 2, axis=1))[:, np.newaxis]
+    bins = ParticleSet(planar).get_angle_bins(width)
+    self.assertTrue(np.all(bins == np.floor(theta / width)))
+    angle_bins = AngleParticleSet.from_vectors(planar).get_angle_bins(width)
+    self.assertTrue(np.mean(angle_bins == bins) > .99)
+
+  def testAngleParticleSet(self):
+    vectors = self.particles[:, :2]
+    vectors /= np.sqrt(np.sum(vectors ** 2, axis=1))[:, np.newaxis]
+    vector_set = ParticleSet(vectors, self.weights)
+    angle_set = AngleParticleSet.from_vectors(vectors, self.weights)
+    self.assertEquals(angle_set.angles.dtype, np.float32)
+    self.assertEquals(angle_set.get_n_particles(), self.n)
+    self.assertTrue(np.allclose(angle_set.particles, vectors, atol=1e-6))
+    self.assertTrue(np.allclose(angle_set.mean(), vector_set.mean(), atol=1e-6))
+    # Weighting matches that of the vectors
+    cpdf = VonMisesCPdf(10., pb.RV(pb.RVComp(2, 'y')), pb.RV(pb.RVComp(2, 'x')))
+    y = np.array([.6, .8])
+    self.assertTrue(np.allclose(angle_set.get_log_likelihoods(cpdf, y),
+                                vector_set.get_log_likelihoods(cpdf, y),
+                                atol=1e-5))
+    angle_set.propagate(cpdf)
+    self.assertEquals(angle_set.angles.dtype, np.float32)
+    inds = angle_set.get_resample_indices()
+    angles = angle_set.angles[inds]
+    angle_set.resample(inds=inds)
+    self.assertTrue(np.allclose(angle_set.angles, angles))
+    self.assertTrue(np.allclose(angle_set.weights, 1. / self.n))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,71 @@
+__author__ = 'Adam Miller'
+import unittest
+
+import numpy as np
+
+from pa_tools.distributionlocalizer import DistributionLocalizer
+from pa_tools.observation import Observation
+from pa_tools.srppftrackinglocalizer import SRPPFTrackingLocalizer
+from searchspace import SearchSpace, OrientedSourcePlane
+
+
+class SRPPFTrackingLocalizerTest(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(5)
+    plane = OrientedSourcePlane(np.array([0, -1, 0]), np.array([0, 0, 1]),
+                                np.array([0, 1, 0]))
+    self.space = SearchSpace(np.zeros(3), np.zeros(3), [plane],
+                             np.array([0, 1, 0]), np.array([0, 0, 1]))
+    self.mics = np.array([[.03, 0], [-.01, 0], [.01, 0], [-.03, 0]])
+    self.loc = SRPPFTrackingLocalizer(mic_positions=self.mics,
+                                      search_space=self.space,
+                                      n_particles=100, state_kappa=100,
+                                      dft_len=512, sample_rate=44100,
+                                      n_theta=20, n_phi=1)
+    self.rffts = np.random.randn(4, 257) + 1j * np.random.randn(4, 257)
+
+  def testSharedObservation(self):
+    # A localizer and the tracker sharing its geometry compute the spectra,
+    # energy and steered response of a frame once between them
+    loc = DistributionLocalizer(mic_positions=None,
+                                geometry=self.loc.get_geometry(),
+                                dft_len=512, sample_rate=44100)
+    obs = Observation(self.rffts, 0)
+    loc.get_distribution_real(obs, 'beam')
+    def fail(*args):
+      raise AssertionError("Frame computed twice")
+    self.loc._get_spectra = fail
+    self.loc._get_energy = fail
+    self.loc._iter_steered_distribution = fail
+    self.loc.get_distribution(obs)
+
+  def testGatedFrameUpdatesEstimate(self):
+    # A frame without energy does not pass the gate. The particles are still
+    # propagated, and the estimate follows them
+    self.loc.ENERGY_GATE = True
+    before = np.array(self.loc._posterior.particles)
+    self.loc.get_distribution(np.zeros((4, 257), dtype=complex))
+    self.assertFalse(np.allclose(before, self.loc._posterior.particles))
+    np.testing.assert_allclose(self.loc._estimate, self.loc._posterior.mean())
+
+  def testFlatLikelihood(self):
+    # Every particle keeps a finite weight, and a flat srp leaves them uniform
+    self.loc._get_srp_likelihood = lambda rffts, dirs: np.ones(dirs.shape[1])
+    self.assertTrue(self.loc._doa_bayes(self.rffts))
+    self.assertTrue(np.all(np.isfinite(self.loc._posterior.log_weights)))
+    np.testing.assert_allclose(self.loc._posterior.weights, 1. / 100)
+
+  def testUnusableLikelihood(self):
+    # The prediction is kept and the estimate is left as it was
+    self.loc._get_srp_likelihood = \
+      lambda rffts, dirs: np.nan * np.ones(dirs.shape[1])
+    weights = np.array(self.loc._posterior.weights)
+    estimate = np.array(self.loc._estimate)
+    self.assertFalse(self.loc._doa_bayes(self.rffts))
+    np.testing.assert_allclose(self.loc._posterior.weights, weights)
+    np.testing.assert_allclose(self.loc._estimate, estimate)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,36 @@
+__author__ = 'Adam Miller'
+import math
+
+import numpy as np
+
+import pa_tools.constants as consts
+
+
+def make_rffts(mic_positions, direction, dft_len, sample_rate):
+    """
+    Create the positive half DFTs of a far field broadband source arriving
+    from the given direction at each microphone
+    """
+    delays = -mic_positions.dot(direction) * sample_rate / consts.SPEED_OF_SOUND
+    return _make_delayed_rffts(delays, dft_len)
+
+
+def make_point_source_rffts(mic_positions, position, dft_len, sample_rate):
+    """
+    Create the positive half DFTs of a broadband point source at the given
+    position at each microphone
+    """
+    delays = np.sqrt(np.sum((mic_positions - position) ** 2, axis=1)) * \
+        sample_rate / consts.SPEED_OF_SOUND
+    return _make_delayed_rffts(delays, dft_len)
+
+
+def _make_delayed_rffts(delays, dft_len):
+    """
+    Create the positive half DFTs of one white noise source delayed by the
+    given number of samples at each microphone
+    """
+    n_bins = dft_len / 2 + 1
+    source = np.fft.rfft(np.random.randn(dft_len))
+    k = np.arange(n_bins)
+    return source * np.exp(-1j * 2 * math.pi * np.outer(delays, k) / dft_len)
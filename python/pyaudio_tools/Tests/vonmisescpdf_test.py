@@ -0,0 +1,67 @@
+__author__ = 'Adam Miller'
+import unittest
+
+import numpy as np
+import pybayes as pb
+
+from pa_tools.vonmisescpdf import VonMisesCPdf
+
+
+class VonMisesCPdfTest(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(2)
+    self.kappa = 20.
+
+  def make_pdf(self, ndim):
+    return VonMisesCPdf(self.kappa, pb.RV(pb.RVComp(ndim, 'x')),
+                        pb.RV(pb.RVComp(ndim, 'mu')))
+
+  def make_conds(self, n, ndim):
+    conds = np.random.randn(n, ndim)
+    return conds / np.sqrt(np.sum(conds ** 2, axis=1))[:, np.newaxis]
+
+  def testEvalLogBatch(self):
+    for ndim in [2, 3]:
+      pdf = self.make_pdf(ndim)
+      conds = self.make_conds(50, ndim)
+      x = self.make_conds(50, ndim)
+      batch = pdf.eval_log_batch(x, conds)
+      for i in range(x.shape[0]):
+        self.assertAlmostEqual(batch[i], pdf.eval_log(x[i], conds[i]))
+      # A single condition is used for every point
+      batch = pdf.eval_log_batch(x, conds[0])
+      for i in range(x.shape[0]):
+        self.assertAlmostEqual(batch[i], pdf.eval_log(x[i], conds[0]))
+
+  def testSamplesBatch(self):
+    n = 20000
+    for ndim in [2, 3]:
+      pdf = self.make_pdf(ndim)
+      conds = self.make_conds(3, ndim)
+      samples = pdf.samples_batch(np.repeat(conds, n, axis=0))
+      self.assertEquals(samples.shape, (3 * n, ndim))
+      self.assertTrue(np.allclose(np.sum(samples ** 2, axis=1), 1))
+      # Mean resultant of each condition's samples should point along it,
+      # and match that of samples drawn one condition at a time
+      for i in range(3):
+        mean = np.mean(samples[i * n:(i + 1) * n], axis=0)
+        expected = np.mean(pdf.samples(n, conds[i].copy()), axis=0)
+        self.assertTrue(np.allclose(mean, expected, atol=.01))
+        self.assertTrue(np.allclose(mean / np.linalg.norm(mean), conds[i],
+                                    atol=.01))
+
+  def testSamplesBatchAtReference(self):
+    pdf = self.make_pdf(3)
+    conds = np.array([[1., 0, 0], [-1., 0, 0]])
+    samples = pdf.samples_batch(np.repeat(conds, 5000, axis=0))
+    self.assertGreater(np.mean(samples[:5000, 0]), .9)
+    self.assertLess(np.mean(samples[5000:, 0]), -.9)
+
+  def testSamplesBatchZeroCond(self):
+    pdf = self.make_pdf(3)
+    self.assertRaises(ValueError, pdf.samples_batch, np.zeros((2, 3)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+__author__ = 'Adam Miller'
+import unittest
+
+import numpy as np
+
+from pa_tools.vonmisestrackinglocalizer import VonMisesTrackingLocalizer
+from searchspace import SearchSpace, OrientedSourcePlane
+
+
+class VonMisesTrackingLocalizerTest(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(4)
+    plane = OrientedSourcePlane(np.array([0, -1, 0]), np.array([0, 0, 1]),
+                                np.array([0, 1, 0]))
+    self.space = SearchSpace(np.zeros(3), np.zeros(3), [plane],
+                             np.array([0, 1, 0]), np.array([0, 0, 1]))
+    self.mics = np.array([[.03, 0], [-.01, 0], [.01, 0], [-.03, 0]])
+    self.loc = VonMisesTrackingLocalizer(mic_positions=self.mics,
+                                         search_space=self.space,
+                                         n_particles=200,
+                                         state_kappa=100,
+                                         observation_kappa=5,
+                                         outlier_prob=.3, dft_len=512,
+                                         sample_rate=44100, n_theta=20,
+                                         n_phi=1)
+
+  def testWeightedBayesWithoutResampling(self):
+    loc = self.loc
+    loc.RESAMPLE_ESS_FRACTION = 0  # Never resample
+    yt = np.array([.6, .8])
+    for i in range(3):
+      loc._weighted_bayes(yt)
+    # Particle weights are far from uniform, as no frame resampled
+    self.assertLess(loc._posterior.get_ess(), 190)
+    prior_weights = loc._posterior.weights.copy()
+    # Joint weights hold p(c_t, x_t|y_1:t), so summing over classes gives
+    # the particle weights and over particles the class weights
+    loc._weighted_bayes(yt)
+    joint = loc.get_joint_weights()
+    self.assertTrue(np.allclose(np.sum(joint, axis=0), loc._posterior.weights))
+    self.assertTrue(np.allclose(np.sum(joint, axis=1), loc.get_class_weights()))
+    # Class weights come from the fixed class prior and the prior particle
+    # weights, not from the class weights of the last frame
+    state_lhood = np.exp(loc._posterior.get_log_likelihoods(
+      loc._obs_distribution, yt))
+    outlier_lhood = np.exp(loc._outlier_distribution.eval_log(yt))
+    state = .5 * (1 - loc._outlier_prob) * state_lhood.dot(prior_weights)
+    outlier = .5 * loc._outlier_prob * outlier_lhood
+    self.assertAlmostEqual(loc.get_class_weights()[0],
+                           state / (state + outlier))
+
+  def testAdaptiveParticlesResampleOnLowEss(self):
+    loc = VonMisesTrackingLocalizer(mic_positions=self.mics,
+                                    search_space=self.space,
+                                    n_particles=50, max_particles=500,
+                                    state_kappa=100, observation_kappa=5,
+                                    dft_len=512, sample_rate=44100,
+                                    n_theta=20, n_phi=1)
+    yt = np.array([.6, .8])
+    # Particles are only resampled, and their number adapted, once the ESS
+    # falls below the threshold
+    loc.RESAMPLE_ESS_FRACTION = 0
+    for i in range(3):
+      loc._bayes(yt)
+    self.assertEquals(loc.get_n_particles(), 500)
+    loc.RESAMPLE_ESS_FRACTION = 1
+    loc._bayes(yt)
+    self.assertLess(loc.get_n_particles(), 500)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -15,6 +15,7 @@ from pa_tools.audiohelper import AudioHelper
 from pa_tools.audiobuffer import AudioBuffer
 from pa_tools.stftmanager import StftManager
 from pa_tools.kalmantrackinglocalizer import KalmanTrackingLocalizer
+from pa_tools.observation import Observation
 from pa_tools.beamformer import BeamFormer
 from searchspace import SearchSpace
 from searchspace import OrientedSourcePlane
@@ -307,8 +308,10 @@ def localize():
                 # Process dfts from windowed segments of input
                 dfts = stft.getDFTs()
                 rffts = mat.to_all_real_matlab_format(dfts)
-                d, energy = localizer.get_distribution_real(rffts[:, :, 0], 'gcc') # Use first hop
-                post = localizer.get_distribution(rffts[:, :, 0])
+                # Localize once and share the result with the tracker
+                obs = Observation(rffts[:, :, 0], count) # Use first hop
+                d, energy = localizer.get_distribution_real(obs, 'gcc')
+                post = localizer.get_distribution(obs)
                 ind = np.argmax(post)
                 u = 1.5 * direcs[:, ind]  # Direction of arrival
                 #if energy < 500:
@@ -16,6 +16,7 @@ from pa_tools.audiobuffer import AudioBuffer
 from pa_tools.commandlistener import CommandListener
 from pa_tools.stftmanager import StftManager
 from pa_tools.kalmantrackinglocalizer import KalmanTrackingLocalizer
+from pa_tools.observation import Observation
 from pa_tools.gridtrackinglocalizer import GridTrackingLocalizer
 from pa_tools.beamformer import BeamFormer
 from plottools.filterplot import FilterPlot
@@ -368,11 +369,13 @@ def localize():
                 #    d, energy = localizer.get_distribution_real(
                 #            rffts[:, :, 0], 'mcc', k) # Use first hop
                 #    gccs.append(d)
-                d, energy = localizer.get_distribution_real(rffts[:, :, 0], 'beam') # Use first hop
+                # Localize once and share the result with the tracker
+                obs = Observation(rffts[:, :, 0], count) # Use first hop
+                d, energy = localizer.get_distribution_real(obs, 'beam')
                 def w(cpmat):
                     cpmat /= (np.abs(cpmat + consts.EPS))
                     return cpmat
-                post = localizer.get_distribution(rffts[:, :, 0], 'beam')
+                post = localizer.get_distribution(obs, 'beam')
                 #post, bla = localizer.get_distribution_real(rffts[:, :, 0], 'mcc')
 
                 #post = localizer.get_distribution(rffts[:, :, 0])
@@ -2,6 +2,7 @@ __author__ = 'adamjmiller'
 import wave
 import struct
 import threading
+import time
 import math
 import cv2
 
@@ -17,6 +18,7 @@ from pa_tools.audiobuffer import AudioBuffer
 from pa_tools.commandlistener import CommandListener
 from pa_tools.stftmanager import StftManager
 from pa_tools.srppftrackinglocalizer import SRPPFTrackingLocalizer
+from pa_tools.observation import Observation
 from pa_tools.beamformer import BeamFormer
 from searchspace import SearchSpace
 from searchspace import OrientedSourcePlane
@@ -65,6 +67,10 @@ STATE_KAPPA = 100
 OUTLIER_PROB = .9
 OBS_KAPPA = 5
 N_PARTICLES = 30
+# Adapt the number of particles of the first tracker up to MAX_PARTICLES.
+# None keeps N_PARTICLES. See ParticleTrackingLocalizer
+MAX_PARTICLES = None
+PRINT_PARTICLE_COUNTS = False  # Print the particles and time of each frame
 
 # Setup printing
 np.set_printoptions(precision=4, suppress=True)
@@ -300,6 +306,7 @@ def localize():
     localizer = SRPPFTrackingLocalizer(mic_positions=mic_layout,
                                       search_space=space,
                                       n_particles=N_PARTICLES,
+                                      max_particles=MAX_PARTICLES,
                                       state_kappa=STATE_KAPPA,
                                       dft_len=FFT_LENGTH,
                                       sample_rate=SAMPLE_RATE,
@@ -424,8 +431,15 @@ def localize():
                 # Process dfts from windowed segments of input
                 dfts = stft.getDFTs()
                 rffts = mat.to_all_real_matlab_format(dfts)
-                d, energy = localizer.get_distribution_real(rffts[:, :, 0], 'gcc') # Use first hop
-                post = localizer.get_distribution(rffts[:, :, 0])
+                # Localize once and share the result with the tracker
+                obs = Observation(rffts[:, :, 0], count) # Use first hop
+                d, energy = localizer.get_distribution_real(obs, 'gcc')
+                start_time = time.time()
+                post = localizer.get_distribution(obs)
+                if PRINT_PARTICLE_COUNTS:
+                    print "Frame %d: %d particles, %.2f ms" % \
+                        (count, localizer.get_n_particles(),
+                         (time.time() - start_time) * 1000)
                 w = np.asarray(post.weights)
                 ps = np.asarray(post.particles)
                 ps[:, 1] = np.abs(ps[:, 1]) # Ensure remain positive
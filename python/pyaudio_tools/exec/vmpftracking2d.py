@@ -2,6 +2,7 @@ __author__ = 'adamjmiller'
 import wave
 import struct
 import threading
+import time
 import math
 import cv2
 
@@ -17,6 +18,7 @@ from pa_tools.audiobuffer import AudioBuffer
 from pa_tools.commandlistener import CommandListener
 from pa_tools.stftmanager import StftManager
 from pa_tools.vonmisestrackinglocalizer import VonMisesTrackingLocalizer
+from pa_tools.observation import Observation
 from pa_tools.beamformer import BeamFormer
 from searchspace import SearchSpace
 from searchspace import OrientedSourcePlane
@@ -65,6 +67,10 @@ STATE_KAPPA = 100
 OUTLIER_PROB = .9
 OBS_KAPPA = 5
 N_PARTICLES = 30
+# Adapt the number of particles of the first tracker up to MAX_PARTICLES.
+# None keeps N_PARTICLES. See ParticleTrackingLocalizer
+MAX_PARTICLES = None
+PRINT_PARTICLE_COUNTS = False  # Print the particles and time of each frame
 
 # Setup printing
 np.set_printoptions(precision=4, suppress=True)
@@ -300,6 +306,7 @@ def localize():
     localizer = VonMisesTrackingLocalizer(mic_positions=mic_layout,
                                       search_space=space,
                                       n_particles=N_PARTICLES,
+                                      max_particles=MAX_PARTICLES,
                                       state_kappa=STATE_KAPPA,
                                       observation_kappa=OBS_KAPPA,
                                       outlier_prob=0,
@@ -307,6 +314,7 @@ def localize():
                                       sample_rate=SAMPLE_RATE,
                                       n_theta=N_THETA,
                                       n_phi=N_PHI)
+    # Share mic layout, search space and steering tables between trackers
     localizer2 = VonMisesTrackingLocalizer(mic_positions=mic_layout,
                                       search_space=space,
                                       n_particles=N_PARTICLES,
@@ -315,8 +323,7 @@ def localize():
                                       outlier_prob=.3,
                                       dft_len=FFT_LENGTH,
                                       sample_rate=SAMPLE_RATE,
-                                      n_theta=N_THETA,
-                                      n_phi=N_PHI)
+                                      geometry=localizer.get_geometry())
     localizer3 = VonMisesTrackingLocalizer(mic_positions=mic_layout,
                                       search_space=space,
                                       n_particles=N_PARTICLES,
@@ -325,8 +332,7 @@ def localize():
                                       outlier_prob=.6,
                                       dft_len=FFT_LENGTH,
                                       sample_rate=SAMPLE_RATE,
-                                      n_theta=N_THETA,
-                                      n_phi=N_PHI)
+                                      geometry=localizer.get_geometry())
     beamformer = BeamFormer(mic_layout, SAMPLE_RATE)
 
     # Setup STFT object
@@ -457,11 +463,18 @@ def localize():
                 # Process dfts from windowed segments of input
                 dfts = stft.getDFTs()
                 rffts = mat.to_all_real_matlab_format(dfts)
-                d, energy = localizer.get_distribution_real(rffts[:, :, 0], 'gcc') # Use first hop
-                post = localizer.get_distribution(rffts[:, :, 0])
+                # Localize once and share the result between the trackers
+                obs = Observation(rffts[:, :, 0], count) # Use first hop
+                d, energy = localizer.get_distribution_real(obs, 'gcc')
+                start_time = time.time()
+                post = localizer.get_distribution(obs)
+                if PRINT_PARTICLE_COUNTS:
+                    print "Frame %d: %d particles, %.2f ms" % \
+                        (count, localizer.get_n_particles(),
+                         (time.time() - start_time) * 1000)
                 joint_w = localizer.get_joint_weights()
-                post2 = localizer2.get_distribution(rffts[:, :, 0])
-                post3 = localizer3.get_distribution(rffts[:, :, 0])
+                post2 = localizer2.get_distribution(obs)
+                post3 = localizer3.get_distribution(obs)
                 w = np.asarray(post.weights)
                 ps = np.asarray(post.particles)
                 ps[:, 1] = np.abs(ps[:, 1])  # Since we have ambiguity about side of array
@@ -278,6 +278,51 @@ def norm2(vec):
     vec = check_vec(vec)
     return (float(np.sum(vec ** 2))) ** .5
 
+def spher_to_cartesian(angles):
+    """
+    Convert directions in spherical coordinates to unit vectors
+    :param angles: matrix where row 0 is the azimuthal angle and row 1 is
+                   the polar angle of each direction, or a length 2 vector
+                   for a single direction
+    :returns: matrix of unit vectors, one per column, or a length 3 vector
+              if a single direction was given
+    """
+    theta = angles[0]
+    phi = angles[1]
+    return np.array([np.sin(phi) * np.cos(theta),
+                     np.sin(phi) * np.sin(theta),
+                     np.cos(phi)])
+
+
+def cartesian_to_spher(directions):
+    """
+    Convert unit vectors to spherical coordinates. Inverse of
+    spher_to_cartesian
+    :param directions: matrix of unit vectors, one per column, or a length
+                       3 vector for a single direction
+    :returns: matrix where row 0 is the azimuthal angle in [0, 2pi) and row
+              1 is the polar angle of each direction, or a length 2 vector
+              if a single direction was given
+    """
+    theta = np.mod(np.arctan2(directions[1], directions[0]), 2 * np.pi)
+    phi = np.arccos(np.clip(directions[2], -1, 1))
+    return np.array([theta, phi])
+
+
+def parabolic_peak_offset(y_minus, y_0, y_plus):
+    """
+    Fit a parabola through three equally spaced samples and return the
+    location of its vertex relative to the middle sample, in units of the
+    sample spacing. The middle sample is assumed to be the largest, so the
+    offset is limited to [-.5, .5]
+    """
+    denom = y_minus - 2 * y_0 + y_plus
+    if denom >= 0:  # Not a maximum
+        return 0.
+    offset = .5 * (y_minus - y_plus) / denom
+    return float(np.clip(offset, -.5, .5))
+
+
 def gauss_pdf(x, mu, cov):
     scaled = np.linalg.solve(cov, x-mu)
     return 1. / np.sqrt((2*np.pi)**2 * np.linalg.det(cov)) * \
@@ -2,7 +2,6 @@ from mattools import mattools as mat
 
 __author__ = 'Adam Miller'
 from pa_tools.audiolocalizer import AudioLocalizer
-import scipy.fftpack as fftp
 import numpy as np
 import math
 import sys
@@ -31,6 +30,8 @@ class DirectionLocalizer(AudioLocalizer):
             self._setup_distances()
         self._shift_n = shift_n + (1 - (shift_n % 2))  # Use odd number so zero shift possible
         self._shift_max = shift_max
+        self._taus = np.linspace(-self._shift_max, self._shift_max, self._shift_n)
+        self._steering_mat = None  # Built for the DFT length of the first frame
 
     def get_peaks(self, ffts):
         """
@@ -45,19 +46,26 @@ class DirectionLocalizer(AudioLocalizer):
             # Auto correlation in frequency (unshifted)
         auto_corr = ffts[0, :].conjugate() * ffts[1:, :]
 
-        # Discrete freq domain
-        k = np.arange(dft_len, dtype=consts.REAL_DTYPE)
-        # Shifts
-        taus = np.linspace(-self._shift_max, self._shift_max, self._shift_n)
         # Will hold values at t=0 of transformed autocorr
         peaks = np.zeros((num_chan, self._shift_n))
-        for idx, tau in enumerate(taus):
-            shifted = auto_corr * np.exp(-1j * 2 * np.pi * k * tau / dft_len)
-            corr = np.real(fftp.ifft(shifted))
-            peaks[0, idx] = tau  # Store shift amount in first row
-            peaks[1:, idx] = corr[:, 0]  # Check value at t = 0. Searching for delta
+        peaks[0, :] = self._taus  # Store shift amount in first row
+        # The value at t = 0 of the ifft of the shifted autocorr is the mean
+        # of its coefficients, so every shift is evaluated by one product
+        peaks[1:, :] = np.real(auto_corr.dot(self._get_steering_mat(dft_len)))
         return peaks
 
+    def _get_steering_mat(self, dft_len):
+        """
+        Get the matrix whose column i shifts a DFT of length dft_len by the
+        ith shift and averages its coefficients
+        """
+        if self._steering_mat is None or self._steering_mat.shape[0] != dft_len:
+            # Discrete freq domain
+            k = np.arange(dft_len, dtype=consts.REAL_DTYPE)
+            self._steering_mat = np.exp(-1j * 2 * np.pi *
+                                        np.outer(k, self._taus) / dft_len) / dft_len
+        return self._steering_mat
+
     def get_direction(self, dfts):
         ffts = mat.to_matlab_format(dfts)
         #print "ffts: " + str(ffts)
@@ -89,7 +97,7 @@ class DirectionLocalizer(AudioLocalizer):
             return direction.T[0]
 
         # Now we have the time delays, so we solve system
-        direction = mat.cholesky_solve(self._distances, delays)
+        direction = self._lstsq_mat.dot(delays)
         norm = np.linalg.norm(direction, 2)
         if norm != 0:
             direction /= np.linalg.norm(direction, 2)
@@ -113,3 +121,8 @@ class DirectionLocalizer(AudioLocalizer):
             raise ValueError("Must have at least as many mics as dimensions")
             #print "mic layout: " + str(self._mic_positions)
         self._distances = self._mic_positions[1:, :] - self._mic_positions[0, :]
+        # Least squares solution of distances.dot(direction) = delays is
+        # lstsq_mat.dot(delays). Factor the geometry once rather than per frame
+        if not self._use_angle:
+            self._lstsq_mat = mat.cholesky_solve(
+                self._distances, np.eye(self._n_mics - 1))
@@ -6,9 +6,60 @@ import numpy as np
 import math
 import constants as consts
 import sys
+from steeringgeometry import SteeringGeometry
+from observation import Observation
+try:
+    import steeringkernel
+except ImportError:
+    steeringkernel = None  # Compiled kernel not built. See setup.py
 
 class DistributionLocalizer(AudioLocalizer):
 
+    # How get_peak finds the peak of a distribution. See get_peak
+    PEAK_SEARCH = 'grid'
+    SEARCH_LEVELS = 4  # Number of refinement levels for 'coarse_to_fine'
+    SEARCH_CANDIDATES = 3  # Number of peaks refined at each level
+    # Local search around a prior direction. When LOCAL_SEARCH_HOPS is above
+    # 0, get_peak only evaluates the directions within that many steps of
+    # the prior along the neighbour graph of the geometry. See get_peak
+    LOCAL_SEARCH_HOPS = 0
+    FULL_SCAN_INTERVAL = 25  # Most frames between full scans
+    # Fraction of the peak value of the last full scan below which the peak
+    # of a local search is not trusted
+    LOCAL_SEARCH_CONFIDENCE = .5
+    # Angle in radians within which get_sparse_distribution only keeps the
+    # strongest direction. 0 disables peak suppression
+    PEAK_SUPPRESSION_ANGLE = 0.
+    # Candidates taken from each block of directions by get_sparse_distribution
+    # for each peak it returns
+    SPARSE_CANDIDATES = 8
+    # Activity gate on frame energy. See _update_gate. When it is enabled,
+    # frames below the gate skip the steered response computation
+    ENERGY_GATE = False
+    GATE_ON_RATIO = 4.  # Energy over noise floor for a frame to open the gate
+    GATE_OFF_RATIO = 2.  # Energy over noise floor for the gate to stay open
+    NOISE_FLOOR_RISE = .002  # Fraction by which the noise floor may rise per frame
+    # Frequency bin selection. When N_BINS is above 0, the steered response
+    # is only computed over the N_BINS bins below the cutoff frequency with
+    # the best score. See _select_bins
+    N_BINS = 0
+    BIN_SCORE = 'snr'  # 'snr' or 'power'
+    # Recursive cross power spectral density estimates. See update_cpsd
+    CPSD_FORGETTING = .9  # Weight of the previous estimate at each hop
+    CPSD_SEARCH_INTERVAL = 4  # Hops between searches
+    # Frames steered together by get_distribution_batch
+    BATCH_FRAMES = 32
+    # Use the compiled steering kernel for single frames when it is built.
+    # See _iter_kernel_distribution
+    USE_KERNEL = True
+    KERNEL_THREADS = 0  # Threads used by the kernel, 0 to let OpenMP choose
+    # Use each mic pair only in its band of frequencies. See
+    # SteeringGeometry.get_pair_bands
+    NESTED_BANDS = False
+    # Interpolate the SRP likelihood of arbitrary directions from the search
+    # space. See _get_srp_likelihood
+    SRP_GRID_LIKELIHOOD = True
+
     def __init__(self, mic_positions, n_theta=20, n_phi=1, *args, **kwargs):
         """
         :param mic_positions: locations of microphones. Each row should be the
@@ -23,19 +74,93 @@ class DistributionLocalizer(AudioLocalizer):
                       where phi is the polar angle in spherical coordinates. The
                       default value is 1, which indicates a 2d search space
         :type n_phi: int
+        :param geometry: optional keyword argument. SteeringGeometry holding
+                         the mic layout, search space and steering tables.
+                         When given, mic_positions, n_theta and n_phi are
+                         ignored, and the geometry is shared with any other
+                         localizer it was given to
+        :type geometry: SteeringGeometry
+        :param grid: optional keyword argument. How directions are laid out
+                     over a 3d search space. See SteeringGeometry. Ignored
+                     when geometry is given
+        :type grid: str
+        :param max_pairs: optional keyword argument. Maximum number of mic
+                          pairs used by 'mcc', 'beam' and 'tdoa'. See
+                          SteeringGeometry. Ignored when geometry is given
+        :type max_pairs: int
         """
+        geometry = kwargs.pop('geometry', None)
+        grid = kwargs.pop('grid', 'lattice')
+        max_pairs = kwargs.pop('max_pairs', None)
         AudioLocalizer.__init__(self, *args, **kwargs)
+        # Activity gate state
+        self._noise_floor = None
+        self._gate_active = True
+        self._gate_frame = None
+        self._prev_direction = None
+        # Frequency bin selection state
+        self._noise_spectrum = None
+        self._bins_frame = None
+        self._bins = None
+        # Recursive CPSD state. See update_cpsd
+        self._cpsd = None
+        self._cpsd_hops = 0
         self._n_theta = n_theta
         self._n_phi = n_phi
-        if mic_positions is not None:
-            self._process_mic_positions(mic_positions)
-            self._setup_distances()
-            self._setup_search_space()
-            self._setup_freq_spaces()
+        if geometry is None and mic_positions is not None:
+            geometry = SteeringGeometry(mic_positions, self._dft_len,
+                                        self._sample_rate, n_theta, n_phi,
+                                        self.CUTOFF_FREQ, grid, max_pairs)
+        if geometry is not None:
+            self._use_geometry(geometry)
         else:
             sys.stderr.write("WARNING: No mic positions provided -- certain public methods"
                              "may fail")
 
+    def get_geometry(self):
+        """
+        Returns the SteeringGeometry used by this localizer. It can be passed
+        to other localizers with the same mic layout, DFT length, sample rate
+        and search space so that they share it
+        """
+        return self._geometry
+
+    def _use_geometry(self, geometry):
+        """
+        Setup the member variables describing the mic layout and search space
+        from a SteeringGeometry. The arrays are shared with the geometry
+        """
+        if not geometry.is_compatible(self._dft_len, self._sample_rate,
+                                      self.CUTOFF_FREQ):
+            raise ValueError("Geometry was built for a different DFT length, " +
+                             "sample rate or cutoff frequency")
+        self._geometry = geometry
+        self._n_theta = geometry.get_n_theta()
+        self._n_phi = geometry.get_n_phi()
+        self._grid = geometry.get_grid()
+        self._n_directions = geometry.get_n_directions()
+        self._mic_positions = geometry.get_mic_positions()
+        self._n_mics, self._n_dimensions = self._mic_positions.shape
+        self._pairs = geometry.get_pairs()
+        self._n_mic_pairs = geometry.get_n_pairs()
+        self._distances = geometry.get_distances()
+        self._all_distances = geometry.get_all_distances()
+        self._directions = geometry.get_directions()
+        self._spher_directions = geometry.get_spher_directions()
+        self._delays = geometry.get_delays()
+        self._all_delays = geometry.get_all_delays()
+        self._cutoff_index = geometry.get_cutoff_index()
+        # Store previous distribution for when signal energy is very low
+        self._prev_distr = \
+            np.zeros((4, self._n_directions), dtype=consts.REAL_DTYPE)
+        self._prev_distr[:3, :] = self._directions
+        self._prev_distr[3, :] = consts.EPS
+        # Local search state. See get_peak
+        self._search_prior_ind = None
+        self._last_peak_ind = None
+        self._frames_since_scan = 0
+        self._scan_peak_value = 0.
+
     def get_distribution_mat(self, ffts):
         """
         Get probability distribution of source location
@@ -48,12 +173,13 @@ class DistributionLocalizer(AudioLocalizer):
         # For some reason, 'whitening' both sources causes problems (underflow?)
         #auto_corr /= (np.abs(ffts[0, :]) * np.abs(ffts[1:, :]))
         # Get correlation values
-        corrs = np.zeros((self._n_mics - 1, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
-        for i in range(corrs.shape[1]):
-            shifted = auto_corr * self._shift_mats[:, :, i]
-            corrs[:, i] = np.real(np.sum(shifted, axis=1))  # idft for n = 0
+        corrs = np.zeros((self._n_mics - 1, self._n_directions), dtype=consts.REAL_DTYPE)
+        for start, shift_mats in self._geometry.iter_shift_blocks('full'):
+            stop = start + shift_mats.shape[2]
+            corrs[:, start:stop] = np.real(
+                np.einsum('ik,ikj->ij', auto_corr, shift_mats))  # idft for n = 0
         # Normalize ang get probability for each direction
-        distr = np.empty((4, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
+        distr = np.empty((4, self._n_directions), dtype=consts.REAL_DTYPE)
         distr = np.maximum(np.sum(corrs, axis=0), consts.EPS)
         #distr[3, :] = np.log(distr[3, :])
         #distr[3, :] -= np.log(1.e14)
@@ -68,76 +194,826 @@ class DistributionLocalizer(AudioLocalizer):
         given observed ffts. There are a few different methods for doing so. These
         strings can be passed in as the 'method' argument.
 
-        :param rffts: positive half of the observed rffts
+        :param rffts: positive half of the observed rffts, or an Observation
+                      of the frame to share the work with other localizers
         :param method: method for computing the distribution. There are few options:
             'gcc': Use the Generalized Cross Correlation Method
             'beam': Use the energy of a delay and sum beamform
             'mcc': Use cross correlation with all pairs of mics
+            'tdoa': Cross correlation with all pairs of mics computed once
+                    per pair in the lag domain. Each direction reads its
+                    value from a lag lookup table
         :param args: optional arguments specific to the method chosen. For the 
                      gcc method this can be used to specify the coefficient of
                      the shaping function
+
+        If ENERGY_GATE is set and the frame does not pass the gate, the
+        distribution of the last frame that did is returned instead. See
+        is_active
         """
         
-        energy = self._get_energy(rffts)
+        obs = self._observe(rffts)
+        energy = self._get_frame_energy(obs)
+        if not self._gate_observation(obs):
+            return self._prev_distr[3, :].copy(), energy
+        distr = self._get_full_distribution(obs, method, *args)
+        self._prev_distr[3, :] = distr
+        return distr, energy
+
+    def get_distribution_batch(self, rffts, method='gcc', *args):
+        """
+        Get the distributions of get_distribution_real for a stack of frames.
+        Up to BATCH_FRAMES frames are steered together, so that every block
+        of shifts is applied to all of them in one array operation. This is
+        meant for offline processing of recordings. Frames do not pass the
+        activity gate, and if N_BINS is set the bins are selected once for
+        each group of frames rather than per frame.
+
+        :param rffts: positive half of the observed rffts of size
+                      (n_frames x n_mics x n_bins)
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :param args: optional arguments specific to the method chosen
+        :returns: (distrs, energies) tuple. distrs is of size
+                  (n_frames x n_directions), and energies holds the energy of
+                  each frame as returned by get_distribution_real
+        """
+        n_frames = rffts.shape[0]
+        distrs = None
+        energies = np.empty((n_frames,), dtype=consts.COMPLEX_DTYPE)
+        for start in range(0, n_frames, self.BATCH_FRAMES):
+            stop = min(start + self.BATCH_FRAMES, n_frames)
+            spectra = self._get_spectra(rffts[start:stop])
+            energies[start:stop] = np.sum(np.sum(spectra[1], axis=-1), axis=-1)
+            batch = self._get_steered_distribution(spectra, method, None, *args)
+            if distrs is None:
+                distrs = np.empty((n_frames, batch.shape[1]), dtype=batch.dtype)
+            distrs[start:stop, :] = batch
+        return distrs, energies
+
+    def gate_frame(self, rffts):
+        """
+        Pass a frame through the activity gate without localizing. This is
+        for callers that do not use get_distribution_real or get_peak, which
+        gate their frames themselves
+        :returns: True if the frame is active. See is_active
+        """
+        return self._gate_observation(self._observe(rffts))
+
+    def is_active(self):
+        """
+        Returns whether the last frame given to get_distribution_real,
+        get_peak or gate_frame passed the activity gate. Trackers should
+        only do their prediction step on inactive frames. Always True when
+        ENERGY_GATE is not set
+        """
+        return self._gate_active
+
+    def _gate_observation(self, obs):
+        """
+        Pass an Observation through the activity gate. The gate is updated
+        once per Observation, so repeated calls on one frame, such as
+        get_distribution_real followed by get_distribution, reuse the
+        decision rather than advancing the noise floor and hysteresis again
+        :returns: True if the frame is active
+        """
+        if obs is self._gate_frame:
+            return self._gate_active
+        self._gate_frame = obs
+        return self._update_gate(self._get_frame_energy(obs))
+
+    def _update_gate(self, energy):
+        """
+        Update the activity gate with the energy of a frame. The noise floor
+        drops to the frame energy whenever the energy is lower, and
+        otherwise rises by at most NOISE_FLOOR_RISE per frame, so it follows
+        the quietest recent frames. The gate opens when the energy is above
+        GATE_ON_RATIO times the noise floor, and then stays open until the
+        energy falls below GATE_OFF_RATIO times the noise floor.
+        Frames without energy are inactive and leave the noise floor as is
+        :returns: True if the frame is active
+        """
+        if not self.ENERGY_GATE:
+            self._gate_active = True
+            return True
+        energy = float(np.real(energy))
+        if energy <= consts.EPS:
+            self._gate_active = False
+            return False
+        if self._noise_floor is None or energy < self._noise_floor:
+            self._noise_floor = energy
+        else:
+            self._noise_floor = min(energy,
+                self._noise_floor * (1 + self.NOISE_FLOOR_RISE))
+        ratio = self.GATE_OFF_RATIO if self._gate_active else self.GATE_ON_RATIO
+        self._gate_active = energy > ratio * self._noise_floor
+        return self._gate_active
+
+    def get_sparse_distribution(self, rffts, n_peaks=5, method='gcc', *args):
+        """
+        Get the strongest directions of the distribution given by
+        get_distribution_real without holding the distribution over the
+        whole search space. Directions are evaluated one block at a time,
+        keeping only the strongest candidates so far, so memory use does not
+        grow with the size of the search space. The peaks are then chosen
+        from those candidates. If PEAK_SUPPRESSION_ANGLE is above 0, a
+        direction is not kept when a stronger direction within that angle
+        is, so that the peaks belong to separate lobes of the distribution.
+        Each peak then takes as many candidates as the directions it
+        suppresses on top of the SPARSE_CANDIDATES it takes otherwise.
+
+        :param rffts: positive half of the observed rffts
+        :param n_peaks: largest number of directions to return
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :returns: (inds, values, energy) tuple. inds holds the indices of
+                  the strongest directions in the search space, strongest
+                  first, and values the distribution at those directions.
+                  energy is as returned by get_distribution_real
+        """
+        inds = np.zeros((0,), dtype=int)
+        values = np.zeros((0,))
+        obs = self._observe(rffts)
+        n_candidates = max(n_peaks, 1) * \
+            (self.SPARSE_CANDIDATES + self._get_n_suppressed())
+        for start, distr in self._iter_search_blocks(
+                self._get_frame_spectra(obs), method, *args):
+            inds = np.hstack((inds, start + np.arange(distr.size)))
+            values = np.hstack((values, distr))
+            if values.size > n_candidates:
+                strongest = np.argpartition(-values, n_candidates - 1)[:n_candidates]
+                inds, values = inds[strongest], values[strongest]
+        inds, values = self._select_peaks(inds, values, n_peaks)
+        return inds, values, self._get_frame_energy(obs)
+
+    def _get_n_suppressed(self):
+        """
+        Estimate the number of directions within PEAK_SUPPRESSION_ANGLE of a
+        direction, from the fraction of the search space they cover
+        """
+        angle = self.PEAK_SUPPRESSION_ANGLE
+        if angle <= 0:
+            return 0
+        if self._n_phi == 1:
+            fraction = 2 * angle / math.pi
+        else:
+            fraction = 1 - math.cos(angle)
+        return int(math.ceil(min(fraction, 1.) * self._n_directions))
+
+    def _select_peaks(self, inds, values, n_peaks):
+        """
+        Select the n_peaks strongest of a list of candidate directions,
+        leaving out those within PEAK_SUPPRESSION_ANGLE of a stronger
+        direction that is kept
+        :returns: (inds, values) tuple of the directions kept, strongest first
+        """
+        order = np.lexsort((inds, -values))  # Ties go to the lowest index
+        inds, values = inds[order], values[order]
+        if self.PEAK_SUPPRESSION_ANGLE <= 0:
+            return inds[:n_peaks], values[:n_peaks]
+        directions = self._directions[:, inds]
+        near = directions.T.dot(directions) >= math.cos(self.PEAK_SUPPRESSION_ANGLE)
+        kept = np.zeros(inds.shape, dtype=bool)
+        for i in range(inds.size):
+            if np.sum(kept) == n_peaks:
+                break
+            kept[i] = not np.any(near[i, kept])
+        return inds[kept], values[kept]
+
+    def get_peak(self, rffts, method='gcc', *args):
+        """
+        Get the direction of the strongest source along with the distribution
+        from get_distribution_real. How the peak is found is set by the
+        PEAK_SEARCH member:
+            'grid': the search space direction with the largest value
+            'coarse_to_fine': the SEARCH_CANDIDATES best search space
+                              directions are refined over SEARCH_LEVELS
+                              levels, halving the angular spacing around the
+                              best candidates at each level. The search space
+                              then only needs to be fine enough to not miss
+                              the peak, and the cost of reaching a given
+                              resolution is logarithmic in that resolution
+            'interpolate': fit a parabola through the best search space
+                           direction and its neighbours along each grid
+                           axis, and use the vertex. For grids other than
+                           the lattice a quadratic surface is fit to the
+                           nearest directions instead. This costs nothing
+                           beyond the distribution itself
+
+        If LOCAL_SEARCH_HOPS is above 0 the distribution is only evaluated
+        around a prior direction, which is the one given to set_search_prior
+        or else the peak of the previous call. Directions outside of that
+        neighbourhood are set to EPS. The whole search space is scanned
+        instead every FULL_SCAN_INTERVAL frames, when there is no prior, when
+        the local peak is on the boundary of the neighbourhood, or when it is
+        below LOCAL_SEARCH_CONFIDENCE times the peak of the last full scan.
+
+        Frames that do not pass the activity gate (see is_active) return the
+        direction and distribution of the last frame that did. The direction
+        is None if there was no such frame.
+
+        :param rffts: positive half of the observed rffts, or an Observation
+                      of the frame
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :returns: (direction, distr, energy) tuple. direction is a length 3
+                  unit vector, and distr and energy are as returned by
+                  get_distribution_real
+        """
+        obs = self._observe(rffts)
+        energy = self._get_frame_energy(obs)
+        if not self._gate_observation(obs):
+            return self._prev_direction, self._prev_distr[3, :].copy(), energy
+        direction, distr = self._search_peak(obs, method, *args)
+        return direction, distr, energy
+
+    def update_cpsd(self, rffts):
+        """
+        Update the recursive estimates of the cross power spectral density
+        of every pair of mics, and of the power spectral density of every
+        mic, with one or more hops:
+            S_t = CPSD_FORGETTING * S_{t-1} + (1 - CPSD_FORGETTING) * X_t X_t*
+        An update costs O(n_mic_pairs * n_bins) per hop, so every hop can
+        be used while the search over directions by get_cpsd_peak runs only
+        every CPSD_SEARCH_INTERVAL hops, or when an estimate is needed.
+
+        :param rffts: positive half of the rffts of one hop, of size
+                      (n_mics x n_bins), or of several hops, of size
+                      (n_mics x n_bins x n_hops) as given by
+                      mattools.to_all_real_matlab_format
+        :returns: True if at least CPSD_SEARCH_INTERVAL hops have been added
+                  since the last call to get_cpsd_peak
+        """
+        if rffts.ndim == 2:
+            rffts = rffts[:, :, np.newaxis]
+        forgetting = self.CPSD_FORGETTING
+        for hop in range(rffts.shape[2]):
+            spectra = self._get_spectra(rffts[:, :, hop])
+            if self._cpsd is None:
+                self._cpsd = spectra
+                continue
+            for estimate, spectrum in zip(self._cpsd, spectra):
+                estimate *= forgetting
+                estimate += (1 - forgetting) * spectrum
+        self._cpsd_hops += rffts.shape[2]
+        return self._cpsd_hops >= self.CPSD_SEARCH_INTERVAL
+
+    def get_cpsd_peak(self, method='gcc', *args):
+        """
+        Get the direction of the strongest source as get_peak does, from the
+        spectral density estimates of update_cpsd rather than from a single
+        frame
+
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :returns: (direction, distr, energy) tuple as from get_peak. energy
+                  is that of the estimated spectral densities
+        """
+        if self._cpsd is None:
+            raise ValueError("No hops have been added with update_cpsd")
+        self._cpsd_hops = 0
+        spectra = (self._cpsd[0], self._cpsd[1])
+        energy = np.sum(spectra[1])
+        if not self._update_gate(energy):
+            return self._prev_direction, self._prev_distr[3, :].copy(), energy
+        direction, distr = self._search_peak(spectra, method, *args)
+        return direction, distr, energy
+
+    def _search_peak(self, frame, method, *args):
+        """
+        Find the peak as described in get_peak
+        :param frame: Observation of the frame, or spectra such as the CPSD
+                      estimates. See _get_frame_spectra
+        :returns: (direction, distr) tuple
+        """
+        spectra = self._get_frame_spectra(frame)
+        if self.LOCAL_SEARCH_HOPS > 0:
+            distr = self._get_local_distribution(frame, method, *args)
+        else:
+            distr = self._get_full_distribution(frame, method, *args)
+        self._prev_distr[3, :] = distr
+        self._last_peak_ind = np.argmax(distr)
+        if self.PEAK_SEARCH == 'coarse_to_fine':
+            direction = self._refine_peak(spectra, distr, method, *args)
+        elif self.PEAK_SEARCH == 'interpolate':
+            direction = self._interpolate_peak(distr)
+        elif self.PEAK_SEARCH == 'grid':
+            direction = self._directions[:, np.argmax(distr)]
+        else:
+            raise ValueError("Unknown peak search: " + str(self.PEAK_SEARCH))
+        self._prev_direction = direction
+        return direction, distr
+
+    def set_search_prior(self, direction):
+        """
+        Set the direction around which the next call to get_peak searches
+        when LOCAL_SEARCH_HOPS is above 0, such as the estimate of a tracker.
+        The closest direction of the search space is used
+        :param direction: vector pointing towards the prior direction. It
+                          does not need to be normalized. Vectors with 2
+                          entries lie in the xy plane
+        """
+        direction = np.asarray(direction, dtype=float)
+        if np.linalg.norm(direction) == 0:
+            return
+        if direction.size < 3:
+            direction = np.hstack((direction, np.zeros((3 - direction.size,))))
+        self._search_prior_ind = np.argmax(self._directions.T.dot(direction))
+
+    def _get_local_distribution(self, frame, method, *args):
+        """
+        Get the distribution for get_peak when local search is enabled
+        :param frame: Observation or spectra of the frame. See _search_peak
+        :returns: distribution over the search space
+        """
+        spectra = self._get_frame_spectra(frame)
+        prior_ind = self._search_prior_ind
+        self._search_prior_ind = None
+        if prior_ind is None:
+            prior_ind = self._last_peak_ind
+        if prior_ind is not None and \
+                self._frames_since_scan + 1 < self.FULL_SCAN_INTERVAL:
+            inds, n_inner = self._geometry.get_neighbourhood(
+                prior_ind, self.LOCAL_SEARCH_HOPS)
+            values = self._get_steered_distribution(spectra, method, inds, *args)
+            best = np.argmax(values)
+            if best < n_inner and values[best] >= \
+                    self.LOCAL_SEARCH_CONFIDENCE * self._scan_peak_value:
+                self._frames_since_scan += 1
+                distr = consts.EPS * np.ones((self._n_directions,),
+                                             dtype=values.dtype)
+                distr[inds] = values
+                return distr
+        distr = self._get_full_distribution(frame, method, *args)
+        self._frames_since_scan = 0
+        self._scan_peak_value = np.max(distr)
+        return distr
+
+    def _refine_peak(self, spectra, distr, method, *args):
+        """
+        Coarse to fine search for the peak of the distribution, starting from
+        the distribution over the search space. Candidates are kept in
+        spherical coordinates. At each level every candidate is surrounded by
+        neighbours at half the previous spacing, the method is evaluated at
+        those neighbours, and the best candidates overall are kept.
+        """
+        n_candidates = min(self.SEARCH_CANDIDATES, distr.size)
+        best = np.argsort(distr)[-n_candidates:]
+        candidates = np.asarray(self._spher_directions[1:, best], dtype=float)
+        values = distr[best]
+        theta_step, phi_step = self._get_grid_steps()
+        if self._n_phi == 1:
+            offsets = np.array([[-1., 1.], [0., 0.]])
+        else:
+            offsets = np.array([[-1., -1., -1., 0., 0., 1., 1., 1.],
+                                [-1., 0., 1., -1., 1., -1., 0., 1.]])
+        for level in range(self.SEARCH_LEVELS):
+            theta_step /= 2.
+            phi_step /= 2.
+            steps = np.array([[theta_step], [phi_step]])
+            neighbours = (candidates[:, :, np.newaxis] +
+                          (steps * offsets)[:, np.newaxis, :]).reshape((2, -1))
+            if self._n_phi == 1:
+                neighbours[0, :] = np.clip(neighbours[0, :], 0, math.pi)
+            else:
+                neighbours[0, :] = np.mod(neighbours[0, :], 2 * math.pi)
+                neighbours[1, :] = np.clip(neighbours[1, :], 0, math.pi / 2.)
+            neighbour_values = self._get_steered_distribution(
+                spectra, method, mat.spher_to_cartesian(neighbours), *args)
+            candidates = np.hstack((candidates, neighbours))
+            values = np.hstack((values, neighbour_values))
+            best = np.argsort(values)[-n_candidates:]
+            candidates = candidates[:, best]
+            values = values[best]
+        return mat.spher_to_cartesian(candidates[:, np.argmax(values)])
+
+    def _interpolate_peak(self, distr):
+        """
+        Get a continuous estimate of the peak of a distribution over the
+        search space by parabolic interpolation along the azimuthal and
+        polar axes of the grid. Along an axis where the best direction has
+        no neighbour on one side, the grid value is used.
+        """
+        if self._grid != 'lattice':
+            return self._interpolate_scattered_peak(distr)
+        ind = np.argmax(distr)
+        p, t = divmod(ind, self._n_theta)
+        grid = np.reshape(distr, (self._n_phi, self._n_theta))
+        theta = float(self._spher_directions[1, ind])
+        phi = float(self._spher_directions[2, ind])
+        theta_step, phi_step = self._get_grid_steps()
+        if self._n_phi == 1:
+            if 0 < t < self._n_theta - 1:
+                theta += theta_step * mat.parabolic_peak_offset(
+                    grid[p, t - 1], grid[p, t], grid[p, t + 1])
+        else:
+            if self._n_theta > 2:
+                # Azimuth wraps around. First and last columns are both at
+                # azimuth 0 (2 pi)
+                left = t - 1 if t > 0 else self._n_theta - 2
+                right = t + 1 if t < self._n_theta - 1 else 1
+                theta += theta_step * mat.parabolic_peak_offset(
+                    grid[p, left], grid[p, t], grid[p, right])
+            if 0 < p < self._n_phi - 1:
+                phi += phi_step * mat.parabolic_peak_offset(
+                    grid[p - 1, t], grid[p, t], grid[p + 1, t])
+        return mat.spher_to_cartesian(np.array([theta, phi]))
+
+    def _interpolate_scattered_peak(self, distr):
+        """
+        Get a continuous estimate of the peak of a distribution over a grid
+        without axes. A quadratic surface is fit by least squares to the
+        values at the best direction and its nearest neighbours, in
+        coordinates on the plane tangent to the sphere at the best direction.
+        The vertex is used if the surface has a maximum within one grid
+        spacing. Otherwise the grid value is used.
+        """
+        ind = np.argmax(distr)
+        peak = np.asarray(self._directions[:, ind], dtype=float)
+        if self._n_directions < 6:
+            return peak
+        dots = self._directions.T.dot(peak)
+        near = np.argsort(-dots)[:min(9, self._n_directions)]
+        # Orthonormal basis of the tangent plane
+        axis = np.array([0., 0., 1.]) if abs(peak[2]) < .9 else np.array([1., 0., 0.])
+        e1 = np.cross(peak, axis)
+        e1 /= np.linalg.norm(e1)
+        e2 = np.cross(peak, e1)
+        x = self._directions[:, near].T.dot(e1)
+        y = self._directions[:, near].T.dot(e2)
+        design = np.array([np.ones(x.shape), x, y, x ** 2, x * y, y ** 2]).T
+        c = np.linalg.lstsq(design, distr[near])[0]
+        hessian = np.array([[2 * c[3], c[4]], [c[4], 2 * c[5]]])
+        if hessian[0, 0] >= 0 or np.linalg.det(hessian) <= 0:  # Not a maximum
+            return peak
+        offset = np.linalg.solve(hessian, -c[1:3])
+        spacing = self._geometry.get_grid_spacing()
+        if np.linalg.norm(offset) > spacing:
+            return peak
+        direction = peak + offset[0] * e1 + offset[1] * e2
+        direction[2] = max(direction[2], 0.)  # Stay in the upper hemisphere
+        return direction / np.linalg.norm(direction)
+
+    def _get_grid_steps(self):
+        """
+        Get the spacing of the search space grid in azimuthal and polar angle
+        :returns: (theta_step, phi_step) tuple in radians. phi_step is 0 for
+                  a 2d search space
+        """
+        if self._grid != 'lattice':
+            spacing = self._geometry.get_grid_spacing()
+            return spacing, spacing
+        if self._n_phi == 1:
+            return math.pi / max(self._n_theta - 1, 1), 0.
+        return 2 * math.pi / max(self._n_theta - 1, 1), \
+            (math.pi / 2.) / (self._n_phi - 1)
+
+    def _observe(self, rffts):
+        """
+        Get an Observation of a frame given either its rffts or an
+        Observation already
+        """
+        if isinstance(rffts, Observation):
+            return rffts
+        return Observation(rffts)
+
+    def _get_frame_spectra(self, frame):
+        """
+        Get the spectra of a frame, computed once per Observation and
+        geometry. Spectra that are not of an Observation are returned as is
+        """
+        if not isinstance(frame, Observation):
+            return frame
+        return frame.get(('spectra', self._geometry),
+                         lambda: self._get_spectra(frame.get_rffts()))
+
+    def _get_frame_energy(self, obs):
+        return obs.get(('energy', self._geometry),
+                       lambda: self._get_energy(obs.get_rffts()))
+
+    def _get_full_distribution(self, frame, method, *args):
+        """
+        Get the distribution over the whole search space, computed once per
+        Observation, geometry, method, arguments and steering settings
+        :param frame: Observation or spectra of the frame. See _search_peak
+        :returns: the distribution, which the caller may modify
+        """
+        if not isinstance(frame, Observation):
+            return self._get_steered_distribution(frame, method, None, *args)
+        spectra = self._get_frame_spectra(frame)
+        key = ('distribution', self._geometry, method, args,
+               self._get_steering_key(spectra))
+        return frame.get(key, lambda: self._get_steered_distribution(
+            spectra, method, None, *args)).copy()
+
+    def _get_steering_key(self, spectra):
+        """
+        Get the settings a steered distribution of the frame depends on
+        beyond the geometry, so localizers sharing a geometry only share
+        distributions computed the same way. Selects the bins of the frame,
+        which steering would do anyway
+        """
+        bins = self._select_bins(spectra)
+        if bins is not None:
+            bins = tuple(bins)
+        return (self.N_BINS, self.BIN_SCORE, self.NESTED_BANDS,
+                self.USE_KERNEL, bins)
+
+    def _get_steered_distribution(self, spectra, method, directions, *args):
+        """
+        Evaluate the distribution given by method either over the search
+        space or over arbitrary directions. Steering over the search space
+        uses the precomputed tables of the geometry, while steering over
+        other directions computes the delays and shifts for those directions.
+
+        :param spectra: spectra of the frame. See _get_spectra
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :param directions: None to use the search space, a vector of indices
+                           into the search space, or a matrix of unit
+                           vectors, one per column
+        :returns: distribution over the search space or given directions
+        """
+        return np.hstack([distr for start, distr in
+                          self._iter_steered_distribution(spectra, method,
+                                                          directions, *args)])
+
+    def _iter_steered_distribution(self, spectra, method, directions, *args):
+        """
+        Evaluate the distribution as in _get_steered_distribution, one block
+        of directions at a time. Over the search space the blocks are those
+        of SteeringGeometry.iter_shift_blocks, otherwise there is one block
+        :returns: generator of (start, distr) tuples where distr is the
+                  distribution for directions start onwards
+        """
+        inds = None
+        if directions is not None and np.ndim(directions) == 1:
+            inds = directions
+        bins, spectra = self._get_steering_spectra(spectra)
+        if method not in ['gcc', 'beam', 'mcc', 'tdoa']:
+            raise ValueError("Unknown localization method: " + str(method))
+        # Method 'gcc' uses pairs with the first mic, the others all pairs
+        all_pairs = method != 'gcc'
+        table_name = 'all_lp_pos' if all_pairs else 'lp_pos'
+        if directions is None:
+            if method == 'tdoa':
+                return self._iter_distribution_tdoa(spectra, bins, None, *args)
+            if self._use_kernel(spectra, method, *args):
+                delays = self._all_delays if all_pairs else self._delays
+                return self._iter_kernel_distribution(spectra, bins, delays,
+                                                      method, *args)
+            shift_blocks = self._geometry.iter_shift_blocks(table_name, bins)
+            return self._iter_shifted_distribution(spectra, bins, method,
+                                                   shift_blocks, *args)
+        if inds is None:
+            delays = self._geometry.compute_delays(directions, all_pairs)
+        elif method == 'tdoa' or self._use_kernel(spectra, method, *args) or \
+                self._geometry.get_shift_table(table_name) is None:
+            delays = (self._all_delays if all_pairs else self._delays)[:, inds]
+        else:
+            table = self._geometry.get_shift_table(table_name)
+            if bins is not None:
+                table = table[:, bins, :]
+            return self._iter_shifted_distribution(
+                spectra, bins, method, [(0, table[:, :, inds])], *args)
+        return self._iter_delay_distribution(spectra, bins, method, delays,
+                                             *args)
+
+    def _iter_search_blocks(self, spectra, method, *args):
+        """
+        Evaluate the distribution over the search space in blocks of
+        directions, as _iter_steered_distribution does. The compiled kernel
+        is also given one block at a time rather than every direction at
+        once, with blocks of the length of those of iter_shift_blocks
+        :returns: generator of (start, distr) tuples
+        """
+        if method == 'tdoa' or not self._use_kernel(spectra, method, *args):
+            for block in self._iter_steered_distribution(spectra, method,
+                                                         None, *args):
+                yield block
+            return
+        table_name = 'lp_pos' if method == 'gcc' else 'all_lp_pos'
+        block_len = self._geometry.get_block_len(table_name)
+        for start in range(0, self._n_directions, block_len):
+            inds = np.arange(start, min(start + block_len, self._n_directions))
+            for _, distr in self._iter_steered_distribution(spectra, method,
+                                                            inds, *args):
+                yield start, distr
+
+    def _get_steering_spectra(self, spectra):
+        """
+        Get the spectra a frame is steered with: those of the selected bins
+        (see _select_bins), restricted to the band of each pair when
+        NESTED_BANDS is set
+        :returns: (bins, spectra) tuple
+        """
+        bins = self._select_bins(spectra)
+        spectra = self._get_bin_spectra(spectra, bins)
+        if self.NESTED_BANDS:
+            bands = self._geometry.get_pair_bands()
+            if bins is not None:
+                bands = bands[:, bins]
+            spectra = (spectra[0] * bands, spectra[1])
+        return bins, spectra
+
+    def _iter_delay_distribution(self, spectra, bins, method, delays, *args):
+        """
+        Evaluate the distribution given by method for arbitrary delays, such
+        as those of directions off the search space or of near field
+        positions. The shifts are computed from the delays.
+
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. See _select_bins
+        :param method: method for computing the distribution. See
+                       get_distribution_real
+        :param delays: delays of the pairs used by method, those with the
+                       first mic for 'gcc' and every selected pair otherwise,
+                       with one column per point to evaluate
+        :returns: generator of (start, distr) tuples
+        """
+        if method == 'tdoa':
+            return self._iter_distribution_tdoa(spectra, bins, delays, *args)
+        if self._use_kernel(spectra, method, *args):
+            return self._iter_kernel_distribution(spectra, bins, delays,
+                                                  method, *args)
+        if bins is None:
+            shift_mats = self._geometry.get_shifts_from_delays(
+                delays, self._cutoff_index)
+        else:
+            shift_mats = self._geometry.get_shifts_at_bins(delays, bins)
+        return self._iter_shifted_distribution(spectra, bins, method,
+                                               [(0, shift_mats)], *args)
+
+    def _iter_shifted_distribution(self, spectra, bins, method, shift_blocks,
+                                   *args):
+        """
+        Dispatch to the engine of 'gcc', 'beam' or 'mcc' given the blocks of
+        shifts to steer with. See _iter_distribution_beam
+        """
         if method == 'gcc':
-            distr = self._get_distribution_gcc(rffts, *args)
+            return self._iter_distribution_gcc(spectra, bins, shift_blocks, *args)
         if method == 'beam':
-            distr = self._get_distribution_beam(rffts, self._all_lp_pos_shift_mats, *args)
-        if method == 'mcc':
-            distr = self._get_distribution_mcc(rffts, *args)
-        return distr, energy
+            return self._iter_distribution_beam(spectra, bins, shift_blocks, *args)
+        return self._iter_distribution_mcc(spectra, bins, shift_blocks, *args)
+
+    def _use_kernel(self, spectra, method, *args):
+        """
+        Check whether a frame can be steered by the compiled kernel. The
+        kernel handles single frames of 'gcc', 'mcc', and 'beam' with the
+        default PHAT weighting
+        """
+        if steeringkernel is None or not self.USE_KERNEL:
+            return False
+        if spectra[0].ndim != 2:
+            return False
+        return method != 'beam' or len(args) == 0
+
+    def _iter_kernel_distribution(self, spectra, bins, delays, method, *args):
+        """
+        Get the distribution of 'gcc', 'mcc' or 'beam' with the compiled
+        kernel of steeringkernel.pyx. The kernel computes the shifts from the
+        delays as it goes, so neither the shift tables nor blocks of shifts
+        are needed, and splits the directions between KERNEL_THREADS threads.
+
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. See _select_bins
+        :param delays: delays of the pairs used by method for each direction
+                       to evaluate
+        :returns: generator of a single (start, distr) tuple
+        """
+        cp_pairs, auto_spectra = spectra
+        if bins is None:
+            bins = np.arange(cp_pairs.shape[1])
+        if method == 'beam':
+            self_energy = np.sum(auto_spectra / (np.abs(auto_spectra) + consts.EPS))
+            distr = steeringkernel.steer_directions(
+                cp_pairs, delays, bins, self._dft_len,
+                steeringkernel.SHAPE_POWER, self_energy=self_energy,
+                n_threads=self.KERNEL_THREADS)
+        else:
+            if method == 'gcc':
+                cp_pairs = cp_pairs[:self._n_mics - 1, :]
+            k = 2  # Default value of coefficient. See _shape_correlations
+            if len(args) > 0:
+                k = float(args[0])
+            distr = steeringkernel.steer_directions(
+                cp_pairs, delays, bins, self._dft_len,
+                steeringkernel.SHAPE_CORRELATIONS, k,
+                n_threads=self.KERNEL_THREADS)
+        # The kernel works in double precision
+        yield 0, distr.astype(consts.REAL_DTYPE)
+
+    def _select_bins(self, spectra):
+        """
+        Select the frequency bins below the cutoff frequency over which a
+        frame is steered. Bins are scored by BIN_SCORE:
+            'snr': power averaged over mics divided by the noise spectrum.
+                   The noise spectrum of each bin follows the quietest
+                   recent frames, as the noise floor of the activity gate
+                   does (see _update_gate). This drops stationary noise
+                   such as low frequency rumble
+            'power': power averaged over mics
+        Selection is done once per frame, so repeated evaluations of the
+        same frame use the same bins.
+
+        :param spectra: spectra of the frame. See _get_spectra
+        :returns: sorted vector of the indices of the N_BINS best bins, or
+                  None to use every bin below the cutoff frequency
+        """
+        cutoff_index = self._compute_cutoff_index()
+        if self.N_BINS <= 0 or self.N_BINS >= cutoff_index:
+            return None
+        if spectra is self._bins_frame:
+            return self._bins
+        power = np.mean(np.real(spectra[1]), axis=-2)
+        if power.ndim > 1:
+            # A stack of frames shares one selection. See get_distribution_batch
+            power = np.mean(power.reshape((-1, power.shape[-1])), axis=0)
+        if self.BIN_SCORE == 'snr':
+            if self._noise_spectrum is None:
+                self._noise_spectrum = power + consts.EPS
+            else:
+                self._noise_spectrum = np.minimum(power + consts.EPS,
+                    self._noise_spectrum * (1 + self.NOISE_FLOOR_RISE))
+            score = power / self._noise_spectrum
+        elif self.BIN_SCORE == 'power':
+            score = power
+        else:
+            raise ValueError("Unknown bin score: " + str(self.BIN_SCORE))
+        self._bins = np.sort(np.argpartition(-score, self.N_BINS - 1)[:self.N_BINS])
+        self._bins_frame = spectra
+        return self._bins
+
+    def _get_spectra(self, rffts):
+        """
+        Get the spectra of a frame below the cutoff frequency, which are
+        what the steering engines work from
+        :param rffts: positive half of the observed rffts, or a stack of
+                      them with frames along the first axis
+        :returns: (cp_pairs, auto_spectra) tuple. cp_pairs holds the cross
+                  power spectrum of every unique pair of mics (see
+                  _get_crosspower_pairs) and auto_spectra the spectrum
+                  X_j(f)X_j(f)* of every mic. Both keep the frames axis of
+                  a stack
+        """
+        lowffts = rffts[..., :self._compute_cutoff_index()]  # Low pass filtered
+        return self._get_crosspower_pairs(lowffts), lowffts * lowffts.conj()
+
+    def _get_bin_spectra(self, spectra, bins):
+        """
+        Get the spectra of the given bins, or of every bin below the cutoff
+        frequency if bins is None
+        """
+        if bins is None:
+            return spectra
+        return spectra[0][..., bins], spectra[1][..., bins]
 
     def _get_energy(self, rffts):
         cutoff_index = self._compute_cutoff_index()
         lowffts = rffts[:, :cutoff_index]
         return np.sum(np.sum(lowffts * lowffts.conj()))
 
-    def _get_distribution_gcc(self, rffts, *args):
+    def _iter_distribution_gcc(self, spectra, bins, shift_blocks, *args):
         """
         Get distribution using Generalized Cross Correlation - Phase 
         Transform method (GCC-PHAT).
-        """
-        cutoff_index = self._compute_cutoff_index()
-        lowffts = rffts[:, :cutoff_index]  # Low pass filtered
-        auto_corr = lowffts[0, :] * lowffts[1:, :].conjugate()
-        auto_corr /= (np.abs(auto_corr) + consts.EPS)
-        # Get correlation values from time domain
-        corrs = np.zeros((self._n_mics - 1, self._n_theta * self._n_phi), 
-                          dtype=consts.COMPLEX_DTYPE)
-        if cutoff_index < self._dft_len/2. + 1:
-            for i in range(corrs.shape[1]):
-                shifted = auto_corr * self._lp_pos_shift_mats[:, :, i]
-                corrs[:, i] = shifted[:, 0] + 2 * np.sum(shifted[:, 1:],
-                                      axis=1)  # ifft for n = 0
-        else:
-            for i in range(corrs.shape[1]):
-                shifted = auto_corr * self._lp_pos_shift_mats[:, :, i]
-                corrs[:, i] = shifted[:, 0] + 2 * \
-                              np.sum(shifted[:, 1:-1], axis=1) + shifted[:, -1]
 
-        # Shaping function \sum_i (mic_corr_i)^k
-        k = 2  # Default value of coefficient
-        if len(args) > 0:
-          k = float(args[0])  # coefficient for shaping function
-        distr = np.maximum(np.sum(np.abs(corrs) ** k, axis=0), consts.EPS)
-        return distr
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. See _select_bins
+        :param shift_blocks: iterable of (start, shift_mats) tuples for pairs
+                             with the first mic. See _iter_distribution_beam
+        """
+        # The first pairs are those of the first mic with every other mic
+        auto_corr = spectra[0][..., :self._n_mics - 1, :]
+        auto_corr = auto_corr / (np.abs(auto_corr) + consts.EPS)
+        for start, shift_mats in shift_blocks:
+            # Get correlation values from time domain
+            corrs = self._steer_pairs(auto_corr, shift_mats, bins)
+            yield start, self._shape_correlations(corrs, *args)
 
-    def _get_distribution_beam(self, rffts, shift_mats, *args):
+    def _iter_distribution_beam(self, spectra, bins, shift_blocks, *args):
         """
         Use SRP from square of delay-and-sum beamformer output. This is described
         in the thesis, and can be done in the frequency domain
 
-        :param shift_mats: Crosspower shift matrix that will be applied to microphone
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. See _select_bins
+        :param shift_blocks: iterable of (start, shift_mats) tuples. shift_mats
+                           is a crosspower shift matrix that will be applied to microphone
                            pair cross power spectra to align them to certain direcitons
-                           Should be of size (n_mic_pairs x n_dft_bins x n_steering_directions)
-        :returns: steered response power -- n_steering_directions length vector
+                           Should be of size (n_mic_pairs x n_bins x n_block_directions)
+                           and covers steering directions starting at index start.
+                           See SteeringGeometry.iter_shift_blocks
+        :returns: generator of (start, srp) tuples where srp is the steered
+                  response power for each direction of the block
         """
-        cutoff_index = self._compute_cutoff_index()
-        lowffts = rffts[:, :cutoff_index]  # Low pass filtered
-        # Get cross power at each pair of mics
-        cp_pairs = self._get_crosspower_pairs(lowffts)
-        # Get cross power at mic pair consisting of same mic twice
-        mic_self_energy = lowffts * lowffts.conj()
+        # Cross power at each pair of mics, and at the mic pair consisting
+        # of the same mic twice
+        cp_pairs, mic_self_energy = spectra
 
         # Setup Frequency weighting function -- return a frequency weighted
         # version of a crosspower matrix
@@ -150,58 +1026,141 @@ class DistributionLocalizer(AudioLocalizer):
         else:
           weighted = PHAT
 
-        # Setup vector for steered response power result
-        n_directions = shift_mats.shape[2]
-        srp = np.empty((n_directions,))
-        for i in range(n_directions):
-            # Get between microphone energy
-            shifted_cps = cp_pairs * shift_mats[:, :, i]
-            srp[i] = np.abs(
-                2 * np.sum(np.sum(weighted(shifted_cps))) + \
-                    np.sum(np.sum(weighted(mic_self_energy))))
-        return srp
+        # Energy of each mic with itself does not depend on direction
+        self_energy = np.sum(np.sum(weighted(mic_self_energy), axis=-1),
+                             axis=-1)[..., np.newaxis]
+        # With a stack of frames the shifted spectra are n_frames times as
+        # large, so split the blocks to keep them within the block budget
+        n_frames = int(np.prod(cp_pairs.shape[:-2]))
+        for start, shift_mats in shift_blocks:
+            block_len = shift_mats.shape[2]
+            sub_len = max(1, int(math.ceil(block_len / float(n_frames))))
+            for sub_start in range(0, block_len, sub_len):
+                # Get between microphone energy
+                shifted_cps = cp_pairs[..., np.newaxis] * \
+                    shift_mats[:, :, sub_start:sub_start + sub_len]
+                srp = np.abs(2 * np.sum(np.sum(weighted(shifted_cps), axis=-3),
+                                        axis=-2) + self_energy)
+                yield start + sub_start, srp.astype(consts.REAL_DTYPE)
 
-    def _get_distribution_mcc(self, rffts, *args):
-        cutoff_index = self._compute_cutoff_index()
-        lowffts = rffts[:, :cutoff_index]  # Low pass filtered
-        cp_pairs = self._get_crosspower_pairs(lowffts)
+    def _iter_distribution_mcc(self, spectra, bins, shift_blocks, *args):
+        """
+        Get distribution using GCC-PHAT over all unique pairs of mics
+
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. See _select_bins
+        :param shift_blocks: iterable of (start, shift_mats) tuples for all
+                             pairs of mics. See _iter_distribution_beam
+        """
         # Use PHAT Transform
-        cp_pairs /= (np.abs(cp_pairs) + consts.EPS)
-        corrs = np.zeros((self._n_mic_pairs, self._n_theta * self._n_phi),
-                            dtype=consts.COMPLEX_DTYPE)
-        if cutoff_index < self._dft_len/2. + 1:
-            for i in range(self._n_theta * self._n_phi):
-                shifted = cp_pairs * self._all_lp_pos_shift_mats[:, :, i]
-                corrs[:, i] = shifted[:, 0] + \
-                    2 * np.sum(shifted[:, 1:], axis=1)  # ifft for n = 0
-        else:
-            for i in range(self._n_theta * self._n_phi):
-                shifted = cp_pairs * self._all_lp_pos_shift_mats[:, :, i]
-                corrs[:, i] = shifted[:, 0] + \
-                    2 * np.sum(shifted[:, 1:-1], axis=1) + shifted[:, -1]  
-        # Shaping function \sum_i (mic_corr_i)^k
+        cp_pairs = spectra[0] / (np.abs(spectra[0]) + consts.EPS)
+        for start, shift_mats in shift_blocks:
+            corrs = self._steer_pairs(cp_pairs, shift_mats, bins)
+            yield start, self._shape_correlations(corrs, *args)
+
+    def _shape_correlations(self, corrs, *args):
+        """
+        Combine the correlations of mic pairs for each direction with the
+        shaping function \sum_i (mic_corr_i)^k. The coefficient k may be
+        given as the first optional argument. Default is 2
+        """
         k = 2  # Default value of coefficient
         if len(args) > 0:
           k = float(args[0])  # coefficient for shaping function
-        distr = np.maximum(np.sum(np.abs(corrs) ** k, axis=0), consts.EPS) 
-        return distr
+        distr = np.maximum(np.sum(np.abs(corrs) ** k, axis=-2), consts.EPS)
+        return distr.astype(consts.REAL_DTYPE)
+
+    def _steer_pairs(self, cp_pairs, shift_mats, bins=None):
+        """
+        Align crosspower spectra to a set of directions and evaluate the
+        resulting correlations at n = 0 of the ifft. Only the positive
+        frequencies are given, so every coefficient other than DC (and the
+        nyquist frequency when it is included) is counted twice.
+
+        :param cp_pairs: crosspower spectra of size (n_pairs x n_bins), or a
+                         stack of them of size (n_frames x n_pairs x n_bins)
+        :param shift_mats: shift matrix of size (n_pairs x n_bins x n_directions)
+        :param bins: indices of the bins given, or None if they are the
+                     first n_bins bins
+        :returns: correlations of size (n_pairs x n_directions), with the
+                  leading frames axis of cp_pairs if it has one
+        """
+        if bins is None:
+            n_bins = shift_mats.shape[1]
+            bin_weights = 2 * np.ones((n_bins,), dtype=consts.REAL_DTYPE)
+            bin_weights[0] = 1
+            if n_bins >= self._dft_len / 2. + 1:
+                bin_weights[-1] = 1
+        else:
+            bin_weights = np.where((bins == 0) | (bins == self._dft_len / 2),
+                                   1, 2).astype(consts.REAL_DTYPE)
+        return np.einsum('...ik,ikj->...ij', cp_pairs * bin_weights, shift_mats)
+
+    def _iter_distribution_tdoa(self, spectra, bins, delays, *args):
+        """
+        Get distribution using GCC-PHAT over all pairs of mics, evaluated in
+        the time delay domain. This uses the real part of the correlations
+        summed by 'mcc'. Each pair's correlation is computed
+        with a single (optionally upsampled) inverse real FFT, and the value
+        for every search direction is then linearly interpolated at the
+        fractional lag stored in the lag tables. The cost per frame is
+        O(pairs * bins * log(bins) + pairs * directions) rather than
+        O(pairs * bins * directions).
+
+        :param spectra: spectra of the bins to use. See _get_spectra
+        :param bins: the bins of spectra, or None for all bins below the
+                     cutoff frequency. Other bins are left out of the lag
+                     domain correlations. See _select_bins
+        :param delays: None to use the lag tables of the search space, read
+                       in the same blocks as the 'all_lp_pos' shifts.
+                       Otherwise, delays between all pairs of mics for the
+                       directions to evaluate
+        """
+        # Use PHAT Transform
+        cp_pairs = spectra[0] / (np.abs(spectra[0]) + consts.EPS)
+        if bins is not None:
+            selected = cp_pairs
+            cp_pairs = np.zeros(selected.shape[:-1] + (bins[-1] + 1,),
+                                dtype=consts.COMPLEX_DTYPE)
+            cp_pairs[..., bins] = selected
+        lag_corrs = self._get_lag_correlations(cp_pairs)
+        if delays is not None:
+            corrs = self._geometry.lookup_lags(lag_corrs, delays)
+            yield 0, self._shape_correlations(corrs, *args)
+            return
+        block_len = self._geometry.get_block_len('all_lp_pos')
+        for start in range(0, self._n_directions, block_len):
+            corrs = self._geometry.lookup_lags(
+                lag_corrs, None, slice(start, start + block_len))
+            yield start, self._shape_correlations(corrs, *args)
+
+    def _get_lag_correlations(self, cp_pairs):
+        """
+        Bring weighted crosspower spectra into the lag domain.
+
+        :param cp_pairs: crosspower spectra of size (n_mic_pairs x n_bins)
+                         where n_bins is at most dft_len/2 + 1
+        :returns: matrix of size (n_mic_pairs x n_lags) where n_lags is
+                  dft_len * TDOA_UPSAMPLE of the geometry. Entry (i, n) is the
+                  correlation of pair i at lag n / TDOA_UPSAMPLE samples. The
+                  scaling matches the real part of the frequency domain sums
+                  used by 'mcc'
+        """
+        n_lags = self._geometry.get_lag_table_len()
+        return np.fft.irfft(cp_pairs, n=n_lags, axis=-1) * n_lags
 
     def _get_crosspower_pairs(self, rffts):
         """
-        Get the crosspower spectrum for every unique pair of microphones.
+        Get the crosspower spectrum for every selected pair of microphones.
         Row i will contain the cross power spectrum for the ith pair, between
         microphones j and k. This will be
           X_j(f)X_k(f)*
-
+        See SteeringGeometry.get_pairs
         """
-        cp_pairs = np.empty((self._n_mic_pairs, rffts.shape[1]), 
-                        dtype=consts.COMPLEX_DTYPE)
-        curr_ind = 0
-        for i in range(1, self._n_mics):
-            cp_pairs[curr_ind:curr_ind + self._n_mics-i, :] = \
-                rffts[i-1, :] * rffts[i:, :].conjugate()
-            curr_ind += self._n_mics-i
-        return cp_pairs
+        cp_pairs = rffts[..., self._pairs[:, 0], :] * \
+            rffts[..., self._pairs[:, 1], :].conjugate()
+        return cp_pairs.astype(consts.COMPLEX_DTYPE, copy=False)
 
     def get_3d_real_distribution(self, dfts):
         rffts = mat.to_real_matlab_format(dfts)
@@ -236,12 +1195,21 @@ class DistributionLocalizer(AudioLocalizer):
         Will return the distrbution array as a grid over spherical coords.
         This way, the grid can be used for plotting surfaces with meshed
         spherical coordinates. Axis 0 will vary with polar angle and
-        axis 1 will vary with azimuthal angle
+        axis 1 will vary with azimuthal angle. Grids other than the lattice
+        are resampled onto the lattice, whose coordinates are given by
+        get_lattice_spher_directions
         :param distr: array corresponding to the distribution given by a
                       call to get_3d_distribution
         :type distr: numpy array (vector)
         """
-        return np.reshape(distr, (self._n_phi, self._n_theta))
+        return self._geometry.to_spher_grid(distr)
+
+    def get_lattice_spher_directions(self):
+        """
+        Returns the spherical coordinates of the grid returned by
+        to_spher_grid, in the format of get_spher_directions
+        """
+        return self._geometry.get_lattice_spher_directions()
 
     def get_align_mat(self):
         """
@@ -249,13 +1217,13 @@ class DistributionLocalizer(AudioLocalizer):
         the FFTs of each microhpones signal, will align the signals
         as if they came from the different possible source directions.
 
-        The returned matrix is of size (nmics, dft_len, n_phi * n_theta)
+        The returned matrix is of size (nmics, dft_len, n_directions)
         Therefore, for a returned matrix 'mat', mat[:, :, i] will give
         the described alignment matrix for a source coming from direction
         (get_directions)[:, i]
         """
-        sm_copy = self._shift_mats.copy()
-        mic0_shifts = np.ones((1, self._dft_len, self._n_theta * self._n_phi))
+        sm_copy = self._geometry.get_shift_table('full', force=True).copy()
+        mic0_shifts = np.ones((1, self._dft_len, self._n_directions))
         return np.vstack((mic0_shifts, sm_copy))
 
     def get_pos_align_mat(self):
@@ -265,96 +1233,31 @@ class DistributionLocalizer(AudioLocalizer):
         to the positive frequencies and negative nyquist frequency, which
         assumes that the signals are real.
         """
-        sm_copy = self._pos_shift_mats.copy()
-        mic0_shifts = np.ones((1, self._dft_len / 2 + 1, self._n_theta * self._n_phi))
+        sm_copy = self._geometry.get_shift_table('pos', force=True).copy()
+        mic0_shifts = np.ones((1, self._dft_len / 2 + 1, self._n_directions))
         return np.vstack((mic0_shifts, sm_copy))
 
-    def _process_mic_positions(self, mic_positions):
-        mic_shape = mic_positions.shape
-        self._n_mics = mic_shape[0]
-        self._n_mic_pairs = (self._n_mics - 1) * self._n_mics / 2
-        self._n_dimensions = mic_shape[1]
-        if self._n_dimensions == 2:
-            if self._n_phi != 1:
-                ValueError("Number of phi search space samples must be 1 for " +
-                           "microphone coordinates in 2 dimensions")
-            self._mic_positions = np.concatenate((mic_positions.copy(), 
-                                    np.zeros((self._n_mics,1))), axis=1)
-            self._n_dimensions = 3
-        elif self._n_dimensions == 3:
-            self._mic_positions = mic_positions.copy()
-        else:
-            ValueError("Microphones must be specified in either 2 or 3 dimensions")
-            
-
-    def _setup_distances(self):
-        """
-        Setup array of distances between mics using the mic
-        layout given for this object
-        """
-        self._distances = self._mic_positions[1:, :] - self._mic_positions[0, :]
-        # Now setup all mic distances for more exhaustive algorithms
-        self._all_distances = np.empty(((self._n_mics - 1) * self._n_mics / 2, self._mic_positions.shape[1]))
-        curr_ind = 0
-        for i in range(1, self._n_mics):
-            self._all_distances[curr_ind:curr_ind + self._n_mics-i, :] = \
-                self._mic_positions[i:, :] - self._mic_positions[i-1, :]
-            curr_ind += self._n_mics - i
-            
-
-    def _setup_search_space(self):
-        """
-        Setup the search space for constructing the distribution of source
-        locations. This will be held in the member variable 'directions'.
-        This method will also setup the member variable 'delays', which
-        will contain the delays in samples between the first microphone and
-        every other microphone. Note that these sample delays may be non-integers.
-        """
-        # Setup angle space
-        if self._n_phi == 1: # 2d search space
-            theta = np.linspace(0, math.pi, self._n_theta)
-        else:
-            theta = np.linspace(0, 2 * math.pi, self._n_theta)
-        #theta = theta[:-1]  # Don't use both 0 and 2pi
-        phi = np.linspace(math.pi/2., 0, self._n_phi)[::-1] # Want to include pi/2 if self._n_phi == 1
-
-        # Setup array of direction vectors
-        self._directions = np.empty((3, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
-        self._spher_directions = np.empty((3, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
-        for p in range(self._n_phi):
-            for t in range(self._n_theta):
-                ind = p * self._n_theta + t
-                # Get cartestian coordinates
-                self._directions[0, ind] = np.sin(phi[p]) * np.cos(theta[t])  # x
-                self._directions[1, ind] = np.sin(phi[p]) * np.sin(theta[t])  # y
-                self._directions[2, ind] = np.cos(phi[p])  # z
-                # Get the spherical coordinates
-                self._spher_directions[0, ind] = 1
-                self._spher_directions[1, ind] = theta[t]
-                self._spher_directions[2, ind] = phi[p]
-
-    def _setup_freq_spaces(self):
-        # Setup delays between first mic and all others
-        self._delays = -1 * self._distances.dot(self._directions) * \
-                            self._sample_rate / consts.SPEED_OF_SOUND
-        # Setup delays between all unique pairs of mics
-        self._all_delays = -1 * self._all_distances.dot(self._directions) * \
-                                self._sample_rate / consts.SPEED_OF_SOUND
-        # Setup the various shift matrices
-        self._setup_shift_mats()
-        self._setup_pos_shift_mats()
-        self._setup_lp_pos_shift_mats()
-        # Store previous distribution for when signal energy is very low
-        self._prev_distr = \
-            np.zeros((4, self._n_phi * self._n_theta), dtype=consts.REAL_DTYPE)
-        self._prev_distr[:3, :] = self._directions
-
     def _get_srp_likelihood(self, rffts, directions):
-        delays = -1 * self._all_distances.dot(directions) * \
-            self._sample_rate / consts.SPEED_OF_SOUND
-        cutoff_index = self._compute_cutoff_index()
-        shift_mats = self._get_shifts_from_delays(delays, cutoff_index)
-        srp = self._get_distribution_beam(rffts, shift_mats)
+        """
+        Get the SRP-PHAT likelihood of each of the given directions. With
+        SRP_GRID_LIKELIHOOD, the steered response over the search space is
+        interpolated at the directions, so steering costs the same however
+        many directions there are. Directions outside the search space are
+        steered to directly.
+        :param rffts: positive half of the rffts of the frame, or an
+                      Observation of it
+        :param directions: matrix of unit vectors, one per column
+        """
+        frame = self._observe(rffts)
+        spectra = self._get_frame_spectra(frame)
+        if not self.SRP_GRID_LIKELIHOOD:
+            srp = self._get_steered_distribution(spectra, 'beam', directions)
+        else:
+            srp, covered = self._geometry.interpolate_distribution(
+                self._get_full_distribution(frame, 'beam'), directions)
+            if not np.all(covered):
+                srp[~covered] = self._get_steered_distribution(
+                    spectra, 'beam', directions[:, ~covered])
         srp /= (np.sum(srp) + consts.EPS) # Normalize
         srp = srp ** 3
         return srp
@@ -371,68 +1274,3 @@ class DistributionLocalizer(AudioLocalizer):
         if cutoff_index > self._dft_len / 2 + 1:
             cutoff_index = int(self._dft_len / 2 + 1)
         return cutoff_index
-            
-    def _setup_lp_pos_shift_mats(self):
-        """
-        Setup matrix that can be used to shift ffts to delays corresponding
-        with the search space. This will use only the positive frequencies
-        and will low pass filter the DFT using the frequency specified.
-        """
-        self._cutoff_index = self._compute_cutoff_index()
-        self._lp_pos_shift_mats = \
-            self._get_shifts_from_delays(self._delays, self._cutoff_index)
-        self._all_lp_pos_shift_mats = \
-            self._get_shifts_from_delays(self._all_delays, self._cutoff_index)
-
-    def _setup_pos_shift_mats(self):
-        """
-        Setup matrix that can be used to shift ffts to delays corresponding
-        with the search space. This will use only the positive frequencies
-        and negative nyquist frequency
-        """
-        self._pos_shift_mats = \
-            self._get_shifts_from_delays(self._delays, self._dft_len/2. + 1)
-
-    def _setup_shift_mats(self):
-        """
-        Setup matrix that can be used to shift ffts to delays corresponding
-        with the search space. 
-        """
-        self._shift_mats = self._get_shifts_from_delays(self._delays)
-
-    def _get_shifts_from_delays(self, delays, dft_coeff_n=None):
-        """
-        Compute matrix of multiplicative factors used to shift fourier 
-        transforms of signals, using provided delays. These will use
-        the delay in teh phase term
-        :param delays: Matrix of delays for each search direciton. Entry (i,j)
-                       contains the sample delay amount to align mic pair
-                       i for search direction j
-        :param dft_coeff_n: Number of first DFT coefficients to keep.
-                           To use only the positive frequencies in
-                           the DFT's, this should be dft_len/2+1. It is also
-                           possible to use this argument to enforce a LPF on
-                           the DFT
-        :returns: shift martrix where entry (i,j,k) is the multiplicative factor
-                  in the fourier domain to align mic-pair i at frequency j for
-                  search direction k
-        """
-        if dft_coeff_n is None:
-            dft_coeff_n = self._dft_len
-        # Avoid problems with dft_coeff_n values that don't make sense
-        if dft_coeff_n > self._dft_len/2. + 1 and dft_coeff_n != self._dft_len:
-            raise ValueError("If dft_coeff_n is not DFT_LEN it must be \
-                              at most DFT_LEN/2 + 1")
-        n_delays = delays.shape[1]
-        shift_mats = np.empty((delays.shape[0], dft_coeff_n, n_delays),
-                                    dtype=consts.COMPLEX_DTYPE)
-        nn = np.hstack((np.arange(0, self._dft_len / 2, dtype=consts.REAL_DTYPE),
-                        np.arange(-self._dft_len / 2, 0, dtype=consts.REAL_DTYPE)))
-        nn = nn[:dft_coeff_n] # Use first dft_coeff_n coefficients
-        for i in range(n_delays):
-            freqs = np.outer(delays[:, i], nn)
-            shift_mats[:, :, i] = np.exp(-1j * 2 * math.pi * freqs / self._dft_len)
-        return shift_mats
-
-
-
@@ -19,7 +19,7 @@ class GridTrackingLocalizer(TrackingLocalizer):
     """
     TrackingLocalizer.__init__(self, mic_positions, search_space, dft_len, 
                                sample_rate, n_theta, n_phi)
-    self._grid_size = self._n_theta * self._n_phi
+    self._grid_size = self._n_directions
     self._process_search_space(search_space)
     self._setup_posterior_grid()
     self._setup_state_model(source_cov)
@@ -44,6 +44,10 @@ class GridTrackingLocalizer(TrackingLocalizer):
     print "before: " + str(self._posterior_grid)
     pred = self._get_prediction()
     print "pred: " + str(pred.shape)
+    if not self.is_active():
+      # Frame did not pass the activity gate. Prediction step only
+      self._posterior_grid = pred / np.sum(pred)
+      return self._posterior_grid
     #pred /= (np.sum(pred) + consts.EPS)
     #d /= (np.sum(d) + consts.EPS)
     print "post: " + str(d.shape)
@@ -63,8 +67,8 @@ class GridTrackingLocalizer(TrackingLocalizer):
   
 
   def _setup_posterior_grid(self):
-    self._posterior_grid = (1. / (self._n_phi * self._n_theta)) * \
-                            np.ones((self._n_phi * self._n_theta,))
+    self._posterior_grid = (1. / self._grid_size) * \
+                            np.ones((self._grid_size,))
 
   def _setup_state_model(self, source_cov):
     # Transition parameters in state space (in physical space)
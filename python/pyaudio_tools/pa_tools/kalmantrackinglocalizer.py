@@ -38,7 +38,7 @@ class KalmanTrackingLocalizer(TrackingLocalizer):
     """
     TrackingLocalizer.__init__(self, mic_positions, search_space, dft_len, 
                                sample_rate, n_theta, n_phi)
-    self._grid_size = self._n_theta * self._n_phi
+    self._grid_size = self._n_directions
     self._process_search_space(search_space)
     self._setup_posterior_grid()
     self._setup_state_model(mic_forward, mic_above, trans_mat, state_cov, 
@@ -57,10 +57,17 @@ class KalmanTrackingLocalizer(TrackingLocalizer):
       self._transition_mat.dot(self._estimate_cov).dot(self._transition_mat.T) \
       + self._transformed_state_cov
     # Update
-    # Get observation
-    d, energy = self.get_distribution_real(rffts, *args)
-    max_ind = np.argmax(d)
-    obs = self._direction_to_plane_point(self._directions[:, max_ind])
+    # Get observation, searching around the predicted position when local
+    # search is enabled (see LOCAL_SEARCH_HOPS)
+    self.set_search_prior(state_pred[:3])
+    direction, d, energy = self.get_peak(rffts, *args)
+    if not self.is_active():
+      # Frame did not pass the activity gate. Prediction step only
+      self._state_estimate = state_pred
+      self._estimate_cov = cov_pred
+      self._estimate_cov[6, 6] = .01
+      return self._distribution_from_estimates(self._state_estimate, self._estimate_cov)
+    obs = self._direction_to_plane_point(direction)
     if obs is not None:
       # perform update step of KF
       innov = obs - self._emission_mat.dot(state_pred)
@@ -99,8 +106,8 @@ class KalmanTrackingLocalizer(TrackingLocalizer):
   
 
   def _setup_posterior_grid(self):
-    self._posterior_grid = (1. / (self._n_phi * self._n_theta)) * \
-                            np.ones((self._n_phi * self._n_theta,))
+    self._posterior_grid = (1. / self._grid_size) * \
+                            np.ones((self._grid_size,))
 
   def _setup_state_model(self, mic_forward, mic_above, trans_mat, state_cov, 
                          emission_mat, emission_cov):
@@ -0,0 +1,208 @@
+__author__ = 'Adam Miller'
+from pa_tools.distributionlocalizer import DistributionLocalizer
+import numpy as np
+import math
+import constants as consts
+
+
+class NearFieldLocalizer(DistributionLocalizer):
+    """
+    Localize a source by its position rather than its direction. Candidate
+    positions are steered to with delays from the exact distance between
+    each mic and the position, so sources close to the array are located
+    without the far field assumption.
+
+    The steered response is maximized by stochastic region contraction
+    (SRC): positions are drawn at random from the search region, the region
+    contracts to the bounding box of the best positions found so far, and
+    this repeats until the region is small. A frame costs at most
+    SRC_INITIAL_POINTS + SRC_ITERATIONS * SRC_POINTS evaluations rather than
+    one for every point of a dense grid of positions.
+    """
+    SRC_INITIAL_POINTS = 1000  # Positions drawn from the whole search region
+    SRC_POINTS = 300  # Positions drawn from each contracted region
+    SRC_KEEP = 40  # Number of best positions spanning the contracted region
+    SRC_ITERATIONS = 10  # Maximum number of contractions
+    SRC_MIN_EXTENT = .005  # in meters. Stop once the region is this small
+
+    def __init__(self, mic_positions, bounds, planes=None, *args, **kwargs):
+        """
+        :param mic_positions: locations of microphones. Each row should be the
+                            location of a given microphone. The dimension
+                            is taken to be the number of columns of this
+                            matrix
+        :type mic_positions: numpy array
+        :param bounds: matrix of size (2 x 3) holding the lower and upper
+                       corners of the box of positions to search, in the
+                       coordinates of the mic positions
+        :param planes: optional list of SourcePlane objects, in the
+                       coordinates of the mic positions. When given, only
+                       positions on the planes and within bounds are searched
+        :type planes: list
+
+        Other arguments are those of DistributionLocalizer. Its far field
+        methods remain available
+        """
+        DistributionLocalizer.__init__(self, mic_positions, *args, **kwargs)
+        self._bounds = np.asarray(bounds, dtype=float)
+        if self._bounds.shape != (2, 3):
+            raise ValueError("bounds must hold the lower and upper corners " +
+                             "of a 3d box")
+        self._setup_regions(planes)
+        self._prev_position = None
+        self._prev_value = 0.
+
+    def get_position(self, rffts, method='beam', *args):
+        """
+        Get the position of the strongest source
+
+        :param rffts: positive half of the observed rffts, or an Observation
+                      of the frame
+        :param method: method for computing the steered response. See
+                       DistributionLocalizer.get_distribution_real. Default
+                       is 'beam', which is SRP-PHAT
+        :param args: optional arguments specific to the method chosen
+        :returns: (position, value, energy) tuple. position is a 3d vector
+                  in the coordinates of the mic positions, value the steered
+                  response there and energy that of the frame. If
+                  ENERGY_GATE is set and the frame does not pass the gate,
+                  the position and value of the last frame that did are
+                  returned instead
+        """
+        obs = self._observe(rffts)
+        energy = self._get_frame_energy(obs)
+        if not self._gate_observation(obs):
+            return self._prev_position, self._prev_value, energy
+        position, value = self._contract_regions(self._get_frame_spectra(obs),
+                                                 method, *args)
+        self._prev_position = position
+        self._prev_value = value
+        return position, value, energy
+
+    def get_bounds(self):
+        return self._bounds
+
+    def _setup_regions(self, planes):
+        """
+        Setup the regions searched by SRC. Each region is a tuple
+        (origin, basis, lower, upper) holding the positions
+        origin + basis.dot(t) where lower <= t <= upper. The box has a
+        single region with a 3d basis. Each source plane that passes through
+        the box has a region with a 2d basis in the plane, covering the
+        part of the plane within the box
+        """
+        lower, upper = self._bounds
+        if planes is None:
+            self._regions = [(np.zeros(3), np.eye(3), lower, upper)]
+            return
+        center = (lower + upper) / 2.
+        radius = np.linalg.norm(upper - lower) / 2.
+        self._regions = []
+        for plane in planes:
+            normal = plane.get_normal() / np.linalg.norm(plane.get_normal())
+            origin = center - normal * normal.dot(center - plane.get_offset())
+            if np.linalg.norm(origin - center) > radius:
+                continue  # Plane does not pass through the box
+            if hasattr(plane, 'get_transform_mat'):
+                # Right and up vectors of an OrientedSourcePlane
+                basis = plane.get_transform_mat()[:, :2]
+            else:
+                axis = np.array([0., 0., 1.]) if abs(normal[2]) < .9 \
+                    else np.array([1., 0., 0.])
+                right = np.cross(normal, axis)
+                right /= np.linalg.norm(right)
+                basis = np.array([right, np.cross(normal, right)]).T
+            self._regions.append((origin, basis, -radius * np.ones(2),
+                                  radius * np.ones(2)))
+        if len(self._regions) == 0:
+            raise ValueError("None of the source planes pass through bounds")
+
+    def _contract_regions(self, spectra, method, *args):
+        """
+        Find the position with the strongest steered response by stochastic
+        region contraction. The points drawn in each round are divided
+        between the regions by the number of best positions they hold.
+        :returns: (position, value) tuple
+        """
+        bins, spectra = self._get_steering_spectra(spectra)
+        regions = list(self._regions)
+        counts = [max(1, self.SRC_INITIAL_POINTS / len(regions))] * len(regions)
+        # Best positions so far, their values and their regions
+        best = np.empty((3, 0))
+        best_values = np.empty((0,))
+        best_regions = np.empty((0,), dtype=int)
+        for iteration in range(self.SRC_ITERATIONS + 1):
+            positions, region_inds = self._draw_positions(regions, counts)
+            values = self._evaluate_positions(spectra, bins, method,
+                                              positions, *args)
+            best = np.hstack((best, positions))
+            best_values = np.hstack((best_values, values))
+            best_regions = np.hstack((best_regions, region_inds))
+            keep = np.argsort(-best_values)[:self.SRC_KEEP]
+            keep = keep[np.isfinite(best_values[keep])]
+            best, best_values, best_regions = \
+                best[:, keep], best_values[keep], best_regions[keep]
+            if best_values.size == 0 or iteration == self.SRC_ITERATIONS:
+                break
+            # Contract each region to the bounding box of its best positions
+            max_extent = 0.
+            for i, (origin, basis, lower, upper) in enumerate(regions):
+                coords = basis.T.dot(best[:, best_regions == i] -
+                                     origin[:, np.newaxis])
+                if coords.shape[1] == 0:
+                    counts[i] = 0
+                    continue
+                regions[i] = (origin, basis, np.min(coords, axis=1),
+                              np.max(coords, axis=1))
+                max_extent = max(max_extent, np.max(regions[i][3] - regions[i][2]))
+                counts[i] = int(math.ceil(self.SRC_POINTS *
+                                          np.sum(best_regions == i) /
+                                          float(best_regions.size)))
+            if max_extent < self.SRC_MIN_EXTENT:
+                break
+        if best_values.size == 0:
+            return self._prev_position, self._prev_value
+        return best[:, 0], best_values[0]
+
+    def _draw_positions(self, regions, counts):
+        """
+        Draw positions uniformly from each region
+        :param counts: number of positions to draw from each region
+        :returns: (positions, region_inds) tuple. positions is a matrix of
+                  size (3 x n_positions) and region_inds holds the region
+                  each position was drawn from
+        """
+        positions = []
+        region_inds = []
+        for i, (origin, basis, lower, upper) in enumerate(regions):
+            if counts[i] <= 0:
+                continue
+            coords = lower[:, np.newaxis] + (upper - lower)[:, np.newaxis] * \
+                np.random.rand(lower.size, counts[i])
+            positions.append(origin[:, np.newaxis] + basis.dot(coords))
+            region_inds.append(i * np.ones((counts[i],), dtype=int))
+        return np.hstack(positions), np.hstack(region_inds)
+
+    def _evaluate_positions(self, spectra, bins, method, positions, *args):
+        """
+        Evaluate the steered response at the given positions. Positions
+        outside of the bounds get a value of -inf
+        :param spectra: spectra to steer with. See
+                        DistributionLocalizer._get_steering_spectra
+        """
+        values = -np.inf * np.ones((positions.shape[1],))
+        inside = np.all((positions >= self._bounds[0, :, np.newaxis] - consts.EPS) &
+                        (positions <= self._bounds[1, :, np.newaxis] + consts.EPS),
+                        axis=0)
+        inside_inds = np.nonzero(inside)[0]
+        all_pairs = method != 'gcc'
+        block_len = self._geometry.get_block_len(
+            'all_lp_pos' if all_pairs else 'lp_pos')
+        for start in range(0, inside_inds.size, block_len):
+            inds = inside_inds[start:start + block_len]
+            delays = self._geometry.compute_position_delays(positions[:, inds],
+                                                            all_pairs)
+            values[inds] = np.hstack([distr for block_start, distr in
+                                      self._iter_delay_distribution(
+                                          spectra, bins, method, delays, *args)])
+        return values
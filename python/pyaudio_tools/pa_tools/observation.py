@@ -0,0 +1,44 @@
+__author__ = 'Adam Miller'
+
+
+class Observation(object):
+    """
+    One STFT frame together with everything localizers derive from it, such
+    as its crosspower spectra, energy, distributions and peaks. Each of these
+    is computed the first time a localizer asks for it and then reused by
+    every other localizer or tracker given the same observation in place of
+    the rffts of the frame. Running several trackers on a frame then costs
+    one localization plus the tracker updates.
+
+    Results are stored per SteeringGeometry, so localizers that share an
+    observation should also share their geometry (see
+    DistributionLocalizer.get_geometry) and settings. State kept by each
+    localizer, such as its activity gate and local search, is not shared.
+    """
+
+    def __init__(self, rffts, frame_id=None):
+        """
+        :param rffts: positive half of the rffts of the frame
+        :param frame_id: optional identifier of the frame, such as its index
+                         in the stream
+        """
+        self._rffts = rffts
+        self._frame_id = frame_id
+        self._results = {}
+
+    def get_rffts(self):
+        return self._rffts
+
+    def get_frame_id(self):
+        return self._frame_id
+
+    def get(self, key, fcn):
+        """
+        Get the result stored under key, computing it as fcn() the first
+        time it is asked for
+        :param key: hashable key identifying the result
+        :param fcn: function of no arguments computing the result
+        """
+        if key not in self._results:
+            self._results[key] = fcn()
+        return self._results[key]
@@ -0,0 +1,318 @@
+__author__ = 'Adam Miller'
+import math
+
+import numpy as np
+import scipy.stats
+
+
+class ParticleSet(object):
+  """
+  Weighted set of particles, the posterior of the particle filter trackers.
+  Particles and weights are held in contiguous arrays and every step works
+  on the whole set at once. Has the particles and weights members and the
+  methods of pybayes EmpPdf used with posteriors, so can be used in its place.
+
+  The log of each weight is kept in log_weights. Likelihoods are applied to
+  these by reweight, so particles far from the observation keep a small
+  weight rather than underflowing to 0. Call normalise_weights after
+  changing weights directly to bring the two back in line
+  """
+  RESAMPLE_METHODS = ['systematic', 'stratified', 'residual']
+
+  def __init__(self, particles, weights=None):
+    """
+    :param particles: matrix of size (n_particles x n_dimensions) holding a
+                      particle in each row
+    :param weights: weight of each particle. Default is uniform
+    """
+    self.particles = np.ascontiguousarray(particles, dtype=float)
+    if self.particles.ndim != 2:
+      raise ValueError("particles must be a 2d array")
+    self._setup_weights(self.particles.shape[0], weights)
+
+  def _setup_weights(self, n, weights):
+    if weights is None:
+      self.weights = np.ones((n,)) / n
+    else:
+      self.weights = np.array(weights, dtype=float)
+      if self.weights.shape != (n,):
+        raise ValueError("Must have one weight for each particle")
+    with np.errstate(divide='ignore'):
+      self.log_weights = np.log(self.weights)
+
+  def get_n_particles(self):
+    return self.particles.shape[0]
+
+  def shape(self):
+    return self.particles.shape[1]
+
+  def mean(self, cond=None):
+    return self.weights.dot(self.particles)
+
+  def variance(self, cond=None):
+    return self.weights.dot(self.particles ** 2) - self.mean() ** 2
+
+  def get_ess(self):
+    """
+    Get the effective sample size of the normalised weights, 1 / sum_i w_i^2.
+    This is n_particles for uniform weights and 1 when one particle holds
+    all the weight
+    """
+    return 1. / np.sum(self.weights ** 2)
+
+  def needs_resample(self, ess_fraction):
+    """
+    Whether the particles have degenerated enough to resample, that is
+    whether the effective sample size is below ess_fraction times the number
+    of particles. See get_ess
+    """
+    return self.get_ess() < ess_fraction * self.get_n_particles()
+
+  def propagate(self, cpdf):
+    """
+    Move every particle by drawing from cpdf conditioned on it
+    :param cpdf: conditional pdf supporting samples_batch, such as
+                 VonMisesCPdf
+    """
+    self.particles[:] = cpdf.samples_batch(self.particles)
+
+  def get_log_likelihoods(self, cpdf, y):
+    """
+    Get the log likelihood of observation y given each particle
+    :param cpdf: conditional pdf of the observation supporting
+                 eval_log_batch, such as VonMisesCPdf
+    """
+    return cpdf.eval_log_batch(y, self.particles)
+
+  def normalise_weights(self):
+    """
+    Scale weights so they sum to one
+    """
+    if np.any(self.weights < 0.):
+      raise ValueError("Weights must not be negative")
+    total = np.sum(self.weights)
+    if total == 0:
+      raise ValueError("Sum of weights is 0: weights cannot be normalised")
+    self.weights /= total
+    with np.errstate(divide='ignore'):
+      self.log_weights[:] = np.log(self.weights)
+    return True
+
+  def reweight(self, log_likelihoods):
+    """
+    Multiply the weight of each particle by its likelihood and normalise the
+    weights. The update is done on the log weights, normalising with
+    log-sum-exp
+    :param log_likelihoods: log likelihood of each particle
+    :returns: False if no particle has a nonzero likelihood, in which case
+              the weights are left unchanged. True otherwise
+    """
+    log_weights = self.log_weights + log_likelihoods
+    max_log = np.max(log_weights)
+    if not np.isfinite(max_log):
+      return False
+    log_weights -= max_log + np.log(np.sum(np.exp(log_weights - max_log)))
+    self.log_weights[:] = log_weights
+    self.weights[:] = np.exp(log_weights)
+    return True
+
+  def get_angle_bins(self, theta_width, phi_width=0):
+    """
+    Get the bin of each particle on a fixed histogram over azimuthal angle
+    and, for 3d particles, polar angle. Binning costs O(n_particles) however
+    fine the bins are. See get_kld_resample_indices
+    :param theta_width: width of the bins in azimuthal angle, in radians
+    :param phi_width: width of the bins in polar angle. 0 bins by azimuthal
+                      angle alone
+    :returns: integer bin of each particle
+    """
+    particles = self.particles
+    bins = self._quantise_angles(np.arctan2(particles[:, 1], particles[:, 0]),
+                                 theta_width)
+    if particles.shape[1] < 3 or phi_width <= 0:
+      return bins
+    phi = np.arccos(np.clip(particles[:, 2], -1, 1))
+    n_theta_bins = int(math.ceil(2 * math.pi / theta_width))
+    return self._quantise_angles(phi, phi_width) * n_theta_bins + bins
+
+  def get_resample_indices(self, method='systematic', n=None):
+    """
+    Get the indices of the particles kept by resampling. Does not modify the
+    particle set
+    :param method: 'systematic' (default) or 'stratified', which draw
+                   particles at n evenly spaced points of the cumulative
+                   weights using one or n random offsets, or 'residual',
+                   which keeps floor(n * w_i) copies of each particle and
+                   draws the rest in proportion to what is left over
+    :param n: number of particles to draw. Default is the current number
+    :returns: integer array of length n. Particle i of the resampled set is
+              the particle at the ith index
+    """
+    if method not in self.RESAMPLE_METHODS:
+      raise ValueError("Resampling method must be one of " +
+                       str(self.RESAMPLE_METHODS))
+    if n is None:
+      n = self.weights.shape[0]
+    if method == 'residual':
+      counts = np.floor(n * self.weights).astype(int)
+      n_particles = self.weights.shape[0]
+      kept = np.repeat(np.arange(n_particles), counts)
+      n_rest = n - kept.size
+      if n_rest <= 0:
+        return kept[:n]
+      residuals = n * self.weights - counts
+      rest = self._invert_cumulative(residuals, np.sort(np.random.rand(n_rest)))
+      return np.hstack((kept, rest))
+    if method == 'systematic':
+      offsets = np.random.rand()
+    else:
+      offsets = np.random.rand(n)
+    return self._invert_cumulative(self.weights, (np.arange(n) + offsets) / n)
+
+  def get_kld_resample_indices(self, bins, min_n, max_n, epsilon=.05,
+                               delta=.01, method='systematic'):
+    """
+    Get the indices of the particles kept by KLD-sampling (Fox, 2003). The
+    number of particles drawn is just enough that, with probability
+    1 - delta, the KL divergence between the particles and the posterior
+    is at most epsilon, given the number of bins the particles occupy. A
+    tight posterior occupies few bins and needs few particles, a diffuse
+    one many. Does not modify the particle set
+    :param bins: integer bin of each particle, such as the nearest direction
+                 of a grid
+    :param min_n: least number of particles to draw
+    :param max_n: greatest number of particles to draw
+    :param epsilon: bound on the KL divergence
+    :param delta: probability of the bound not holding
+    :param method: resampling method. See get_resample_indices
+    :returns: integer array of the indices kept, of length between min_n
+              and max_n
+    """
+    # Draw max_n particles in random order, then keep the first n for which
+    # n reaches the bound for the bins occupied by those n
+    inds = self.get_resample_indices(method, max_n)
+    inds = inds[np.random.permutation(max_n)]
+    first_inds = np.unique(np.asarray(bins)[inds], return_index=True)[1]
+    is_new_bin = np.zeros((max_n,), dtype=int)
+    is_new_bin[first_inds] = 1
+    bounds = self._get_kld_bound(np.cumsum(is_new_bin), epsilon, delta)
+    n_drawn = np.arange(1, max_n + 1)
+    enough = np.nonzero((n_drawn >= bounds) & (n_drawn >= min_n))[0]
+    if enough.size == 0:
+      return inds
+    return inds[:enough[0] + 1]
+
+  def resample(self, method='systematic', inds=None):
+    """
+    Replace low weight particles by copies of high weight ones and reset
+    the weights to uniform
+    :param method: resampling method. See get_resample_indices
+    :param inds: optional indices of the particles to keep, as returned by
+                 get_resample_indices. Found using method if not given. The
+                 number of particles becomes the number of indices
+    """
+    if inds is None:
+      inds = self.get_resample_indices(method)
+    self.particles = self.particles[inds]
+    self._setup_weights(len(inds), None)
+    return True
+
+  def _get_kld_bound(self, n_bins, epsilon, delta):
+    """
+    Get the number of particles needed by KLD-sampling for each number of
+    occupied bins
+    """
+    z = scipy.stats.norm.ppf(1 - delta)
+    k = np.maximum(np.asarray(n_bins, dtype=float) - 1, 1)
+    a = 2. / (9 * k)
+    bounds = k / (2 * epsilon) * (1 - a + np.sqrt(a) * z) ** 3
+    return np.where(np.asarray(n_bins) > 1, bounds, 1)
+
+  def _quantise_angles(self, angles, width):
+    return np.floor(np.mod(angles, 2 * math.pi) / width).astype(int)
+
+  def _invert_cumulative(self, weights, points):
+    """
+    Get the index of the particle whose span of the cumulative weights
+    holds each point
+    :param points: sorted points in [0, 1)
+    """
+    cum_weights = np.cumsum(weights)
+    inds = np.searchsorted(cum_weights, points * cum_weights[-1], side='right')
+    return np.minimum(inds, weights.shape[0] - 1)
+
+
+class AngleParticleSet(ParticleSet):
+  """
+  Weighted set of particles on the unit circle, each held as a single
+  float32 angle rather than a 2d unit vector. Particles are propagated and
+  weighted in angle space, so no vectors are formed or renormalised on
+  each frame. The particles member gives the unit vectors, computed each
+  time it is read, so the set can be used in place of a ParticleSet of 2d
+  vectors
+  """
+  ANGLE_DTYPE = np.float32
+
+  def __init__(self, angles, weights=None):
+    """
+    :param angles: angle of each particle, in radians
+    :param weights: weight of each particle. Default is uniform
+    """
+    self.angles = np.ascontiguousarray(angles, dtype=self.ANGLE_DTYPE)
+    if self.angles.ndim != 1:
+      raise ValueError("angles must be a 1d array")
+    self._setup_weights(self.angles.size, weights)
+
+  @classmethod
+  def from_vectors(cls, vectors, weights=None):
+    """
+    Create a set from particles given as 2d vectors, one per row
+    """
+    vectors = np.asarray(vectors)
+    return cls(np.arctan2(vectors[:, 1], vectors[:, 0]), weights)
+
+  @property
+  def particles(self):
+    return np.array([np.cos(self.angles), np.sin(self.angles)]).T
+
+  def get_n_particles(self):
+    return self.angles.size
+
+  def shape(self):
+    return 2
+
+  def mean(self, cond=None):
+    return np.array([self.weights.dot(np.cos(self.angles)),
+                     self.weights.dot(np.sin(self.angles))])
+
+  def variance(self, cond=None):
+    return np.array([self.weights.dot(np.cos(self.angles) ** 2),
+                     self.weights.dot(np.sin(self.angles) ** 2)]) - \
+        self.mean() ** 2
+
+  def propagate(self, cpdf):
+    """
+    Move every particle by drawing from cpdf conditioned on it
+    :param cpdf: 2d conditional pdf supporting samples_angles, such as
+                 VonMisesCPdf
+    """
+    self.angles[:] = cpdf.samples_angles(self.angles)
+
+  def get_log_likelihoods(self, cpdf, y):
+    """
+    Get the log likelihood of observation y given each particle
+    :param cpdf: 2d conditional pdf of the observation supporting
+                 eval_log_angles, such as VonMisesCPdf
+    :param y: observation as a 2d vector
+    """
+    return cpdf.eval_log_angles(np.arctan2(y[1], y[0]), self.angles)
+
+  def get_angle_bins(self, theta_width, phi_width=0):
+    return self._quantise_angles(self.angles, theta_width)
+
+  def resample(self, method='systematic', inds=None):
+    if inds is None:
+      inds = self.get_resample_indices(method)
+    self.angles = self.angles[inds]
+    self._setup_weights(len(inds), None)
+    return True
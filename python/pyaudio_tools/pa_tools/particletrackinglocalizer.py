@@ -0,0 +1,91 @@
+__author__ = 'Adam Miller'
+from trackinglocalizer import TrackingLocalizer
+from pa_tools.particleset import ParticleSet, AngleParticleSet
+
+
+class ParticleTrackingLocalizer(TrackingLocalizer):
+  """
+  Base of the particle filter trackers. Holds the posterior as a ParticleSet
+  and decides when it is resampled and how many particles are kept
+  """
+  RESAMPLE_METHOD = 'systematic' # See ParticleSet.get_resample_indices
+  # Resample once the effective sample size falls below this fraction of the
+  # number of particles. Set to 1 to resample every frame
+  RESAMPLE_ESS_FRACTION = .5
+  # With max_particles, the number of particles adapts so that the particles
+  # are within KLD_EPSILON in KL divergence of the posterior with probability
+  # 1 - KLD_DELTA. See ParticleSet.get_kld_resample_indices
+  KLD_EPSILON = .05
+  KLD_DELTA = .01
+
+  def __init__(self, *args, **kwargs):
+    """
+    :param max_particles: optional keyword argument. When given, the number of
+                          particles adapts each frame between n_particles and
+                          max_particles by KLD-sampling over the direction
+                          grid, growing when the posterior is diffuse and
+                          shrinking when it is tight. See get_n_particles
+    :param angle_state: optional keyword argument. When True, each particle of
+                        a planar (n_phi == 1) tracker is held as a single
+                        float32 angle. The posterior is then an
+                        AngleParticleSet, whose particles are unit vectors
+                        computed on request
+
+    All other parameters will be passed to TrackingLocalizer in the form of *args
+    and **kwargs
+    """
+    self._max_particles = kwargs.pop('max_particles', None)
+    self._angle_state = kwargs.pop('angle_state', False)
+    TrackingLocalizer.__init__(self, *args, **kwargs)
+
+  def get_n_particles(self):
+    """
+    Get the number of particles in use, which sets the cost of each frame.
+    Changes from frame to frame when max_particles is given
+    """
+    return self._posterior.get_n_particles()
+
+  def _setup_posterior(self, init_distribution, n_particles):
+    """
+    Setup the posterior with particles drawn from init_distribution. With
+    max_particles it starts from the most particles, as the initial
+    posterior is diffuse
+    """
+    if self._max_particles is not None and self._max_particles < n_particles:
+      raise ValueError("max_particles must be at least n_particles")
+    n_initial = n_particles if self._max_particles is None else self._max_particles
+    samples = init_distribution.samples(n_initial)
+    if self._angle_state:
+      if samples.shape[1] != 2:
+        raise ValueError("angle_state can only be used when tracking in 2d")
+      self._posterior = AngleParticleSet.from_vectors(samples)
+    else:
+      self._posterior = ParticleSet(samples)
+
+  def _needs_resample(self):
+    """
+    Whether the particles have degenerated enough to resample. See
+    RESAMPLE_ESS_FRACTION. With max_particles the number of particles adapts
+    only on these frames, so frames whose particles are still well spread
+    keep them rather than adding resampling noise
+    """
+    return self._posterior.needs_resample(self.RESAMPLE_ESS_FRACTION)
+
+  def _get_resample_indices(self):
+    """
+    Get the indices of the particles kept by resampling. With max_particles,
+    the number kept is chosen by KLD-sampling
+    """
+    if self._max_particles is None:
+      return self._posterior.get_resample_indices(self.RESAMPLE_METHOD)
+    return self._posterior.get_kld_resample_indices(
+      self._get_particle_bins(), self._n_particles, self._max_particles,
+      self.KLD_EPSILON, self.KLD_DELTA, self.RESAMPLE_METHOD)
+
+  def _get_particle_bins(self):
+    """
+    Get the bin of each particle for KLD-sampling, on a histogram over
+    angles with the spacing of the search space grid
+    """
+    theta_step, phi_step = self._get_grid_steps()
+    return self._posterior.get_angle_bins(theta_step, phi_step)
@@ -1,5 +1,11 @@
+import os
+import shutil
+import tempfile
+from distutils.ccompiler import new_compiler
 from distutils.core import setup
+from distutils.errors import CompileError, LinkError
 from distutils.extension import Extension
+from distutils.sysconfig import customize_compiler
 from Cython.Distutils import build_ext
 import numpy as np
 
@@ -17,6 +23,33 @@ LDFLAGS = [
     ]
 c_src = audio_dir_base + "src/"
 
+
+def has_openmp():
+    """
+    Check whether the C compiler builds and links a program with -fopenmp.
+    Compilers such as Apple clang reject the flag
+    """
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp_dir, "openmp_test.c")
+        with open(src, "w") as f:
+            f.write("#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n")
+        objects = compiler.compile([src], output_dir=tmp_dir,
+                                   extra_postargs=["-fopenmp"])
+        compiler.link_executable(objects, os.path.join(tmp_dir, "openmp_test"),
+                                 extra_postargs=["-fopenmp"])
+        return True
+    except (CompileError, LinkError):
+        return False
+    finally:
+        shutil.rmtree(tmp_dir)
+
+# Without OpenMP the steering kernel is built serial, as its prange loops
+# then run on one thread
+OPENMP_FLAGS = ["-fopenmp"] if has_openmp() else []
+
 setup(
     cmdclass={'build_ext': build_ext},
     ext_modules=[
@@ -24,6 +57,12 @@ setup(
                   ["stftmanager.pyx", c_src + "realtimestft.c"],
                   include_dirs=[np.get_include()],
                   extra_link_args=LDFLAGS,
-                  extra_compile_args=CFLAGS)
+                  extra_compile_args=CFLAGS),
+        # Steering kernel used by DistributionLocalizer when it is built
+        Extension("steeringkernel",
+                  ["steeringkernel.pyx"],
+                  include_dirs=[np.get_include()],
+                  extra_link_args=OPENMP_FLAGS,
+                  extra_compile_args=["-O3"] + OPENMP_FLAGS)
     ]
 )
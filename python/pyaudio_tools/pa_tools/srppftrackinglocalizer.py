@@ -7,12 +7,11 @@ import pybayes as pb
 import math
 import constants as consts
 import sys
-from trackinglocalizer import TrackingLocalizer
+from particletrackinglocalizer import ParticleTrackingLocalizer
 from pa_tools.vonmisescpdf import VonMisesCPdf
 from pa_tools.vonmisespdf import VonMisesPdf
-from pybayes import EmpPdf
 
-class SRPPFTrackingLocalizer(TrackingLocalizer):
+class SRPPFTrackingLocalizer(ParticleTrackingLocalizer):
 
   def __init__(self, n_particles, state_kappa, *args, **kwargs):
     """
@@ -23,15 +22,21 @@ class SRPPFTrackingLocalizer(TrackingLocalizer):
     :param n_particles: number of particles to use
     :param state_kappa: concentration parameter for state von mises distribution
     
-    All other parameters will be passed to TrackingLocalizer in the form of *args
-    and **kwargs
+    All other parameters, such as max_particles, will be passed to
+    ParticleTrackingLocalizer in the form of *args and **kwargs
     """
-    TrackingLocalizer.__init__(self, *args, **kwargs)
-    self._grid_size = self._n_theta * self._n_phi
+    ParticleTrackingLocalizer.__init__(self, *args, **kwargs)
+    self._grid_size = self._n_directions
     self._setup_particle_filters(n_particles, state_kappa)
 
   def get_distribution(self, rffts):
-    self._doa_bayes(rffts)
+    # The gate and the likelihood share the spectra of one Observation
+    obs = self._observe(rffts)
+    if self.gate_frame(obs):
+      self._doa_bayes(obs)
+    else:
+      # Frame did not pass the activity gate. Nothing observed
+      self._predict()
     return self._posterior
 
   def _setup_particle_filters(self, n_particles, state_kappa):
@@ -57,30 +62,43 @@ class SRPPFTrackingLocalizer(TrackingLocalizer):
       VonMisesPdf(init_mu, init_kappa, self._x0)
 
     # Do particle filtering ourselves...
-    self._posterior = EmpPdf(self._init_distribution.samples(self._n_particles))
+    self._setup_posterior(self._init_distribution, n_particles)
     self._estimate = self._get_estimate()
     self._count = 0
 
+  def _predict(self):
+    """
+    Prediction step only, for frames without an observation. Particles move
+    according to the state distribution and keep their weights
+    """
+    self._posterior.propagate(self._state_distribution)
+    self._estimate = self._get_estimate()
+
   def _doa_bayes(self, rffts):
     """
     Particle filtering using SRP-PHAT as likelihood measure of observation
+    :returns: False if the likelihood could not weight the particles, in
+              which case only the prediction step is done. True otherwise
     """
     # resample -- do it here so that the weights will be available after one run
     # of inference.
-    self._posterior.resample()
-    for i in range(self._posterior.particles.shape[0]):
-      # generate new ith particle:
-      self._posterior.particles[i] = \
-        self._state_distribution.sample(self._posterior.particles[i])
+    if self._needs_resample():
+      self._posterior.resample(inds=self._get_resample_indices())
+    # generate new particles:
+    self._posterior.propagate(self._state_distribution)
     # Get SRP likelihood
     particles_3d = self._to_3d_particles(self._posterior.particles).T
     # Get likelihoods
     srp = self._get_srp_likelihood(rffts, particles_3d)
-    srp -= np.min(srp)
-    srp /= (np.sum(srp) + consts.EPS)
-    self._posterior.weights *= srp
-    # assure that weights are normalised
-    self._posterior.normalise_weights()
+    # Shift so the weakest particle has the least likelihood. The floor keeps
+    # every likelihood above 0, so a flat srp leaves the weights as they are
+    srp = srp - np.min(srp) + consts.EPS
+    srp /= np.sum(srp)
+    # Weight and normalise
+    if not self._posterior.reweight(np.log(srp)):
+      # No usable likelihood. Keep the prediction as it is
+      return False
+    self._estimate = self._get_estimate()
     return True
 
   def _get_effective_n_dimensions(self):
@@ -98,7 +116,5 @@ class SRPPFTrackingLocalizer(TrackingLocalizer):
     return np.hstack((np.asarray(mat), np.zeros((mat.shape[0], 1))))
 
   def _get_estimate(self):
-      w = np.asarray(self._posterior.weights)
-      parts = np.asarray(self._posterior.particles)
-      return w.dot(parts)
+      return self._posterior.mean()
 
@@ -0,0 +1,967 @@
+__author__ = 'Adam Miller'
+import numpy as np
+import math
+import constants as consts
+import tablecache
+from mattools import mattools as mat
+
+
+class SteeringGeometry(object):
+    """
+    Geometry of a microphone array together with a far field search space
+    and all steering tables derived from them: directions, delays, lag
+    lookup tables and shift matrices. Tables are read only, so one instance
+    can be shared by any number of localizers and trackers that use the same
+    mic layout, DFT length, sample rate and grid. Memory use and setup time
+    then do not grow with the number of localizers.
+    """
+
+    TDOA_UPSAMPLE = 4  # Lag domain resolution of the 'tdoa' method
+    # Shift matrices are only built when a method first needs them. Matrices
+    # are kept in memory while their total size stays under the table budget.
+    # Otherwise they are generated on the fly in blocks of directions, each
+    # of size at most the block budget
+    SHIFT_TABLE_BUDGET = 512 * 2 ** 20  # in bytes
+    SHIFT_BLOCK_BUDGET = 16 * 2 ** 20  # in bytes
+    # Directory in which shift matrices are cached as memory mapped files.
+    # Cached matrices are shared between restarts and processes and do not
+    # count against the table budget. None disables the cache
+    TABLE_CACHE_DIR = None
+    # Search space grids for 3d search spaces. See _setup_search_space
+    GRIDS = ['lattice', 'fibonacci', 'icosahedral']
+    # Number of grid directions interpolated from when resampling onto the
+    # lattice. See to_spher_grid
+    RESAMPLE_NEIGHBOURS = 3
+    # Number of nearest directions linked to each direction in the
+    # neighbour graph of a 3d search space. Directions of a 2d search space
+    # are linked to the 2 on either side. See get_neighbours
+    NEIGHBOURS = 8
+    # Pair selection. Pairs whose baselines differ by less than this many
+    # meters are geometrically redundant. See _select_pairs
+    PAIR_TOL = 1e-4
+    # Ratio between the highest and lowest frequency of the band in which
+    # each pair is used by nested sub-arrays. See get_pair_bands
+    NESTED_BAND_RATIO = 8.
+
+    def __init__(self, mic_positions, dft_len=512, sample_rate=44100,
+                 n_theta=20, n_phi=1, cutoff_freq=4000, grid='lattice',
+                 max_pairs=None):
+        """
+        :param mic_positions: locations of microphones. Each row should be the
+                            location of a given microphone. The dimension
+                            is taken to be the number of columns of this
+                            matrix
+        :type mic_positions: numpy array
+        :param dft_len: Length of the DFT to use. Default is 512.
+        :param sample_rate: Sample rate that was used when sampling data.
+                            Default value is 44100 Hz.
+        :param n_theta: The number of points to sample in theta search
+                        space where theta is angle in spherical coordinates
+        :type n_theta: int
+        :param n_phi: The number of points to sample in phi search space
+                      where phi is the polar angle in spherical coordinates. The
+                      default value is 1, which indicates a 2d search space
+        :type n_phi: int
+        :param cutoff_freq: frequency in Hz of the low pass filter applied
+                            before localization
+        :param grid: how directions are laid out over a 3d search space.
+                     One of GRIDS. See _setup_search_space
+        :param max_pairs: maximum number of mic pairs used by the methods
+                          that use all pairs. Default of None uses every
+                          unique pair. See _select_pairs
+        """
+        if grid not in self.GRIDS:
+            raise ValueError("Unknown search space grid: " + str(grid))
+        if grid != 'lattice' and n_phi == 1:
+            raise ValueError("Grid '" + grid + "' requires a 3d search " +
+                             "space (n_phi > 1)")
+        self._grid = grid
+        self._dft_len = dft_len
+        self._sample_rate = float(sample_rate)
+        self._cutoff_freq = cutoff_freq
+        self._n_theta = n_theta
+        self._n_phi = n_phi
+        self._process_mic_positions(mic_positions)
+        self._select_pairs(max_pairs)
+        self._setup_distances()
+        self._setup_search_space()
+        self._setup_delays()
+        self._neighbours = None  # Built on demand
+        self._lattice_nearest = None  # Built on demand
+        self._pair_bands = None  # Built on demand
+        for arr in [self._mic_positions, self._pairs, self._distances,
+                    self._all_distances,
+                    self._directions, self._spher_directions, self._delays,
+                    self._all_delays]:
+            arr.flags.writeable = False
+
+    def is_compatible(self, dft_len, sample_rate, cutoff_freq):
+        """
+        Check whether this geometry was built for the given DFT length,
+        sample rate and low pass cutoff frequency
+        """
+        return self._dft_len == dft_len and \
+            self._sample_rate == float(sample_rate) and \
+            self._cutoff_freq == cutoff_freq
+
+    def get_n_theta(self):
+        return self._n_theta
+
+    def get_n_phi(self):
+        return self._n_phi
+
+    def get_grid(self):
+        return self._grid
+
+    def get_n_directions(self):
+        """
+        Returns the number of directions in the search space. This is
+        n_theta * n_phi except for the 'icosahedral' grid
+        """
+        return self._directions.shape[1]
+
+    def get_grid_spacing(self):
+        """
+        Returns the typical angular spacing in radians between neighbouring
+        directions of the search space. For 3d search spaces this is the
+        side of a square with the area of the hemisphere divided evenly
+        between the directions
+        """
+        if self._n_phi == 1:
+            return math.pi / max(self._n_theta - 1, 1)
+        return math.sqrt(2 * math.pi / self.get_n_directions())
+
+    def get_mic_positions(self):
+        """
+        Returns the mic positions in 3 dimensions. The returned arrays from
+        this and the other getters of this class are shared and read only
+        """
+        return self._mic_positions
+
+    def get_distances(self):
+        """
+        Returns the distances between the first mic and every other mic
+        """
+        return self._distances
+
+    def get_all_distances(self):
+        """
+        Returns the distances between every selected pair of mics
+        """
+        return self._all_distances
+
+    def get_pairs(self):
+        """
+        Returns the selected pairs of mics, of size (n_pairs x 2). Row i
+        holds mics (j, k) of pair i, where j < k. The first n_mics - 1 pairs
+        are those of the first mic with every other mic
+        """
+        return self._pairs
+
+    def get_n_pairs(self):
+        return self._pairs.shape[0]
+
+    def get_pair_report(self):
+        """
+        Describe the cost and accuracy of the selected pairs relative to
+        using every unique pair. Returns a dictionary with:
+            'n_pairs': number of selected pairs
+            'n_all_pairs': number of unique pairs
+            'cost': relative cost per direction of the methods that use all
+                    pairs, n_pairs / n_all_pairs
+            'aperture': sum of the squared baseline lengths of the selected
+                        pairs over that of every pair. The curvature of the
+                        steered response around its peak, and so the
+                        accuracy of the peak, is proportional to it
+            'min_baseline', 'max_baseline': shortest and longest baseline of
+                                            the selected pairs in meters
+        """
+        firsts, seconds = np.triu_indices(self._n_mics, 1)
+        all_baselines = self._mic_positions[seconds, :] - \
+            self._mic_positions[firsts, :]
+        lengths = np.sqrt(np.sum(self._all_distances ** 2, axis=1))
+        return {'n_pairs': self.get_n_pairs(),
+                'n_all_pairs': firsts.size,
+                'cost': self.get_n_pairs() / float(firsts.size),
+                'aperture': np.sum(lengths ** 2) / np.sum(all_baselines ** 2),
+                'min_baseline': np.min(lengths),
+                'max_baseline': np.max(lengths)}
+
+    def get_pair_bands(self):
+        """
+        Returns the frequency bands of nested sub-arrays, built the first
+        time they are needed. This is a boolean matrix of size
+        (n_pairs x cutoff_index). Entry (i, k) is True if pair i is used at
+        bin k. Each pair covers the band from its spatial aliasing frequency
+        c / (2 * baseline) down to NESTED_BAND_RATIO times lower, so long
+        pairs cover low frequencies and short pairs high ones. The longest
+        pairs also cover every frequency below their band and the shortest
+        every frequency above theirs. Bins between bands use every pair
+        that does not alias there
+        """
+        if self._pair_bands is None:
+            lengths = np.sqrt(np.sum(self._all_distances ** 2, axis=1))
+            alias_freqs = consts.SPEED_OF_SOUND / (2 * np.maximum(lengths, consts.EPS))
+            low_freqs = alias_freqs / self.NESTED_BAND_RATIO
+            high_freqs = alias_freqs.copy()
+            low_freqs[lengths >= np.max(lengths) - self.PAIR_TOL] = 0
+            high_freqs[lengths <= np.min(lengths) + self.PAIR_TOL] = np.inf
+            freqs = np.arange(self._cutoff_index) * self._sample_rate / self._dft_len
+            bands = (freqs >= low_freqs[:, np.newaxis]) & \
+                (freqs <= high_freqs[:, np.newaxis])
+            empty = ~np.any(bands, axis=0)
+            bands[:, empty] = freqs[empty] <= high_freqs[:, np.newaxis]
+            bands.flags.writeable = False
+            self._pair_bands = bands
+        return self._pair_bands
+
+    def get_directions(self):
+        """
+        Returns the unit vectors of the search space, one per column
+        """
+        return self._directions
+
+    def get_spher_directions(self):
+        """
+        Returns the search space in spherical coordinates. Row 0 is the
+        radius, row 1 the azimuthal angle and row 2 the polar angle
+        """
+        return self._spher_directions
+
+    def get_delays(self):
+        """
+        Returns the sample delays between the first mic and every other mic
+        for each direction. Entry (i, j) is for mic i + 1 and direction j
+        """
+        return self._delays
+
+    def get_all_delays(self):
+        """
+        Returns the sample delays between every unique pair of mics for
+        each direction. Entry (i, j) is for pair i and direction j
+        """
+        return self._all_delays
+
+    def get_cutoff_index(self):
+        return self._cutoff_index
+
+    def get_lag_table_len(self):
+        """
+        Returns the number of lags in the lag domain correlations read by
+        lookup_lags. This is dft_len * TDOA_UPSAMPLE
+        """
+        return self._lag_table_len
+
+    def _process_mic_positions(self, mic_positions):
+        mic_shape = mic_positions.shape
+        self._n_mics = mic_shape[0]
+        self._n_mic_pairs = (self._n_mics - 1) * self._n_mics / 2
+        self._n_dimensions = mic_shape[1]
+        if self._n_dimensions == 2:
+            if self._n_phi != 1:
+                ValueError("Number of phi search space samples must be 1 for " +
+                           "microphone coordinates in 2 dimensions")
+            self._mic_positions = np.concatenate((mic_positions.copy(), 
+                                    np.zeros((self._n_mics,1))), axis=1)
+            self._n_dimensions = 3
+        elif self._n_dimensions == 3:
+            self._mic_positions = mic_positions.copy()
+        else:
+            ValueError("Microphones must be specified in either 2 or 3 dimensions")
+
+    def _select_pairs(self, max_pairs):
+        """
+        Select the pairs of mics used by the methods that use all pairs.
+        Without max_pairs every unique pair is used. Otherwise:
+            - The pairs of the first mic with every other mic are always
+              kept, as they are used by 'gcc'
+            - Pairs whose baseline is within PAIR_TOL of that of an earlier
+              pair, up to sign, give the same delays for every direction
+              and are dropped
+            - The remaining pairs are added greedily by baseline length
+              times one plus the sine of the smallest angle between their
+              baseline and those already selected, favouring long baselines
+              in new directions, until there are max_pairs pairs
+        The pairs keep the order of the full set of pairs
+        """
+        firsts, seconds = np.triu_indices(self._n_mics, 1)
+        n_all = firsts.size
+        if max_pairs is None:
+            self._pairs = np.vstack((firsts, seconds)).T
+            return
+        n_ref = self._n_mics - 1
+        if max_pairs < n_ref:
+            raise ValueError("At least " + str(n_ref) + " mic pairs are " +
+                             "needed to keep the pairs of the first mic")
+        baselines = self._mic_positions[seconds, :] - self._mic_positions[firsts, :]
+        lengths = np.sqrt(np.sum(baselines ** 2, axis=1))
+        units = baselines / np.maximum(lengths, consts.EPS)[:, np.newaxis]
+        selected = range(n_ref)
+        candidates = []
+        for i in range(n_ref, n_all):
+            kept = selected + candidates
+            redundant = np.minimum(
+                np.max(np.abs(baselines[kept, :] - baselines[i, :]), axis=1),
+                np.max(np.abs(baselines[kept, :] + baselines[i, :]), axis=1))
+            if np.min(redundant) > self.PAIR_TOL:
+                candidates.append(i)
+        while len(selected) < max_pairs and len(candidates) > 0:
+            cosines = np.abs(units[candidates, :].dot(units[selected, :].T))
+            sines = np.sqrt(np.maximum(1 - np.max(cosines, axis=1) ** 2, 0))
+            best = np.argmax(lengths[candidates] * (1 + sines))
+            selected.append(candidates.pop(best))
+        selected.sort()
+        self._pairs = np.vstack((firsts[selected], seconds[selected])).T
+
+    def _setup_distances(self):
+        """
+        Setup array of distances between mics using the mic
+        layout given for this object
+        """
+        self._distances = self._mic_positions[1:, :] - self._mic_positions[0, :]
+        # Now setup the distances of the selected pairs for more exhaustive
+        # algorithms
+        self._all_distances = self._mic_positions[self._pairs[:, 1], :] - \
+            self._mic_positions[self._pairs[:, 0], :]
+
+    def _setup_search_space(self):
+        """
+        Setup the search space for constructing the distribution of source
+        locations. This will be held in the member variable 'directions'.
+        This method will also setup the member variable 'delays', which
+        will contain the delays in samples between the first microphone and
+        every other microphone. Note that these sample delays may be non-integers.
+
+        The 3d search space covers the upper hemisphere. How it is sampled
+        depends on the grid:
+            'lattice': n_theta azimuthal angles by n_phi polar angles. Rows of
+                       the lattice bunch up towards the pole, and the first
+                       and last azimuthal angles (0 and 2pi) coincide
+            'fibonacci': n_theta * n_phi directions on a Fibonacci spiral.
+                         Every direction covers the same area
+            'icosahedral': vertices of a subdivided icosahedron, using the
+                           fewest subdivisions that give at least
+                           n_theta * n_phi directions
+        Near uniform grids reach the same worst case resolution as the
+        lattice with far fewer directions. Directions of those grids are
+        ordered by polar angle.
+        """
+        if self._grid == 'lattice':
+            self._directions, self._spher_directions = self._get_lattice()
+            return
+        if self._grid == 'fibonacci':
+            directions = self._get_fibonacci_directions(self._n_theta * self._n_phi)
+        else:
+            directions = self._get_icosahedral_directions(self._n_theta * self._n_phi)
+        angles = mat.cartesian_to_spher(directions)
+        order = np.lexsort((angles[0, :], angles[1, :]))
+        self._directions = np.asarray(directions[:, order], dtype=consts.REAL_DTYPE)
+        self._spher_directions = np.vstack((np.ones((1, order.size)),
+            angles[:, order])).astype(consts.REAL_DTYPE)
+
+    def _get_lattice(self):
+        """
+        Get the theta x phi lattice of directions. Entry p * n_theta + t is at
+        azimuthal angle t and polar angle p
+        :returns: (directions, spher_directions) tuple
+        """
+        # Setup angle space
+        if self._n_phi == 1: # 2d search space
+            theta = np.linspace(0, math.pi, self._n_theta)
+        else:
+            theta = np.linspace(0, 2 * math.pi, self._n_theta)
+        #theta = theta[:-1]  # Don't use both 0 and 2pi
+        phi = np.linspace(math.pi/2., 0, self._n_phi)[::-1] # Want to include pi/2 if self._n_phi == 1
+
+        # Setup array of direction vectors
+        directions = np.empty((3, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
+        spher_directions = np.empty((3, self._n_theta * self._n_phi), dtype=consts.REAL_DTYPE)
+        for p in range(self._n_phi):
+            for t in range(self._n_theta):
+                ind = p * self._n_theta + t
+                # Get cartestian coordinates
+                directions[0, ind] = np.sin(phi[p]) * np.cos(theta[t])  # x
+                directions[1, ind] = np.sin(phi[p]) * np.sin(theta[t])  # y
+                directions[2, ind] = np.cos(phi[p])  # z
+                # Get the spherical coordinates
+                spher_directions[0, ind] = 1
+                spher_directions[1, ind] = theta[t]
+                spher_directions[2, ind] = phi[p]
+        return directions, spher_directions
+
+    def _get_fibonacci_directions(self, n_directions):
+        """
+        Get directions on a Fibonacci spiral over the upper hemisphere. Each
+        direction is at the center of a band of equal height in z, so every
+        direction covers the same area, and successive directions are turned
+        by the golden angle in azimuth
+        :returns: matrix of unit vectors, one per column
+        """
+        z = 1 - (np.arange(n_directions) + .5) / n_directions
+        theta = np.arange(n_directions) * math.pi * (3 - math.sqrt(5))
+        r = np.sqrt(1 - z ** 2)
+        return np.array([r * np.cos(theta), r * np.sin(theta), z])
+
+    def _get_icosahedral_directions(self, min_directions):
+        """
+        Get the vertices in the upper hemisphere (equator included) of an
+        icosahedron whose faces are split into four, with the new vertices
+        pushed out to the unit sphere, until there are at least
+        min_directions of them
+        :returns: matrix of unit vectors, one per column
+        """
+        g = (1 + math.sqrt(5)) / 2.
+        vertices = [np.array(v) / math.sqrt(1 + g ** 2) for v in
+                    [[-1, g, 0], [1, g, 0], [-1, -g, 0], [1, -g, 0],
+                     [0, -1, g], [0, 1, g], [0, -1, -g], [0, 1, -g],
+                     [g, 0, -1], [g, 0, 1], [-g, 0, -1], [-g, 0, 1]]]
+        faces = [[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+                 [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+                 [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+                 [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1]]
+        while True:
+            directions = np.array(vertices).T
+            directions = directions[:, directions[2, :] > -1e-9]
+            if directions.shape[1] >= min_directions:
+                return directions
+            midpoints = {}
+
+            def get_midpoint(i, j):
+                key = (min(i, j), max(i, j))
+                if key not in midpoints:
+                    midpoint = vertices[i] + vertices[j]
+                    vertices.append(midpoint / np.linalg.norm(midpoint))
+                    midpoints[key] = len(vertices) - 1
+                return midpoints[key]
+
+            new_faces = []
+            for a, b, c in faces:
+                ab = get_midpoint(a, b)
+                bc = get_midpoint(b, c)
+                ca = get_midpoint(c, a)
+                new_faces.extend([[a, ab, ca], [b, bc, ab], [c, ca, bc],
+                                  [ab, bc, ca]])
+            faces = new_faces
+
+    def get_neighbours(self):
+        """
+        Returns the nearest neighbour graph of the search space, built the
+        first time it is needed. This is a matrix of size
+        (n_directions x k) where k is NEIGHBOURS, or 2 for a 2d search
+        space. Row i holds the indices of the
+        directions closest to direction i, nearest first. Directions that
+        coincide with direction i (i itself, and the repeated directions of
+        the lattice at the pole and at azimuth 0 and 2pi) are left out
+        """
+        if self._neighbours is None:
+            self._setup_neighbours()
+        return self._neighbours
+
+    def _setup_neighbours(self):
+        n_directions = self.get_n_directions()
+        n_neighbours = 2 if self._n_phi == 1 else self.NEIGHBOURS
+        n_neighbours = min(n_neighbours, n_directions - 1)
+        neighbours = np.empty((n_directions, n_neighbours), dtype=int)
+        block_len = max(1, int(self.SHIFT_BLOCK_BUDGET / (8 * n_directions)))
+        for start in range(0, n_directions, block_len):
+            dots = self._directions[:, start:start + block_len].T.dot(
+                self._directions).astype(float)
+            rows = np.arange(dots.shape[0])[:, np.newaxis]
+            # Same direction, up to the precision of the directions
+            dots[rows, rows + start] = -np.inf
+            dots[dots > 1 - 1e-6] = -np.inf
+            nearest = np.argpartition(-dots, n_neighbours - 1,
+                                      axis=1)[:, :n_neighbours]
+            order = np.argsort(-dots[rows, nearest], axis=1)
+            neighbours[start:start + block_len, :] = nearest[rows, order]
+        neighbours.flags.writeable = False
+        self._neighbours = neighbours
+
+    def get_neighbourhood(self, ind, hops):
+        """
+        Get the directions of the search space that can be reached from a
+        direction in at most the given number of steps along the neighbour
+        graph
+        :param ind: index of the direction at the center of the neighbourhood
+        :param hops: number of steps
+        :returns: (inds, n_inner) tuple. inds holds the indices of the
+                  neighbourhood ordered by number of steps from the center.
+                  The first n_inner of them are less than hops steps away,
+                  the rest lie on the boundary of the neighbourhood
+        """
+        neighbours = self.get_neighbours()
+        visited = set([ind])
+        rings = [np.array([ind])]
+        n_inner = 0
+        for hop in range(hops):
+            n_inner += rings[-1].size
+            ring = [i for i in np.unique(neighbours[rings[-1], :])
+                    if i not in visited]
+            visited.update(ring)
+            rings.append(np.array(ring, dtype=int))
+        return np.hstack(rings), n_inner
+
+    def to_spher_grid(self, distr):
+        """
+        Arrange values over the search space as a grid over spherical
+        coordinates, with axis 0 varying with polar angle and axis 1 with
+        azimuthal angle. For the lattice this is a reshape. Other grids are
+        resampled onto the lattice with n_theta azimuthal and n_phi polar
+        angles, interpolating between the RESAMPLE_NEIGHBOURS nearest
+        directions weighted by inverse angular distance. The coordinates of
+        the grid are given by get_lattice_spher_directions
+
+        :param distr: vector with one value per search space direction
+        :returns: matrix of size (n_phi x n_theta)
+        """
+        if self._grid == 'lattice':
+            return np.reshape(distr, (self._n_phi, self._n_theta))
+        if not hasattr(self, '_resample_inds'):
+            self._setup_resampling()
+        resampled = np.sum(np.asarray(distr)[self._resample_inds] *
+                           self._resample_weights, axis=0)
+        return np.reshape(resampled, (self._n_phi, self._n_theta))
+
+    def interpolate_distribution(self, distr, directions):
+        """
+        Interpolate values over the search space at arbitrary directions.
+        The lattice is interpolated linearly in azimuthal angle, and also in
+        polar angle for a 3d search space. Other grids weight the
+        RESAMPLE_NEIGHBOURS nearest directions by inverse angular distance,
+        as in to_spher_grid. These are found from the lattice cell of each
+        direction and the neighbour graph (see _find_nearest_directions), so
+        the cost does not grow with the size of the search space.
+
+        Steered responses are unchanged by mirroring a direction along an
+        axis on which every mic has the same coordinate, such as the y axis
+        for a linear array along x. Directions are mirrored onto the search
+        space along such axes first.
+
+        :param distr: vector with one value per search space direction
+        :param directions: matrix of unit vectors, one per column
+        :returns: (values, covered) tuple. covered flags the directions that
+                  lie within the search space. The other directions get the
+                  value at the nearest edge of the search space
+        """
+        distr = np.asarray(distr, dtype=float)
+        directions = np.array(directions, dtype=float)
+        # Axis bounding the search space: y for 2d, z for 3d
+        axis = 1 if self._n_phi == 1 else 2
+        if np.ptp(self._mic_positions[:, axis]) < self.PAIR_TOL:
+            directions[axis, :] = np.abs(directions[axis, :])
+        covered = directions[axis, :] >= -1e-6
+        if self._grid != 'lattice':
+            # Directions below the search space take the values at their
+            # projection onto its edge
+            edge = np.array(directions)
+            edge[axis, ~covered] = 0
+            norms = np.sqrt(np.sum(edge ** 2, axis=0))
+            edge = np.where(norms > 1e-6, edge / np.maximum(norms, 1e-6),
+                            directions)
+            inds, dots = self._find_nearest_directions(edge)
+            weights = 1. / np.maximum(np.arccos(np.clip(dots, -1, 1)), 1e-6)
+            return np.sum(distr[inds] * weights, axis=1) / \
+                np.sum(weights, axis=1), covered
+        theta = np.arctan2(directions[1, :], directions[0, :])
+        if self._n_phi == 1:
+            t, t_frac = self._get_lattice_cell(theta, math.pi, self._n_theta)
+            return (1 - t_frac) * distr[t] + t_frac * distr[t + 1], covered
+        grid = np.reshape(distr, (self._n_phi, self._n_theta))
+        t, t_frac = self._get_lattice_cell(np.mod(theta, 2 * math.pi),
+                                           2 * math.pi, self._n_theta)
+        phi = np.arccos(np.clip(directions[2, :], -1, 1))
+        p, p_frac = self._get_lattice_cell(phi, math.pi / 2., self._n_phi)
+        values = (1 - p_frac) * ((1 - t_frac) * grid[p, t] +
+                                 t_frac * grid[p, t + 1]) + \
+            p_frac * ((1 - t_frac) * grid[p + 1, t] + t_frac * grid[p + 1, t + 1])
+        return values, covered
+
+    def _find_nearest_directions(self, directions):
+        """
+        Find the RESAMPLE_NEIGHBOURS directions of a grid without axes
+        closest to each of the given directions. The search starts from the
+        grid direction nearest the closest lattice point and moves along the
+        neighbour graph to whichever neighbour is closer until none is. The
+        closest directions are then taken from the one reached and its
+        neighbours.
+        :param directions: matrix of unit vectors, one per column
+        :returns: (inds, dots) tuple of matrices of size
+                  (n_directions x RESAMPLE_NEIGHBOURS), holding the indices
+                  of the closest grid directions and their dot products
+                  with the given directions
+        """
+        if self._lattice_nearest is None:
+            self._setup_lattice_nearest()
+        neighbours = self.get_neighbours()
+        theta = np.mod(np.arctan2(directions[1, :], directions[0, :]), 2 * math.pi)
+        t, t_frac = self._get_lattice_cell(theta, 2 * math.pi, self._n_theta)
+        phi = np.arccos(np.clip(directions[2, :], -1, 1))
+        p, p_frac = self._get_lattice_cell(phi, math.pi / 2., self._n_phi)
+        lattice_inds = (p + np.round(p_frac).astype(int)) * self._n_theta + \
+            t + np.round(t_frac).astype(int)
+        nearest = self._lattice_nearest[lattice_inds]
+        rows = np.arange(directions.shape[1])
+        while True:
+            candidates = np.hstack((nearest[:, np.newaxis], neighbours[nearest]))
+            dots = np.sum(self._directions[:, candidates] *
+                          directions[:, :, np.newaxis], axis=0)
+            best = np.argmax(dots, axis=1)
+            if not np.any(best):
+                break
+            nearest = candidates[rows, best]
+        n_neighbours = min(self.RESAMPLE_NEIGHBOURS, candidates.shape[1])
+        order = np.argpartition(-dots, n_neighbours - 1,
+                                axis=1)[:, :n_neighbours]
+        return candidates[rows[:, np.newaxis], order], \
+            dots[rows[:, np.newaxis], order]
+
+    def _setup_lattice_nearest(self):
+        """
+        Setup the index of the grid direction nearest each lattice point,
+        from which _find_nearest_directions starts its search
+        """
+        lattice = self._get_lattice()[0]
+        nearest = np.empty((lattice.shape[1],), dtype=int)
+        block_len = max(1, int(self.SHIFT_BLOCK_BUDGET /
+                               (8 * self.get_n_directions())))
+        for start in range(0, lattice.shape[1], block_len):
+            nearest[start:start + block_len] = np.argmax(self._directions.T.dot(
+                lattice[:, start:start + block_len]), axis=0)
+        self._lattice_nearest = nearest
+
+    def _get_lattice_cell(self, angles, max_angle, n_angles):
+        """
+        Get the cell of n_angles evenly spaced angles from 0 to max_angle
+        holding each angle, clipping angles to that range
+        :returns: (inds, fracs) tuple. Angle i lies fracs[i] of the way from
+                  angle inds[i] to angle inds[i] + 1 of the lattice
+        """
+        if n_angles == 1:
+            return np.zeros(angles.shape, dtype=int), np.zeros(angles.shape)
+        pos = np.clip(angles, 0, max_angle) * (n_angles - 1) / max_angle
+        inds = np.minimum(np.floor(pos).astype(int), n_angles - 2)
+        return inds, pos - inds
+
+    def get_lattice_spher_directions(self):
+        """
+        Returns the spherical coordinates of the theta x phi lattice in the
+        format of get_spher_directions. For the lattice grid this is the
+        search space itself
+        """
+        return self._get_lattice()[1]
+
+    def _setup_resampling(self):
+        """
+        Setup the indices and weights used by to_spher_grid to resample
+        values over the search space onto the lattice
+        """
+        lattice = self._get_lattice()[0]
+        n_neighbours = min(self.RESAMPLE_NEIGHBOURS, self.get_n_directions())
+        dots = self._directions.T.dot(lattice)
+        inds = np.argsort(-dots, axis=0)[:n_neighbours, :]
+        angles = np.arccos(np.clip(dots[inds, np.arange(lattice.shape[1])], -1, 1))
+        weights = 1. / np.maximum(angles, 1e-6)
+        self._resample_inds = inds
+        self._resample_weights = weights / np.sum(weights, axis=0)
+
+    def compute_delays(self, directions, all_pairs=False):
+        """
+        Compute the sample delays that align mic pairs for the given
+        directions. Note that these sample delays may be non-integers.
+
+        :param directions: matrix of unit vectors, one per column
+        :param all_pairs: if True, compute delays between all unique pairs of
+                          mics. Otherwise between the first mic and every
+                          other mic
+        :returns: matrix where entry (i, j) is the delay of pair i for
+                  direction j
+        """
+        distances = self._all_distances if all_pairs else self._distances
+        return -1 * distances.dot(directions) * \
+            self._sample_rate / consts.SPEED_OF_SOUND
+
+    def compute_position_delays(self, positions, all_pairs=False):
+        """
+        Compute the sample delays that align mic pairs for sources at the
+        given positions, from the exact distance of each mic to each
+        position rather than from a far field direction. For distant
+        positions these approach the delays of compute_delays.
+
+        :param positions: matrix of positions in the coordinates of the mic
+                          positions, one per column
+        :param all_pairs: if True, compute delays between all selected pairs
+                          of mics. Otherwise between the first mic and every
+                          other mic
+        :returns: matrix where entry (i, j) is the delay of pair i for
+                  position j
+        """
+        ranges = np.sqrt(np.sum((self._mic_positions[:, :, np.newaxis] -
+                                 positions[np.newaxis, :, :]) ** 2, axis=1))
+        if all_pairs:
+            firsts, seconds = self._pairs[:, 0], self._pairs[:, 1]
+        else:
+            firsts, seconds = 0, slice(1, None)
+        return (ranges[seconds, :] - ranges[firsts, :]) * \
+            self._sample_rate / consts.SPEED_OF_SOUND
+
+    def _setup_delays(self):
+        # Setup delays between first mic and all others
+        self._delays = self.compute_delays(self._directions)
+        # Setup delays between all unique pairs of mics
+        self._all_delays = self.compute_delays(self._directions, True)
+        # Shift matrices are built on demand
+        self._cutoff_index = self._compute_cutoff_index()
+        self._shift_tables = {}
+        self._setup_lag_tables()
+
+    def _compute_cutoff_index(self):
+        """
+        Compute the index corresponding to the cutoff frequency for the
+        low pass filter being used. Then only the DFT coefficients for indices
+        up to this cutoff index should be used in localization
+        :returns: cutoff index as described. Will be of int type
+        """
+        cutoff_index = int((float(self._cutoff_freq) / self._sample_rate) * 
+                       (self._dft_len / 1))
+        if cutoff_index > self._dft_len / 2 + 1:
+            cutoff_index = int(self._dft_len / 2 + 1)
+        return cutoff_index
+
+    def _setup_lag_tables(self):
+        """
+        Setup the lag lookup tables used by the 'tdoa' method. A pair with
+        delay d for some direction is aligned by looking at its correlation
+        at lag -d, which is what the frequency domain shift matrices compute.
+        Indices are stored already offset into the raveled lag correlation
+        matrix so that lookups are a single gather.
+        """
+        self._lag_table_len = int(self._dft_len * self.TDOA_UPSAMPLE)
+        self._lag_inds, self._lag_next_inds, self._lag_fracs = \
+            self._get_lag_indices(self._all_delays)
+
+    def _get_lag_indices(self, delays):
+        """
+        Get the indices into raveled lag domain correlations of the two lags
+        neighbouring each delay, and the interpolation fractions between them
+        """
+        lags = np.mod(-delays * self.TDOA_UPSAMPLE, self._lag_table_len)
+        lag_floor = np.floor(lags)
+        lag_fracs = np.asarray(lags - lag_floor, dtype=consts.REAL_DTYPE)
+        lag_floor = lag_floor.astype(int) % self._lag_table_len
+        pair_offsets = self._lag_table_len * \
+            np.arange(delays.shape[0])[:, np.newaxis]
+        lag_inds = lag_floor + pair_offsets
+        lag_next_inds = (lag_floor + 1) % self._lag_table_len + pair_offsets
+        return lag_inds, lag_next_inds, lag_fracs
+
+    def lookup_lags(self, lag_corrs, delays=None, cols=None):
+        """
+        Read correlation values for every search direction from the lag
+        domain correlations of every mic pair by linear interpolation between
+        the two neighbouring lags.
+
+        :param lag_corrs: matrix of size (n_mic_pairs x lag_table_len). Entry
+                          (i, n) is the correlation of pair i at a lag of
+                          n / TDOA_UPSAMPLE samples. May also be a stack of
+                          such matrices, one per frame
+        :param delays: None to use the lag tables of the search space.
+                       Otherwise, delays between all pairs of mics (see
+                       compute_delays) at which to read the correlations
+        :param cols: slice of the search space directions to read when
+                     delays is None. Default is all of them
+        :returns: matrix of size (n_mic_pairs x n_directions), with the
+                  leading axes of lag_corrs if it has any
+        """
+        if delays is None:
+            if cols is None:
+                cols = slice(None)
+            lag_inds, lag_next_inds, lag_fracs = self._lag_inds[:, cols], \
+                self._lag_next_inds[:, cols], self._lag_fracs[:, cols]
+        else:
+            lag_inds, lag_next_inds, lag_fracs = self._get_lag_indices(delays)
+        flat_corrs = lag_corrs.reshape(lag_corrs.shape[:-2] + (-1,))
+        return (1 - lag_fracs) * flat_corrs[..., lag_inds] + \
+            lag_fracs * flat_corrs[..., lag_next_inds]
+
+    def _get_shift_table_spec(self, name):
+        """
+        Get the delays and number of DFT coefficients used to build one of
+        the shift matrices. Valid names are:
+            'full': shifts for pairs with the first mic over the whole DFT
+            'pos': same as 'full', using only the positive frequencies and
+                   negative nyquist frequency
+            'lp_pos': same as 'pos', low pass filtered at the cutoff frequency
+            'all_lp_pos': same as 'lp_pos' for all unique pairs of mics
+        """
+        if name == 'full':
+            return self._delays, self._dft_len
+        if name == 'pos':
+            return self._delays, self._dft_len / 2 + 1
+        if name == 'lp_pos':
+            return self._delays, self._cutoff_index
+        if name == 'all_lp_pos':
+            return self._all_delays, self._cutoff_index
+        raise ValueError("Unknown shift matrix: " + str(name))
+
+    def get_shift_table(self, name, force=False):
+        """
+        Get one of the shift matrices described in _get_shift_table_spec,
+        building it the first time it is needed. If TABLE_CACHE_DIR is set
+        the matrix is memory mapped from the cache. Otherwise it is only
+        stored if it fits within SHIFT_TABLE_BUDGET along with the matrices
+        already stored in memory.
+
+        :param force: if True, build the matrix even when it does not fit
+                      in the budget. It will not be stored in that case
+        :returns: the shift matrix, or None if it does not fit in the budget
+                  and force is False
+        """
+        if name in self._shift_tables:
+            return self._shift_tables[name]
+        if self.TABLE_CACHE_DIR is not None:
+            self._shift_tables[name] = self._load_cached_shift_table(name)
+            return self._shift_tables[name]
+        delays, n_coeffs = self._get_shift_table_spec(name)
+        n_bytes = delays.size * n_coeffs * np.dtype(consts.COMPLEX_DTYPE).itemsize
+        used_bytes = sum([table.nbytes for table in self._shift_tables.values()
+                          if not isinstance(table, np.memmap)])
+        if used_bytes + n_bytes <= self.SHIFT_TABLE_BUDGET:
+            self._shift_tables[name] = self.get_shifts_from_delays(delays, n_coeffs)
+            return self._shift_tables[name]
+        if force:
+            return self.get_shifts_from_delays(delays, n_coeffs)
+        return None
+
+    def iter_shift_blocks(self, name, bins=None):
+        """
+        Iterate over one of the shift matrices described in
+        _get_shift_table_spec in blocks of directions, each of size at most
+        SHIFT_BLOCK_BUDGET. If the whole matrix fits in the table budget the
+        blocks are views into the stored matrix. Otherwise they are generated
+        from the delays as they are needed.
+
+        :param bins: optional vector of DFT coefficient indices. If given,
+                     only the shifts at those coefficients are in the
+                     blocks, gathered from the stored matrix or generated
+                     for those coefficients alone
+        :returns: generator of (start, shift_mats) tuples where shift_mats
+                  contains the shifts for directions start onwards
+        """
+        table = self.get_shift_table(name)
+        delays, n_coeffs = self._get_shift_table_spec(name)
+        if bins is None:
+            block_len = self.get_block_len(name)
+        else:
+            block_len = self._get_shift_block_len(delays, len(bins))
+        for start in range(0, delays.shape[1], block_len):
+            stop = start + block_len
+            if table is not None and bins is None:
+                yield start, table[:, :, start:stop]
+            elif table is not None:
+                yield start, table[:, bins, start:stop]
+            elif bins is None:
+                yield start, self.get_shifts_from_delays(
+                    delays[:, start:stop], n_coeffs)
+            else:
+                yield start, self.get_shifts_at_bins(delays[:, start:stop], bins)
+
+    def get_block_len(self, name):
+        """
+        Get the number of directions in each block yielded by
+        iter_shift_blocks for one of the shift matrices
+        """
+        return self._get_shift_block_len(*self._get_shift_table_spec(name))
+
+    def _get_shift_block_len(self, delays, n_coeffs):
+        """
+        Get the number of directions in a block of shifts so that the block
+        takes at most SHIFT_BLOCK_BUDGET bytes
+        """
+        bytes_per_direction = delays.shape[0] * int(n_coeffs) * \
+            np.dtype(consts.COMPLEX_DTYPE).itemsize
+        return max(1, int(self.SHIFT_BLOCK_BUDGET / bytes_per_direction))
+
+    def _load_cached_shift_table(self, name):
+        """
+        Memory map one of the shift matrices from TABLE_CACHE_DIR, building
+        the cached file block by block if it does not exist yet. The file is
+        keyed by the delays (which capture the mic geometry, sample rate and
+        search grid), the DFT length and the number of coefficients (which
+        captures the cutoff frequency).
+        """
+        delays, n_coeffs = self._get_shift_table_spec(name)
+        n_coeffs = int(n_coeffs)
+        key = tablecache.table_key(delays, self._dft_len, n_coeffs,
+                                   np.dtype(consts.COMPLEX_DTYPE).str)
+        block_len = self._get_shift_block_len(delays, n_coeffs)
+
+        def fill(table):
+            for start in range(0, delays.shape[1], block_len):
+                table[:, :, start:start + block_len] = self.get_shifts_from_delays(
+                    delays[:, start:start + block_len], n_coeffs)
+
+        return tablecache.load_table(self.TABLE_CACHE_DIR, 'shifts_' + name, key,
+                                     (delays.shape[0], n_coeffs, delays.shape[1]),
+                                     consts.COMPLEX_DTYPE, fill)
+
+    def get_shifts_at_bins(self, delays, bins):
+        """
+        Compute the shifts of get_shifts_from_delays at the given positive
+        frequency DFT coefficients only. As in the 'pos' matrices, the
+        nyquist coefficient is that of the negative nyquist frequency
+        :param delays: matrix of delays as for get_shifts_from_delays
+        :param bins: vector of DFT coefficient indices, each at most
+                     dft_len / 2
+        :returns: shift matrix of size (n_pairs x len(bins) x n_directions)
+        """
+        bins = np.asarray(bins)
+        signs = np.where(bins == self._dft_len / 2, -1, 1)
+        return np.exp((-1j * 2 * math.pi / self._dft_len) *
+                       delays[:, np.newaxis, :] *
+                       (signs * bins)[np.newaxis, :, np.newaxis]
+                       ).astype(consts.COMPLEX_DTYPE)
+
+    def get_shifts_from_delays(self, delays, dft_coeff_n=None):
+        """
+        Compute matrix of multiplicative factors used to shift fourier 
+        transforms of signals, using provided delays. These will use
+        the delay in teh phase term
+        :param delays: Matrix of delays for each search direciton. Entry (i,j)
+                       contains the sample delay amount to align mic pair
+                       i for search direction j
+        :param dft_coeff_n: Number of first DFT coefficients to keep.
+                           To use only the positive frequencies in
+                           the DFT's, this should be dft_len/2+1. It is also
+                           possible to use this argument to enforce a LPF on
+                           the DFT
+        :returns: shift martrix where entry (i,j,k) is the multiplicative factor
+                  in the fourier domain to align mic-pair i at frequency j for
+                  search direction k
+        """
+        if dft_coeff_n is None:
+            dft_coeff_n = self._dft_len
+        dft_coeff_n = int(dft_coeff_n)
+        # Avoid problems with dft_coeff_n values that don't make sense
+        if dft_coeff_n > self._dft_len/2. + 1 and dft_coeff_n != self._dft_len:
+            raise ValueError("If dft_coeff_n is not DFT_LEN it must be \
+                              at most DFT_LEN/2 + 1")
+        n_pos = min(dft_coeff_n, self._dft_len / 2 + 1)
+        shift_mats = np.empty((delays.shape[0], n_pos, delays.shape[1]),
+                                    dtype=consts.COMPLEX_DTYPE)
+        # Phase recurrence: the shift for coefficient n is the shift for
+        # coefficient n - 1 times the shift for coefficient 1. Accumulate in
+        # double precision so the error does not build up across coefficients
+        step = np.exp(-1j * 2 * math.pi * delays / self._dft_len)
+        phase = np.ones(delays.shape, dtype=np.complex128)
+        shift_mats[:, 0, :] = phase
+        for n in range(1, n_pos):
+            phase *= step
+            shift_mats[:, n, :] = phase
+        if dft_coeff_n == self._dft_len:
+            # Negative frequencies are conjugates of the positive ones
+            shift_mats = np.concatenate((shift_mats[:, :-1, :],
+                shift_mats[:, :0:-1, :].conj()), axis=1)
+        elif n_pos == self._dft_len / 2 + 1:
+            # Last coefficient is the negative nyquist frequency
+            shift_mats[:, -1, :] = shift_mats[:, -1, :].conj()
+        return shift_mats
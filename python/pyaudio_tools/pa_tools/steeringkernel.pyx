@@ -0,0 +1,142 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+__author__ = 'adamjmiller'
+
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport sin, cos, sqrt, pow, M_PI
+import numpy as np
+cimport numpy as cnp  # Get declarations in numpy.pxd
+cnp.import_array()
+
+cdef enum:
+    _CORRELATIONS = 0
+    _POWER = 1
+
+# Shaping modes of steer_directions
+SHAPE_CORRELATIONS = _CORRELATIONS  # 'gcc' and 'mcc'
+SHAPE_POWER = _POWER  # 'beam'
+
+
+cdef double _steer_direction(const double[:, ::1] phat_re,
+                             const double[:, ::1] phat_im,
+                             const double[:, ::1] delays, const long[::1] bins,
+                             int dft_len, int j, int mode, double k,
+                             double self_re, double self_im,
+                             bint contiguous, double eps) nogil:
+    """
+    Steer every pair to direction j and combine the pairs. The shift of bin b
+    for a delay d is exp(-j2pi b d / dft_len), of the negative nyquist
+    frequency for the nyquist bin. For contiguous bins the shifts are found
+    by rotating the shift of the first bin, otherwise each one is computed
+    """
+    cdef int n_pairs = phat_re.shape[0]
+    cdef int n_bins = phat_re.shape[1]
+    cdef int nyquist = dft_len / 2
+    cdef int i, b
+    cdef double step, angle, shift_re, shift_im, rot_re, rot_im, tmp
+    cdef double corr_re, corr_im
+    cdef double total_re = 0, total_im = 0, total = 0
+    for i in range(n_pairs):
+        step = -2 * M_PI * delays[i, j] / dft_len
+        rot_re = cos(step)
+        rot_im = sin(step)
+        angle = step * bins[0]
+        shift_re = cos(angle)
+        shift_im = sin(angle)
+        corr_re = 0
+        corr_im = 0
+        for b in range(n_bins):
+            if b > 0:
+                if contiguous:
+                    tmp = shift_re * rot_re - shift_im * rot_im
+                    shift_im = shift_re * rot_im + shift_im * rot_re
+                    shift_re = tmp
+                else:
+                    angle = step * bins[b]
+                    shift_re = cos(angle)
+                    shift_im = sin(angle)
+            if bins[b] == nyquist:
+                # Negative nyquist frequency, as in the 'pos' shift tables
+                corr_re = corr_re + phat_re[i, b] * shift_re + \
+                    phat_im[i, b] * shift_im
+                corr_im = corr_im + phat_im[i, b] * shift_re - \
+                    phat_re[i, b] * shift_im
+            else:
+                corr_re = corr_re + phat_re[i, b] * shift_re - \
+                    phat_im[i, b] * shift_im
+                corr_im = corr_im + phat_re[i, b] * shift_im + \
+                    phat_im[i, b] * shift_re
+        if mode == _CORRELATIONS:
+            total = total + pow(corr_re * corr_re + corr_im * corr_im, k / 2)
+        else:
+            total_re = total_re + corr_re
+            total_im = total_im + corr_im
+    if mode == _CORRELATIONS:
+        if total < eps:
+            return eps
+        return total
+    total_re = 2 * total_re + self_re
+    total_im = 2 * total_im + self_im
+    return sqrt(total_re * total_re + total_im * total_im)
+
+
+def steer_directions(cp_pairs, delays, bins, int dft_len, int mode, double k=2,
+                     self_energy=0, int n_threads=0):
+    """
+    Compute a steered distribution over many directions in one pass.
+    Computing the shift of every pair, bin and direction, the sum over bins
+    and the combination of pairs are fused, so no (pairs x bins x
+    directions) arrays are formed. Directions are divided between threads
+    with the GIL released. The crosspower spectra are PHAT weighted once
+    per call before the pass, as this costs O(n_pairs x n_bins) whatever
+    the number of directions.
+
+    :param cp_pairs: crosspower spectra of size (n_pairs x n_bins)
+    :param delays: delays of size (n_pairs x n_directions). See
+                   SteeringGeometry.compute_delays
+    :param bins: DFT coefficient index of each column of cp_pairs, each at
+                 most dft_len / 2
+    :param dft_len: length of the DFT
+    :param mode: SHAPE_CORRELATIONS to return \sum_i |corr_i|^k over the
+                 pairs, where DFT coefficients other than DC and nyquist
+                 are counted twice, as in 'gcc' and 'mcc'. SHAPE_POWER to
+                 return |2 \sum_i corr_i + self_energy| as in 'beam'
+    :param k: coefficient of the shaping function for SHAPE_CORRELATIONS
+    :param self_energy: direction independent term for SHAPE_POWER
+    :param n_threads: number of threads to use. Default of 0 leaves the
+                      choice to OpenMP
+    :returns: distribution over the directions of size (n_directions,), in
+              double precision
+    """
+    bins = np.ascontiguousarray(bins, dtype=np.int_)
+    cp_pairs = np.asarray(cp_pairs, dtype=np.complex128)
+    phat = cp_pairs / (np.abs(cp_pairs) + np.finfo(float).eps)
+    if mode == SHAPE_CORRELATIONS:
+        phat = phat * np.where((bins == 0) | (bins == dft_len / 2), 1, 2)
+    cdef const double[:, ::1] phat_re = np.ascontiguousarray(phat.real)
+    cdef const double[:, ::1] phat_im = np.ascontiguousarray(phat.imag)
+    # Delays may be read only, as are the cached tables of the geometry
+    cdef const double[:, ::1] delays_view = np.ascontiguousarray(
+        delays, dtype=np.float64)
+    cdef const long[::1] bins_view = bins
+    cdef int n_directions = delays_view.shape[1]
+    cdef bint contiguous = bins.size < 2 or \
+        bool(np.all(np.diff(bins) == 1))
+    cdef double self_re = np.real(self_energy)
+    cdef double self_im = np.imag(self_energy)
+    cdef double eps = np.finfo(float).eps
+    out = np.empty((n_directions,), dtype=np.float64)
+    cdef double[::1] out_view = out
+    cdef int j
+    if n_threads <= 0:
+        for j in prange(n_directions, nogil=True, schedule='static'):
+            out_view[j] = _steer_direction(phat_re, phat_im, delays_view,
+                                           bins_view, dft_len, j, mode, k,
+                                           self_re, self_im, contiguous, eps)
+    else:
+        for j in prange(n_directions, nogil=True, schedule='static',
+                        num_threads=n_threads):
+            out_view[j] = _steer_direction(phat_re, phat_im, delays_view,
+                                           bins_view, dft_len, j, mode, k,
+                                           self_re, self_im, contiguous, eps)
+    return out
@@ -0,0 +1,60 @@
+__author__ = 'Adam Miller'
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+def table_key(*items):
+    """
+    Get a content based key for a table computed from the given items.
+    Items may be arrays or scalars. Two sets of items give the same key
+    only if they have the same types, shapes and values
+    :returns: hex digest string
+    """
+    sha = hashlib.sha1()
+    for item in items:
+        arr = np.ascontiguousarray(item)
+        sha.update(str(arr.dtype))
+        sha.update(str(arr.shape))
+        sha.update(arr.tostring())
+    return sha.hexdigest()
+
+
+def load_table(cache_dir, name, key, shape, dtype, fill_fcn):
+    """
+    Load a table from the cache directory as a read only memory mapped
+    array. If the table is not in the cache yet it is created first.
+    Processes that load the same table will share its pages.
+
+    :param cache_dir: directory holding cached tables. Created if needed
+    :param name: descriptive name of the table, used in its file name
+    :param key: content key of the table. See table_key
+    :param shape: shape of the table
+    :param dtype: data type of the table
+    :param fill_fcn: function that takes a writable array of the given
+                     shape and dtype, and fills in the table. The array is
+                     backed by the file, so the table never needs to fit
+                     in memory all at once
+    :returns: read only numpy memmap
+    """
+    path = os.path.join(cache_dir, '%s_%s.npy' % (name, key))
+    if not os.path.exists(path):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Build in a temporary file and rename, so that other processes
+        # never see a partially written table
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        os.close(fd)
+        try:
+            table = np.lib.format.open_memmap(tmp_path, mode='w+',
+                                              dtype=dtype, shape=shape)
+            fill_fcn(table)
+            table.flush()
+            del table
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return np.load(path, mmap_mode='r')
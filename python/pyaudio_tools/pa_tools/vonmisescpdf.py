@@ -28,6 +28,7 @@ class VonMisesCPdf(CPdf):
     if cond_rv is not None and rv.dimension != cond_rv.dimension:
       raise ValueError("RV and Cond_RV must have same shape")
     self._kappa = kappa
+    self._log_normalizers = {}
     self._n_dimensions = rv.dimension
     if self._n_dimensions != 2 and self._n_dimensions != 3:
       raise ValueError("Only support 2 and 3 dimensional von mises distributions")
@@ -49,11 +50,9 @@ class VonMisesCPdf(CPdf):
     cond = self._verify_shape(cond)
     #x = self._verify_shape(x)
     if self._ndims(cond) == 3:
-      return np.log(self._kappa) - np.log(2*np.pi)  - \
-          np.log(1-np.exp(-2 * self._kappa)) -self._kappa + self._kappa * cond.dot(x)
+      return self._get_log_normalizer() + self._kappa * cond.dot(x)
     elif self._ndims(cond) == 2:
-      #print 2 * np.pi * sps.iv(0, self._kappa) 
-      return -np.log(2 * np.pi * sps.iv(0, self._kappa)) + \
+      return self._get_log_normalizer() + \
           self._kappa * np.cos(np.arctan2(x[1], x[0]) - np.arctan2(cond[1], cond[0]))
     else:
       return ValueError("Dimensions other than 2 or 3 not supported for von mises")
@@ -79,6 +78,66 @@ class VonMisesCPdf(CPdf):
     else:
       return ValueError("Dimensions other than 2 or 3 not supported for von mises")
 
+  def eval_log_batch(self, x, conds):
+    """
+    Evaluate the log density of many points at once
+    :param x: matrix of points, one per row
+    :param conds: matrix of conditions (means), one per row of x. May also
+                  be a single condition used for every point
+    :returns: vector holding the log density of each row of x
+    """
+    x = self._verify_batch_shape(x)
+    conds = self._verify_batch_shape(conds)
+    dots = np.sum(x * conds, axis=1)
+    if self._n_dimensions == 2:
+      # Cosine of the angle between each point and its condition
+      dots /= np.sqrt(np.sum(x ** 2, axis=1) * np.sum(conds ** 2, axis=1)) + \
+          consts.EPS
+    return self._get_log_normalizer() + self._kappa * dots
+
+  def samples_batch(self, conds):
+    """
+    Draw one sample for each of many conditions at once
+    :param conds: matrix of conditions (means), one per row. Need not be
+                  normalized
+    :returns: matrix of samples, one per row of conds
+    """
+    conds = self._verify_batch_shape(conds)
+    if np.any(np.isnan(conds)):
+      raise ValueError("NAN detected in conds")
+    norms = np.sqrt(np.sum(conds ** 2, axis=1))
+    if np.any(norms < consts.EPS):
+      raise ValueError("Cannot give lenth 0 vector")
+    mus = conds / norms[:, np.newaxis]
+    if self._n_dimensions == 2:
+      return self._sample_2d_batch(mus)
+    return self._sample_3d_batch(mus)
+
+  def eval_log_angles(self, angles, cond_angles):
+    """
+    Evaluate the log density of many points of a 2 dimensional distribution
+    given as angles rather than unit vectors
+    :param angles: angle of each point, in radians
+    :param cond_angles: angle of the condition (mean) of each point, or a
+                        single angle used for every point
+    :returns: vector holding the log density of each point
+    """
+    self._verify_angle_dimensions()
+    return self._get_log_normalizer() + \
+        self._kappa * np.cos(np.asarray(angles) - np.asarray(cond_angles))
+
+  def samples_angles(self, cond_angles):
+    """
+    Draw one sample for each of many conditions of a 2 dimensional
+    distribution, with conditions and samples given as angles
+    :param cond_angles: angle of each condition (mean), in radians
+    :returns: vector of sampled angles in [-pi, pi], of the same dtype as
+              cond_angles
+    """
+    self._verify_angle_dimensions()
+    cond_angles = np.asarray(cond_angles)
+    return np.random.vonmises(cond_angles, self._kappa).astype(cond_angles.dtype)
+
   def shape(self):
     return self._n_dimensions
 
@@ -97,6 +156,31 @@ class VonMisesCPdf(CPdf):
       x = x[:, 0]
     return x
 
+  def _verify_batch_shape(self, x):
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    if len(x.shape) > 2 or x.shape[1] != self._n_dimensions:
+      raise ValueError("Shape is not consistent with specified dimensions. " + \
+            "Expected shape (n, %d), but input has %s." % (self._n_dimensions, x.shape))
+    return x
+
+  def _verify_angle_dimensions(self):
+    if self._n_dimensions != 2:
+      raise ValueError("Angles can only be used with 2 dimensional von mises")
+
+  def _get_log_normalizer(self):
+    """
+    Get the log of the normalizing constant of the distribution. It is only
+    computed once for each kappa
+    """
+    if self._kappa not in self._log_normalizers:
+      if self._n_dimensions == 3:
+        log_norm = np.log(self._kappa) - np.log(2 * np.pi) - \
+            np.log(1 - np.exp(-2 * self._kappa)) - self._kappa
+      else:
+        log_norm = -np.log(2 * np.pi * sps.iv(0, self._kappa))
+      self._log_normalizers[self._kappa] = log_norm
+    return self._log_normalizers[self._kappa]
+
   def _ndims(self, x):
     return x.shape[0]
 
@@ -141,6 +225,33 @@ class VonMisesCPdf(CPdf):
       result = result[:, 0]
     return result
 
+  def _sample_2d_batch(self, mus):
+    """
+    Assumes each row of mus is a unit vector
+    """
+    theta = np.random.vonmises(np.arctan2(mus[:, 1], mus[:, 0]), self._kappa)
+    return np.array([np.cos(theta), np.sin(theta)]).T
+
+  def _sample_3d_batch(self, mus):
+    """
+    Assumes each row of mus is a unit vector. Samples are drawn about
+    e = [1, 0, 0] by Wood's algorithm, then each is reflected onto its mean
+    by the Householder reflection swapping e and the mean. The distribution
+    about e is symmetric, so the reflection acts as a rotation would
+    """
+    n = mus.shape[0]
+    u = np.random.rand(n)
+    W = 1. + (1. / self._kappa) * np.log(np.exp(-2 * self._kappa) * (1. - u) + u)
+    theta = np.random.rand(n) * 2 * np.pi
+    x = np.array([W, np.sqrt(1 - W**2) * np.cos(theta),
+                  np.sqrt(1 - W**2) * np.sin(theta)]).T
+    # Reflect about the plane normal to v = e - mu
+    v = -mus
+    v[:, 0] += 1.
+    v_norms = np.sum(v ** 2, axis=1)
+    scale = np.where(v_norms > consts.EPS, 2. / np.maximum(v_norms, consts.EPS), 0.)
+    return x - v * (scale * np.sum(v * x, axis=1))[:, np.newaxis]
+
   def _norm2(self, x):
     if len(x.shape) == 2 and x.shape[1] != 1 or len(x.shape) > 2:
       raise ValueError("x must be a vector")
@@ -7,12 +7,11 @@ import pybayes as pb
 import math
 import constants as consts
 import sys
-from trackinglocalizer import TrackingLocalizer
+from particletrackinglocalizer import ParticleTrackingLocalizer
 from pa_tools.vonmisescpdf import VonMisesCPdf
 from pa_tools.vonmisespdf import VonMisesPdf
-from pybayes import EmpPdf
 
-class VonMisesTrackingLocalizer(TrackingLocalizer):
+class VonMisesTrackingLocalizer(ParticleTrackingLocalizer):
 
   def __init__(self, n_particles, state_kappa, observation_kappa, outlier_prob=0, 
                *args, **kwargs):
@@ -30,11 +29,11 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
                          this is omitted, it will be set to 0, and the normal
                          particle filtering algorithm will be used
     
-    All other parameters will be passed to TrackingLocalizer in the form of *args
-    and **kwargs
+    All other parameters, such as max_particles, will be passed to
+    ParticleTrackingLocalizer in the form of *args and **kwargs
     """
-    TrackingLocalizer.__init__(self, *args, **kwargs)
-    self._grid_size = self._n_theta * self._n_phi
+    ParticleTrackingLocalizer.__init__(self, *args, **kwargs)
+    self._grid_size = self._n_directions
     #self._process_search_space(search_space)
     self._setup_particle_filters(n_particles, state_kappa, observation_kappa, outlier_prob)
 
@@ -44,16 +43,22 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
   #  self._tracking_plane = self._planes[0]
 
   def get_distribution(self, rffts):
-    d, energy = self.get_distribution_real(rffts, 'gcc')
-    maxind = np.argmax(d)
-    obs = self._directions[:, maxind]
-    obs = np.asarray(obs, dtype=float) # port audio uses 32, pybayes uses 64
-    if self._use_outlier_distribution():
-      self._weighted_bayes(obs)
+    obs, d, energy = self.get_peak(rffts, 'gcc')
+    if not self.is_active():
+      # Frame did not pass the activity gate. Nothing observed
+      self._predict()
     else:
-      self._bayes(obs)
+      obs = np.asarray(obs, dtype=float) # port audio uses 32, pybayes uses 64
+      # Only the components tracked by the particles are observed
+      obs = obs[:self._get_effective_n_dimensions()]
+      if self._use_outlier_distribution():
+        self._weighted_bayes(obs)
+      else:
+        self._bayes(obs)
     #self._particle_filter.bayes(obs)
     #self._posterior = self._particle_filter.posterior()
+    # Search around the tracked direction next frame (see LOCAL_SEARCH_HOPS)
+    self.set_search_prior(self._get_estimate())
     return self._posterior
 
   def _setup_particle_filters(self, n_particles, state_kappa, 
@@ -96,14 +101,14 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
       VonMisesPdf(self._outlier_mu, self._outlier_kappa, self._outlier_rv)
 
     # Do particle filtering ourselves...
-    self._posterior = EmpPdf(self._init_distribution.samples(self._n_particles))
+    self._setup_posterior(self._init_distribution, n_particles)
     self._estimate = self._get_estimate()
     self._count = 0
     # Create a set of weights for tracking the distribution p(c_t|x_t,y_{1:t})
     self._class_weights = np.array([.5, .5])
     # Matrix used to store weights for each particle for each class in order
     # to calculate class posterior weights and state posterior weights
-    self._joint_weights = np.ones((2, self._n_particles,)) 
+    self._joint_weights = np.ones((2, self._posterior.get_n_particles()))
 
     #self._particle_filter = pb.ParticleFilter(self._n_particles, 
     #                                          self._init_distribution, 
@@ -111,6 +116,14 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
     #                                          self._obs_distribution)
     #self._posterior = self._particle_filter.posterior()
                         
+  def _predict(self):
+    """
+    Prediction step only, for frames without an observation. Particles move
+    according to the state distribution and keep their weights
+    """
+    self._posterior.propagate(self._state_distribution)
+    self._estimate = self._get_estimate()
+
   def _bayes(self, yt):
     """
     Take care of particle filtering ourselves, otherwise we don't have easy access
@@ -118,16 +131,13 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
     """
     # resample -- do it here so that the weights will be available after one run
     # of inference.
-    self._posterior.resample()
-    for i in range(self._posterior.particles.shape[0]):
-      # generate new ith particle:
-      self._posterior.particles[i] = \
-        self._state_distribution.sample(self._posterior.particles[i])
-      # recompute ith weight:
-      self._posterior.weights[i] *= \
-        np.exp(self._obs_distribution.eval_log(yt, self._posterior.particles[i]))
-    # assure that weights are normalised
-    self._posterior.normalise_weights()
+    if self._needs_resample():
+      self._posterior.resample(inds=self._get_resample_indices())
+    # generate new particles:
+    self._posterior.propagate(self._state_distribution)
+    # recompute and normalise weights:
+    self._posterior.reweight(
+      self._posterior.get_log_likelihoods(self._obs_distribution, yt))
     return True
 
   def _weighted_bayes(self, yt):
@@ -137,63 +147,39 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
     data. Then weight the particles using this assumption
     """
     self._count += 1
-    if self._count % 1 == 0:
+    if self._needs_resample():
       self._weighted_resample()
-      #self._posterior.resample()
-    class_weight_sum = np.zeros((2,))
-    for i in range(self._posterior.particles.shape[0]):
-      # generate new ith particle:
-      self._posterior.particles[i] = \
-        self._state_distribution.sample(self._posterior.particles[i])
-      # recompute ith weight:
-      # Get likelihoods of classes p(y_t|c_t=j,x_t) for each class c_j
-      state_ll = self._obs_distribution.eval_log(yt, self._posterior.particles[i]) 
-      outlier_ll = self._outlier_distribution.eval_log(yt)
-      # calculate p(c_t=j|x_t,y_{1:t-1})
-      state_class_prob = np.log(1. - self._outlier_prob) + np.log(self._class_weights[0])
-      outlier_class_prob = np.log(self._outlier_prob) + np.log(self._class_weights[1])
-      # Class weights
-      self._joint_weights[0, i] = np.exp(state_ll + state_class_prob)
-      self._joint_weights[1, i] = np.exp(outlier_ll + outlier_class_prob)
-      class_weight_sum += self._joint_weights[:, i]
-      self._posterior.weights[i] *= np.sum(self._joint_weights[:, i])
-      # Now find p(c_j|x_t) = p(x_t|c_j)p(c_j) / p(x_t) for each class c_j
-      # First compute p(x_t, c_j) = p(x_t|c_j)p(c_j)
-      #state_particle_log_prob = \
-      #  self._obs_distribution.eval_log(self._posterior.particles[i], \
-      #          self._estimate) + np.log(1 - self._outlier_prob)
-      #outlier_particle_log_prob = \
-      #  self._outlir_distribution.eval_log(self._posterior.particles[i]) \
-      #          + np.log(self._outlier_prob)
-      ## Now compute p(x_t) = \sum_j p(x_t, c_j)
-      #total_particle_log_prob = np.log(np.exp(state_particle_log_prob) + \
-      #                          np.exp(outlier_particle_log_prob))
-      ## Finally compute the actual posteriors p(c_j|x_t)
-      #state_class_post = state_particle_log_prob - total_particle_log_prob
-      #outlier_class_post = outlier_particle_log_prob - total_particle_log_prob
-      ## Now compute total likelihood 
-      ## p(y_t|x_t) = sum_j p(y_t,c_j|x_t) = sum_j p(y_t|c_j,x_t)p(c_j|x_t)
-      ##total_likelihood = np.exp(state_ll + state_class_post) + \
-      ##                  np.exp(outlier_ll + outlier_class_post)
-      #total_likelihood = state_ll + np.log(1 - self._outlier_prob) + \
-      #                  outlier_ll + np.log(self._outlier_prob)
-      ## We want to calculate p(x_t,c_state|y_t) = p(x_t|c_0,y_t)p(c_0|y_t)
-      ## we have p(x_t|c_0,y_t) from above. Now calculate p(c_0|y_t)
-      ## p(c_0|y_t) \propto p(y_t|c_0)p(c_0)
-      #state_data_joint = self._obs_distribution.eval_log(yt, self._estimate) \
-      #    + np.log(1 - self._outlier_prob)
-      #outlier_data_joint = self._outlier_distribution.eval_log(yt) + \
-      #    np.log(self._outlier_prob)
-      #total_data_lhood = np.log(np.exp(state_data_joint) + np.exp(outlier_data_joint))
-      #state_class_data_post = state_data_joint - total_data_lhood
-      #outlier_class_data_post = outlier_data_joint - total_data_lhood
-      #self._posterior.weights[i] *= np.exp(state_ll + total_data_lhood)
-      #print "state: %f, outlier: %f, update: %f" %(eta_state, eta_outlier, weight_update)
+      #self._posterior.resample(self.RESAMPLE_METHOD)
+    # The class prior is the same every frame, whether or not it resamples
+    self._class_weights = np.array([.5, .5])
+    # generate new particles:
+    self._posterior.propagate(self._state_distribution)
+    # Get likelihoods of classes p(y_t|c_t=j,x_t) for each class c_j. The
+    # outlier likelihood does not depend on the particle
+    state_ll = self._posterior.get_log_likelihoods(self._obs_distribution, yt)
+    outlier_ll = self._outlier_distribution.eval_log(yt)
+    # calculate p(c_t=j|x_t,y_{1:t-1})
+    state_class_prob = np.log(1. - self._outlier_prob) + np.log(self._class_weights[0])
+    outlier_class_prob = np.log(self._outlier_prob) + np.log(self._class_weights[1])
+    # Class log likelihoods of each particle
+    log_class_lhoods = np.vstack((state_ll + state_class_prob,
+                                  (outlier_ll + outlier_class_prob) *
+                                  np.ones(state_ll.shape)))
+    # Scale by the largest likelihood so they do not underflow. The scale
+    # cancels when normalising
+    max_log = np.max(log_class_lhoods)
+    class_lhoods = np.exp(log_class_lhoods - max_log)
+    # Joint weights of class and particle include the weight of each
+    # particle before this frame, which is not uniform when the last frame
+    # did not resample
+    self._joint_weights = class_lhoods * self._posterior.weights
+    class_weight_sum = np.sum(self._joint_weights, axis=1)
+    with np.errstate(divide='ignore'):
+      self._posterior.reweight(np.log(np.sum(class_lhoods, axis=0)) + max_log)
     # assure that weights are normalised
     total_sum = np.sum(class_weight_sum)
     self._joint_weights /= (total_sum + consts.EPS)
     self._class_weights = class_weight_sum / (total_sum + consts.EPS)
-    self._posterior.normalise_weights()
     self._estimate = self._get_estimate()
 
   def _get_effective_n_dimensions(self):
@@ -202,9 +188,7 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
     return self._n_dimensions
 
   def _get_estimate(self):
-      w = np.asarray(self._posterior.weights)
-      parts = np.asarray(self._posterior.particles)
-      return w.dot(parts)
+      return self._posterior.mean()
 
   def get_joint_weights(self):
     return self._joint_weights.copy()
@@ -216,15 +200,13 @@ class VonMisesTrackingLocalizer(TrackingLocalizer):
     return self._outlier_prob > 0
 
   def _weighted_resample(self):
-    resample_idxs = self._posterior.get_resample_indices()
+    resample_idxs = self._get_resample_indices()
     # Resample particles and associated joint weights
-    np.asarray(self._posterior.particles)[:] = np.asarray(self._posterior.particles)[resample_idxs]
-    self._joint_weights[:, :] = self._joint_weights[:, resample_idxs]
+    self._posterior.resample(inds=resample_idxs)
+    self._joint_weights = self._joint_weights[:, resample_idxs]
     # Normalize joint weights -- ensures particle weights normalized
-    self._joint_weights /= (np.sum(self._joint_weights, axis=0) * self._n_particles)
-    self._posterior.weights[:] = 1. / self._n_particles
+    self._joint_weights /= (np.sum(self._joint_weights, axis=0) * len(resample_idxs))
     self._class_weights = np.sum(self._joint_weights, axis=1)
-    self._class_weights = np.array([.5, .5])
 
 
 